@@ -0,0 +1,18 @@
+from django.contrib import admin
+
+from .models import DeliveryPreference
+
+
+@admin.register(DeliveryPreference)
+class DeliveryPreferenceAdmin(admin.ModelAdmin):
+    list_display = (
+        "user",
+        "quiet_hours_start",
+        "quiet_hours_end",
+        "timezone",
+        "min_interval",
+    )
+    list_select_related = ("user",)
+    readonly_fields = ("last_delivered_at",)
+    raw_id_fields = ("user",)
+    search_fields = ("user__username",)
@@ -0,0 +1,214 @@
+"""Async sender for delivering many messages concurrently with grpc.aio."""
+
+import asyncio
+import atexit
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from discordproxy.discord_api_pb2 import Embed, SendDirectMessageRequest
+from discordproxy.discord_api_pb2_grpc import DiscordApiStub
+from grpc import aio
+
+from allianceauth.services.hooks import get_extension_logger
+from app_utils.logging import LoggerAddTag
+
+from . import __title__
+from .app_settings import DISCORDNOTIFY_SEND_TIMEOUT
+from .channels import channel_options
+from .circuitbreaker import CircuitOpenError
+from .core import ProxyRequest, SendResult
+from .ratelimit import rate_limiter
+
+logger = LoggerAddTag(get_extension_logger(__name__), __title__)
+
+
+class AioChannelPool:
+    """Long-lived grpc.aio channels to Discord Proxy, one per target.
+
+    Channels are bound to the event loop they are used on, so all requests run
+    on an event loop in a dedicated thread, which is started on first use.
+    Loop and channels belong to the process that started them,
+    so a forked child process starts its own.
+    """
+
+    def __init__(self) -> None:
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._channels: Dict[str, aio.Channel] = {}
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._channels)
+
+    def run(self, coro):
+        """Run a coroutine on the event loop of this pool and return its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self._start()).result()
+
+    def get(self, target: str) -> aio.Channel:
+        """Return the channel for a target. Will create it when needed.
+
+        Must be called from the event loop of this pool.
+        """
+        try:
+            return self._channels[target]
+        except KeyError:
+            channel = aio.insecure_channel(target, options=channel_options())
+            self._channels[target] = channel
+            logger.debug("Opened gRPC aio channel to %s", target)
+            return channel
+
+    def close(self, timeout: float = 5) -> None:
+        """Close all channels and stop the event loop of this process."""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            if not loop or self._pid != os.getpid():
+                return
+            self._loop = None
+            self._thread = None
+        try:
+            asyncio.run_coroutine_threadsafe(self._close_channels(), loop).result(
+                timeout
+            )
+        except Exception:
+            logger.exception("Failed to close gRPC aio channels")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        if not thread.is_alive():
+            loop.close()
+
+    def is_loop_thread(self) -> bool:
+        return self._thread is threading.current_thread()
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        """Return the event loop of this process and start it if needed."""
+        pid = os.getpid()
+        with self._lock:
+            if self._loop is None or self._pid != pid:
+                # channels inherited from the parent must not be used or closed here
+                self._channels = {}
+                self._pid = pid
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._run,
+                    args=(self._loop,),
+                    name="discordnotify-aio",
+                    daemon=True,
+                )
+                self._thread.start()
+            return self._loop
+
+    @staticmethod
+    def _run(loop: asyncio.AbstractEventLoop) -> None:
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    async def _close_channels(self) -> None:
+        for target, channel in self._channels.items():
+            await channel.close()
+            logger.debug("Closed gRPC aio channel to %s", target)
+        self._channels = {}
+
+
+aio_channel_pool = AioChannelPool()
+atexit.register(aio_channel_pool.close)
+
+
+def can_run() -> bool:
+    """Report whether the async sender can be run from the current thread.
+
+    That is not the case when an event loop is already running in this thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return not aio_channel_pool.is_loop_thread()
+    return False
+
+
+def send_messages_to_discord_users(
+    messages: List[Tuple[int, List[Embed]]],
+    concurrency: int,
+    high_priority: bool = False,
+) -> List[SendResult]:
+    """Send messages to Discord users with up to concurrency requests in flight.
+
+    Each message can consist of several embeds, which are sent in order.
+    Requests are sent over the long-lived channels of the aio channel pool.
+    Returns for each message the number of embeds sent and the error, if any.
+    """
+    return aio_channel_pool.run(
+        _send_messages_to_discord_users(messages, concurrency, high_priority)
+    )
+
+
+async def _send_messages_to_discord_users(
+    messages: List[Tuple[int, List[Embed]]], concurrency: int, high_priority: bool
+) -> List[SendResult]:
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    return await asyncio.gather(
+        *[
+            _send_embeds_to_discord_user(semaphore, discord_uid, embeds, high_priority)
+            for discord_uid, embeds in messages
+        ]
+    )
+
+
+async def _send_embeds_to_discord_user(
+    semaphore: asyncio.Semaphore,
+    discord_uid: int,
+    embeds: List[Embed],
+    high_priority: bool,
+) -> SendResult:
+    sent = 0
+    for embed in embeds:
+        error = await _send_message_to_discord_user(
+            semaphore, discord_uid, embed, high_priority
+        )
+        if error:
+            return SendResult(sent, error)
+        sent += 1
+    return SendResult(sent)
+
+
+async def _send_message_to_discord_user(
+    semaphore: asyncio.Semaphore,
+    discord_uid: int,
+    embed: Embed,
+    high_priority: bool,
+) -> Optional[Exception]:
+    """Send a message to a Discord user. Returns the error on failure.
+
+    Calls which may access Django's cache are run in the default executor,
+    so they do not block the other requests on the event loop.
+    """
+    loop = asyncio.get_event_loop()
+    request = SendDirectMessageRequest(user_id=discord_uid, embed=embed)
+    proxy_request = ProxyRequest(discord_uid, high_priority)
+    while True:
+        try:
+            await loop.run_in_executor(None, proxy_request.check)
+        except CircuitOpenError as ex:
+            return ex
+        await rate_limiter.acquire_async(discord_uid, high_priority)
+        async with semaphore:
+            target = proxy_request.acquire_target()
+            client = DiscordApiStub(aio_channel_pool.get(target))
+            started = time.monotonic()
+            try:
+                await client.SendDirectMessage(
+                    request, timeout=DISCORDNOTIFY_SEND_TIMEOUT
+                )
+            except Exception as ex:
+                should_retry = await loop.run_in_executor(
+                    None, proxy_request.failed, target, time.monotonic() - started, ex
+                )
+                if not should_retry:
+                    return ex
+            else:
+                await loop.run_in_executor(
+                    None, proxy_request.succeeded, target, time.monotonic() - started
+                )
+                return None
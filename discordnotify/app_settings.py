@@ -5,6 +5,39 @@ DISCORDNOTIFY_DISCORDPROXY_PORT = getattr(
     settings, "DISCORDNOTIFY_DISCORDPROXY_PORT", 50051
 )
 
+# Addresses of Discord Proxy instances as "host:port".
+# Uses localhost with DISCORDNOTIFY_DISCORDPROXY_PORT when empty
+DISCORDNOTIFY_DISCORDPROXY_TARGETS = getattr(
+    settings, "DISCORDNOTIFY_DISCORDPROXY_TARGETS", []
+)
+
+# How requests are balanced between Discord Proxy instances:
+# "round_robin" or "least_outstanding"
+DISCORDNOTIFY_DISCORDPROXY_BALANCING = getattr(
+    settings, "DISCORDNOTIFY_DISCORDPROXY_BALANCING", "round_robin"
+)
+
+# Number of consecutive failed requests after which
+# a Discord Proxy instance is ejected from balancing
+DISCORDNOTIFY_DISCORDPROXY_EJECTION_THRESHOLD = getattr(
+    settings, "DISCORDNOTIFY_DISCORDPROXY_EJECTION_THRESHOLD", 3
+)
+
+# Time in seconds an ejected Discord Proxy instance receives no requests
+DISCORDNOTIFY_DISCORDPROXY_EJECTION_TIME = getattr(
+    settings, "DISCORDNOTIFY_DISCORDPROXY_EJECTION_TIME", 30
+)
+
+# Interval in seconds for keepalive pings on active connections to Discord Proxy
+DISCORDNOTIFY_DISCORDPROXY_KEEPALIVE_TIME = getattr(
+    settings, "DISCORDNOTIFY_DISCORDPROXY_KEEPALIVE_TIME", 60
+)
+
+# Timeout in seconds for keepalive pings, after which a connection is considered dead
+DISCORDNOTIFY_DISCORDPROXY_KEEPALIVE_TIMEOUT = getattr(
+    settings, "DISCORDNOTIFY_DISCORDPROXY_KEEPALIVE_TIMEOUT", 20
+)
+
 # When set to True, only superusers will be get their notifications forwarded
 DISCORDNOTIFY_SUPERUSER_ONLY = getattr(settings, "DISCORDNOTIFY_SUPERUSER_ONLY", False)
 
@@ -14,3 +47,233 @@ DISCORDNOTIFY_ENABLED = getattr(settings, "DISCORDNOTIFY_ENABLED", True)
 # When set True will mark all notifications as read
 # that have been successfully submitted to Discord
 DISCORDNOTIFY_MARK_AS_VIEWED = getattr(settings, "DISCORDNOTIFY_MARK_AS_VIEWED", False)
+
+# Max number of notifications forwarded by one task
+DISCORDNOTIFY_BATCH_SIZE = getattr(settings, "DISCORDNOTIFY_BATCH_SIZE", 100)
+
+# Time window in seconds for collecting new notifications into one batch.
+# Set to 0 to dispatch new notifications immediately.
+DISCORDNOTIFY_BATCH_WINDOW = getattr(settings, "DISCORDNOTIFY_BATCH_WINDOW", 0)
+
+# Max number of concurrent requests to Discord Proxy when forwarding a batch
+DISCORDNOTIFY_SEND_CONCURRENCY = getattr(settings, "DISCORDNOTIFY_SEND_CONCURRENCY", 10)
+
+# When enabled batches are sent with asyncio,
+# else they are sent with threads by the sync sender
+DISCORDNOTIFY_ASYNC_SENDER = getattr(settings, "DISCORDNOTIFY_ASYNC_SENDER", True)
+
+# Max number of users for which the Discord UID is cached per process.
+# Set to 0 to disable the local cache.
+DISCORDNOTIFY_UID_CACHE_SIZE = getattr(settings, "DISCORDNOTIFY_UID_CACHE_SIZE", 10000)
+
+# Timeout in seconds for cached Discord UIDs
+DISCORDNOTIFY_UID_CACHE_TIMEOUT = getattr(
+    settings, "DISCORDNOTIFY_UID_CACHE_TIMEOUT", 300
+)
+
+# When enabled cached Discord UIDs are also stored in Django's cache
+# and shared between all processes
+DISCORDNOTIFY_UID_CACHE_SHARED = getattr(
+    settings, "DISCORDNOTIFY_UID_CACHE_SHARED", False
+)
+
+# Set this to False to disable pacing of requests to Discord Proxy
+DISCORDNOTIFY_RATE_LIMIT_ENABLED = getattr(
+    settings, "DISCORDNOTIFY_RATE_LIMIT_ENABLED", True
+)
+
+# Max number of requests per second to Discord Proxy
+DISCORDNOTIFY_RATE_LIMIT_GLOBAL = getattr(
+    settings, "DISCORDNOTIFY_RATE_LIMIT_GLOBAL", 40
+)
+
+# Max number of messages per DM channel within DISCORDNOTIFY_RATE_LIMIT_PER_USER_PERIOD
+DISCORDNOTIFY_RATE_LIMIT_PER_USER = getattr(
+    settings, "DISCORDNOTIFY_RATE_LIMIT_PER_USER", 5
+)
+
+# Period in seconds for DISCORDNOTIFY_RATE_LIMIT_PER_USER
+DISCORDNOTIFY_RATE_LIMIT_PER_USER_PERIOD = getattr(
+    settings, "DISCORDNOTIFY_RATE_LIMIT_PER_USER_PERIOD", 5
+)
+
+# Max number of retries for a message after it was rate limited by Discord
+DISCORDNOTIFY_RATE_LIMIT_RETRIES = getattr(
+    settings, "DISCORDNOTIFY_RATE_LIMIT_RETRIES", 3
+)
+
+# When enabled rate limits are tracked in Django's cache and shared by all workers,
+# else they are tracked per process
+DISCORDNOTIFY_RATE_LIMIT_SHARED = getattr(
+    settings, "DISCORDNOTIFY_RATE_LIMIT_SHARED", True
+)
+
+# Max number of retries for notifications that failed with a transient error
+DISCORDNOTIFY_MAX_RETRIES = getattr(settings, "DISCORDNOTIFY_MAX_RETRIES", 5)
+
+# Base delay in seconds for retrying failed notifications,
+# which is doubled with every attempt
+DISCORDNOTIFY_RETRY_BACKOFF = getattr(settings, "DISCORDNOTIFY_RETRY_BACKOFF", 10)
+
+# Max delay in seconds for retrying failed notifications
+DISCORDNOTIFY_RETRY_BACKOFF_MAX = getattr(
+    settings, "DISCORDNOTIFY_RETRY_BACKOFF_MAX", 600
+)
+
+# When enabled all notifications for the same user within one batch
+# are combined into one message. See also DISCORDNOTIFY_BATCH_WINDOW.
+DISCORDNOTIFY_DIGEST_ENABLED = getattr(settings, "DISCORDNOTIFY_DIGEST_ENABLED", False)
+
+# Set this to False to disable collecting metrics
+DISCORDNOTIFY_METRICS_ENABLED = getattr(settings, "DISCORDNOTIFY_METRICS_ENABLED", True)
+
+# When enabled metrics of all processes are aggregated in Django's cache,
+# else every process only reports its own metrics
+DISCORDNOTIFY_METRICS_SHARED = getattr(settings, "DISCORDNOTIFY_METRICS_SHARED", True)
+
+# Token for accessing the metrics view without login as bearer token
+DISCORDNOTIFY_METRICS_TOKEN = getattr(settings, "DISCORDNOTIFY_METRICS_TOKEN", "")
+
+# Notifications with these levels are forwarded in the high priority lane
+DISCORDNOTIFY_PRIORITY_LEVELS = getattr(
+    settings, "DISCORDNOTIFY_PRIORITY_LEVELS", ["danger"]
+)
+
+# Notifications for members of these groups are forwarded in the high priority lane
+DISCORDNOTIFY_PRIORITY_GROUPS = getattr(settings, "DISCORDNOTIFY_PRIORITY_GROUPS", [])
+
+# Notifications with a title matching this regular expression
+# are forwarded in the high priority lane
+DISCORDNOTIFY_PRIORITY_TITLE_PATTERN = getattr(
+    settings, "DISCORDNOTIFY_PRIORITY_TITLE_PATTERN", ""
+)
+
+# Celery queue for tasks of the high priority lane. Uses the default queue if not set.
+DISCORDNOTIFY_PRIORITY_QUEUE = getattr(settings, "DISCORDNOTIFY_PRIORITY_QUEUE", "")
+
+# Celery queue for tasks of the normal lane. Uses the default queue if not set.
+DISCORDNOTIFY_BULK_QUEUE = getattr(settings, "DISCORDNOTIFY_BULK_QUEUE", "")
+
+# Requests per second of the global rate limit,
+# which are reserved for the high priority lane
+DISCORDNOTIFY_RATE_LIMIT_PRIORITY_RESERVED = getattr(
+    settings, "DISCORDNOTIFY_RATE_LIMIT_PRIORITY_RESERVED", 5
+)
+
+# When enabled only IDs of notifications are passed to tasks
+# and their content is loaded from the database by the worker
+DISCORDNOTIFY_COMPACT_PAYLOADS = getattr(
+    settings, "DISCORDNOTIFY_COMPACT_PAYLOADS", False
+)
+
+# Identical notifications for the same user are only forwarded once
+# within this time in seconds. Set to 0 to disable.
+DISCORDNOTIFY_DEDUP_TIMEOUT = getattr(settings, "DISCORDNOTIFY_DEDUP_TIMEOUT", 0)
+
+# When enabled the next forwarded notification shows
+# how often it was suppressed as duplicate
+DISCORDNOTIFY_DEDUP_COUNTER = getattr(settings, "DISCORDNOTIFY_DEDUP_COUNTER", True)
+
+# When enabled forwarded notifications are tracked in Django's cache
+# and shared by all workers, else they are tracked per process
+DISCORDNOTIFY_DEDUP_SHARED = getattr(settings, "DISCORDNOTIFY_DEDUP_SHARED", True)
+
+# Timeout in seconds for requests to Discord Proxy
+DISCORDNOTIFY_SEND_TIMEOUT = getattr(settings, "DISCORDNOTIFY_SEND_TIMEOUT", 10)
+
+# Number of consecutive failed requests after which Discord Proxy is considered down
+# and no further requests are made for a while. Set to 0 to disable.
+DISCORDNOTIFY_CIRCUIT_BREAKER_THRESHOLD = getattr(
+    settings, "DISCORDNOTIFY_CIRCUIT_BREAKER_THRESHOLD", 5
+)
+
+# Time in seconds after which a single request tries
+# whether Discord Proxy is available again
+DISCORDNOTIFY_CIRCUIT_BREAKER_RESET_TIMEOUT = getattr(
+    settings, "DISCORDNOTIFY_CIRCUIT_BREAKER_RESET_TIMEOUT", 30
+)
+
+# When enabled the state of the circuit breaker is kept in Django's cache
+# and shared by all workers, else it is kept per process
+DISCORDNOTIFY_CIRCUIT_BREAKER_SHARED = getattr(
+    settings, "DISCORDNOTIFY_CIRCUIT_BREAKER_SHARED", True
+)
+
+# When enabled the outcome of forwarding every notification is stored
+DISCORDNOTIFY_DELIVERY_LOG_ENABLED = getattr(
+    settings, "DISCORDNOTIFY_DELIVERY_LOG_ENABLED", False
+)
+
+# Number of days delivery records are kept
+DISCORDNOTIFY_DELIVERY_LOG_RETENTION = getattr(
+    settings, "DISCORDNOTIFY_DELIVERY_LOG_RETENTION", 30
+)
+
+# When enabled non-urgent notifications are held back
+# according to the delivery preferences of users
+DISCORDNOTIFY_SCHEDULER_ENABLED = getattr(
+    settings, "DISCORDNOTIFY_SCHEDULER_ENABLED", False
+)
+
+# Max number of held notifications released by one run of the periodic task
+DISCORDNOTIFY_SCHEDULER_RELEASE_LIMIT = getattr(
+    settings, "DISCORDNOTIFY_SCHEDULER_RELEASE_LIMIT", 5000
+)
+
+# Max number of messages a long notification is split into.
+# The last message is truncated when a notification is longer.
+DISCORDNOTIFY_MAX_MESSAGE_PARTS = getattr(
+    settings, "DISCORDNOTIFY_MAX_MESSAGE_PARTS", 3
+)
+
+# Rules for routing notifications. Each rule is a dict with the conditions
+# "levels", "groups", "states" and "title" (regex) and an "action":
+# "forward", "drop", "digest" or "redirect" (with "channel").
+# The first matching rule wins. Notifications matching no rule are forwarded.
+DISCORDNOTIFY_RULES = getattr(settings, "DISCORDNOTIFY_RULES", [])
+
+# Timeout in seconds for cached group memberships and states of users
+DISCORDNOTIFY_MEMBERSHIP_CACHE_TIMEOUT = getattr(
+    settings, "DISCORDNOTIFY_MEMBERSHIP_CACHE_TIMEOUT", 300
+)
+
+# ID of the Discord channel for broadcasts. Identical notifications
+# for many users are posted once to this channel instead of as DMs.
+# Set to 0 to disable.
+DISCORDNOTIFY_BROADCAST_CHANNEL = getattr(
+    settings, "DISCORDNOTIFY_BROADCAST_CHANNEL", 0
+)
+
+# Min number of users who need to get an identical notification
+# within DISCORDNOTIFY_BROADCAST_WINDOW for it to become a broadcast
+DISCORDNOTIFY_BROADCAST_MIN_USERS = getattr(
+    settings, "DISCORDNOTIFY_BROADCAST_MIN_USERS", 25
+)
+
+# Time window in seconds for collecting identical notifications into a broadcast
+DISCORDNOTIFY_BROADCAST_WINDOW = getattr(settings, "DISCORDNOTIFY_BROADCAST_WINDOW", 5)
+
+# IDs of Discord roles mentioned in broadcasts
+DISCORDNOTIFY_BROADCAST_ROLES = getattr(settings, "DISCORDNOTIFY_BROADCAST_ROLES", [])
+
+# When enabled notifications are forwarded by background threads
+# of the process which created them instead of by Celery tasks.
+# Retries and jobs rejected by a full queue are still handled by Celery.
+DISCORDNOTIFY_INPROCESS_ENABLED = getattr(
+    settings, "DISCORDNOTIFY_INPROCESS_ENABLED", False
+)
+
+# Number of background threads for in-process delivery
+DISCORDNOTIFY_INPROCESS_WORKERS = getattr(
+    settings, "DISCORDNOTIFY_INPROCESS_WORKERS", 2
+)
+
+# Max number of batches waiting for in-process delivery
+DISCORDNOTIFY_INPROCESS_QUEUE_SIZE = getattr(
+    settings, "DISCORDNOTIFY_INPROCESS_QUEUE_SIZE", 100
+)
+
+# Max time in seconds for delivering queued batches when the process shuts down
+DISCORDNOTIFY_INPROCESS_DRAIN_TIMEOUT = getattr(
+    settings, "DISCORDNOTIFY_INPROCESS_DRAIN_TIMEOUT", 10
+)
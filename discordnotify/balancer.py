@@ -0,0 +1,174 @@
+"""Balancing of requests between multiple Discord Proxy instances."""
+
+import json
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+import grpc
+
+from allianceauth.services.hooks import get_extension_logger
+from app_utils.logging import LoggerAddTag
+
+from . import __title__
+from .app_settings import (
+    DISCORDNOTIFY_DISCORDPROXY_BALANCING,
+    DISCORDNOTIFY_DISCORDPROXY_EJECTION_THRESHOLD,
+    DISCORDNOTIFY_DISCORDPROXY_EJECTION_TIME,
+    DISCORDNOTIFY_DISCORDPROXY_PORT,
+    DISCORDNOTIFY_DISCORDPROXY_TARGETS,
+)
+from .circuitbreaker import is_failure
+
+logger = LoggerAddTag(get_extension_logger(__name__), __title__)
+
+ROUND_ROBIN = "round_robin"
+LEAST_OUTSTANDING = "least_outstanding"
+
+
+def _has_proxy_details(error: grpc.RpcError) -> bool:
+    """Report whether an error has details from Discord Proxy."""
+    try:
+        details = json.loads(error.details())
+    except (TypeError, ValueError):
+        return False
+    return isinstance(details, dict)
+
+
+def discordproxy_targets() -> List[str]:
+    """Return the addresses of all Discord Proxy instances."""
+    if DISCORDNOTIFY_DISCORDPROXY_TARGETS:
+        return list(DISCORDNOTIFY_DISCORDPROXY_TARGETS)
+    return [f"localhost:{DISCORDNOTIFY_DISCORDPROXY_PORT}"]
+
+
+class ProxyBalancer:
+    """Chooses the Discord Proxy instance for each request.
+
+    Targets are chosen in turn (round_robin) or by the lowest number of
+    requests in flight from this process (least_outstanding).
+    A target is ejected for ejection_time seconds after ejection_threshold
+    consecutive failed requests. When all targets are ejected,
+    requests are balanced between all of them again.
+    """
+
+    def __init__(
+        self,
+        targets: Iterable[str],
+        strategy: str = ROUND_ROBIN,
+        ejection_threshold: int = 3,
+        ejection_time: float = 30,
+    ) -> None:
+        self.targets = list(targets)
+        if not self.targets:
+            raise ValueError("Need at least one target")
+        if strategy not in {ROUND_ROBIN, LEAST_OUTSTANDING}:
+            raise ValueError(f"Unknown balancing strategy: {strategy}")
+        self.strategy = strategy
+        self.ejection_threshold = ejection_threshold
+        self.ejection_time = ejection_time
+        self._outstanding: Dict[str, int] = {target: 0 for target in self.targets}
+        self._failures: Dict[str, int] = {target: 0 for target in self.targets}
+        self._ejected_until: Dict[str, float] = {}
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, exclude: Iterable[str] = ()) -> str:
+        """Choose a target for the next request and count it as outstanding.
+
+        Targets in exclude are only chosen when there is no other.
+        Every call must be followed by a call to release().
+        """
+        with self._lock:
+            target = self._choose(self._candidates(set(exclude)))
+            self._outstanding[target] += 1
+            return target
+
+    def release(self, target: str, error: Optional[Exception] = None) -> None:
+        """Record the result of a request to a target.
+
+        Errors with details were reported by Discord Proxy itself,
+        which shows that the target is available.
+        """
+        with self._lock:
+            self._outstanding[target] -= 1
+            if not is_failure(error) or _has_proxy_details(error):
+                self._failures[target] = 0
+                self._ejected_until.pop(target, None)
+                return
+            self._failures[target] += 1
+            if (
+                self.ejection_threshold > 0
+                and self._failures[target] >= self.ejection_threshold
+            ):
+                if target not in self._ejected_until:
+                    logger.warning(
+                        "Discord Proxy at %s is not available. "
+                        "Ejecting it for %s seconds.",
+                        target,
+                        self.ejection_time,
+                    )
+                self._ejected_until[target] = time.monotonic() + self.ejection_time
+
+    def can_failover(self, error: Exception, tried: Iterable[str]) -> bool:
+        """Report whether a failed request should be made again with another target.
+
+        This is only safe when the request never reached Discord Proxy,
+        i.e. when it failed with UNAVAILABLE from the connection.
+        Discord Proxy itself also reports some errors from Discord
+        (e.g. HTTP 502) as UNAVAILABLE with details.
+        Those requests may have been delivered and are not made again.
+        """
+        return (
+            isinstance(error, grpc.RpcError)
+            and error.code() == grpc.StatusCode.UNAVAILABLE
+            and not _has_proxy_details(error)
+            and len(set(tried)) < len(self.targets)
+        )
+
+    def is_ejected(self, target: str) -> bool:
+        with self._lock:
+            return self._ejected_until.get(target, 0) > time.monotonic()
+
+    def outstanding(self, target: str) -> int:
+        with self._lock:
+            return self._outstanding[target]
+
+    def _candidates(self, exclude: set) -> List[str]:
+        now = time.monotonic()
+        healthy = [
+            target
+            for target in self.targets
+            if self._ejected_until.get(target, 0) <= now
+        ]
+        for targets in (
+            [target for target in healthy if target not in exclude],
+            [target for target in self.targets if target not in exclude],
+            healthy,
+        ):
+            if targets:
+                return targets
+        return self.targets
+
+    def _choose(self, candidates: List[str]) -> str:
+        # targets are tried in turn starting after the last chosen one,
+        # which also breaks ties for least_outstanding
+        num_targets = len(self.targets)
+        ordered = sorted(
+            candidates,
+            key=lambda target: (self.targets.index(target) - self._next) % num_targets,
+        )
+        if self.strategy == LEAST_OUTSTANDING:
+            target = min(ordered, key=lambda target: self._outstanding[target])
+        else:
+            target = ordered[0]
+        self._next = (self.targets.index(target) + 1) % num_targets
+        return target
+
+
+proxy_balancer = ProxyBalancer(
+    targets=discordproxy_targets(),
+    strategy=DISCORDNOTIFY_DISCORDPROXY_BALANCING,
+    ejection_threshold=DISCORDNOTIFY_DISCORDPROXY_EJECTION_THRESHOLD,
+    ejection_time=DISCORDNOTIFY_DISCORDPROXY_EJECTION_TIME,
+)
@@ -0,0 +1,300 @@
+"""Collecting new notifications into batches for forwarding."""
+
+import atexit
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from allianceauth.services.hooks import get_extension_logger
+from app_utils.logging import LoggerAddTag
+
+from . import __title__
+from .app_settings import (
+    DISCORDNOTIFY_BATCH_SIZE,
+    DISCORDNOTIFY_BATCH_WINDOW,
+    DISCORDNOTIFY_BROADCAST_CHANNEL,
+    DISCORDNOTIFY_BROADCAST_MIN_USERS,
+    DISCORDNOTIFY_BROADCAST_WINDOW,
+)
+from .core import NotificationPayload
+from .tasks import start_broadcast_task, start_forwarding_task
+
+logger = LoggerAddTag(get_extension_logger(__name__), __title__)
+
+
+class NotificationBatcher:
+    """Collects notification payloads and dispatches them in batches.
+
+    A batch is dispatched once it has reached max_size
+    or when the time window has elapsed since its first payload was added.
+    With a window of 0 every payload is dispatched immediately.
+    """
+
+    def __init__(
+        self,
+        dispatch: Callable[[List[NotificationPayload]], None],
+        max_size: int,
+        window: float,
+    ) -> None:
+        self.dispatch = dispatch
+        self.max_size = max(1, int(max_size))
+        self.window = window
+        self._payloads: List[NotificationPayload] = []
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._payloads)
+
+    def add(self, payload: NotificationPayload) -> None:
+        self.extend([payload])
+
+    def extend(self, payloads: List[NotificationPayload]) -> None:
+        """Add payloads and dispatch all batches that are ready."""
+        batches = []
+        with self._lock:
+            self._payloads.extend(payloads)
+            while len(self._payloads) >= self.max_size:
+                batches.append(self._payloads[: self.max_size])
+                self._payloads = self._payloads[self.max_size :]
+            if self._payloads:
+                if self.window <= 0:
+                    batches.append(self._payloads)
+                    self._payloads = []
+                elif not self._timer:
+                    self._timer = threading.Timer(self.window, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+            if not self._payloads:
+                self._cancel_timer()
+        for batch in batches:
+            self._dispatch(batch)
+
+    def flush(self) -> None:
+        """Dispatch all pending payloads now."""
+        with self._lock:
+            batch = self._payloads
+            self._payloads = []
+            self._cancel_timer()
+        if batch:
+            self._dispatch(batch)
+
+    def _cancel_timer(self) -> None:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    def _dispatch(self, batch: List[NotificationPayload]) -> None:
+        logger.debug("Dispatching batch of %d notifications", len(batch))
+        try:
+            self.dispatch(batch)
+        except Exception:
+            logger.exception("Failed to dispatch batch of %d notifications", len(batch))
+
+
+class BroadcastDetector:
+    """Detects identical notifications for many users
+    and collapses them into one broadcast.
+
+    Payloads with the same title, message and level are collected
+    for the time window after the first of them was added.
+    When they are for at least min_users users they are dispatched as broadcast,
+    else they are passed on to forward.
+    Identical payloads arriving within the time window after a broadcast
+    are dispatched as part of it without posting it again.
+    """
+
+    def __init__(
+        self,
+        forward: Callable[[List[NotificationPayload]], None],
+        broadcast: Callable[[List[NotificationPayload], bool], None],
+        min_users: int,
+        window: float,
+        enabled: bool = True,
+    ) -> None:
+        self.forward = forward
+        self.broadcast = broadcast
+        self.min_users = max(2, int(min_users))
+        self.window = window
+        self.enabled = enabled and window > 0
+        # pending payloads by key with deadline and whether already posted
+        self._pending = OrderedDict()
+        self._posted: Dict[tuple, float] = {}
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return sum(len(payloads) for _, payloads, _ in self._pending.values())
+
+    @staticmethod
+    def key(payload: NotificationPayload) -> tuple:
+        return payload.title, payload.message, payload.level
+
+    def extend(self, payloads: List[NotificationPayload]) -> None:
+        if not self.enabled:
+            self.forward(payloads)
+            return
+        with self._lock:
+            now = time.monotonic()
+            for payload in payloads:
+                key = self.key(payload)
+                try:
+                    self._pending[key][1].append(payload)
+                except KeyError:
+                    posted = self._posted.get(key, 0) > now
+                    self._pending[key] = (now + self.window, [payload], posted)
+            if self._pending and not self._timer:
+                self._start_timer(now)
+
+    def flush(self, force: bool = True) -> None:
+        """Dispatch pending payloads. Only those due unless forced."""
+        due = []
+        with self._lock:
+            now = time.monotonic()
+            for key in list(self._pending.keys()):
+                deadline = self._pending[key][0]
+                if force or deadline <= now:
+                    due.append((key, self._pending.pop(key)))
+            self._cancel_timer()
+            if self._pending:
+                self._start_timer(now)
+            for key, (_, payloads, posted) in due:
+                if not posted and self._is_broadcast(payloads):
+                    self._posted[key] = now + self.window
+            self._posted = {
+                key: until for key, until in self._posted.items() if until > now
+            }
+        for key, (_, payloads, posted) in due:
+            if posted:
+                self._dispatch(self.broadcast, payloads, False)
+            elif self._is_broadcast(payloads):
+                self._dispatch(self.broadcast, payloads, True)
+            else:
+                self._dispatch(self.forward, payloads)
+
+    def _is_broadcast(self, payloads: List[NotificationPayload]) -> bool:
+        return len({payload.discord_uid for payload in payloads}) >= self.min_users
+
+    def _start_timer(self, now: float) -> None:
+        """Start timer for the oldest pending key, which is due first."""
+        deadline = next(iter(self._pending.values()))[0]
+        self._timer = threading.Timer(
+            max(0, deadline - now), self.flush, kwargs={"force": False}
+        )
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _cancel_timer(self) -> None:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    @staticmethod
+    def _dispatch(func: Callable, payloads: List[NotificationPayload], *args) -> None:
+        try:
+            func(payloads, *args)
+        except Exception:
+            logger.exception("Failed to dispatch %d notifications", len(payloads))
+
+
+class OnCommitCollector:
+    """Collects objects created in transactions
+    and processes all of them together once the transaction is committed.
+
+    Every object gets its own on-commit callback, so Django discards
+    the objects of transactions and savepoints that are rolled back.
+    Callbacks are only referenced weakly here and go away when discarded.
+    The last pending callback run after a commit processes all collected objects.
+    Objects created outside of a transaction are processed immediately.
+    """
+
+    def __init__(self, process: Callable[[list], None], using: str = None) -> None:
+        self.process = process
+        self.using = using or DEFAULT_DB_ALIAS
+        self._local = threading.local()
+
+    def add(self, obj) -> None:
+        if not transaction.get_connection(self.using).in_atomic_block:
+            self.process([obj])
+            return
+        callback = _CommitCallback(self, obj)
+        self._state().callbacks.add(callback)
+        transaction.on_commit(callback, using=self.using)
+
+    def _committed(self, callback: "_CommitCallback", obj) -> None:
+        state = self._state()
+        state.callbacks.discard(callback)
+        state.objs.append(obj)
+        if not state.callbacks:
+            objs, state.objs = state.objs, []
+            self.process(objs)
+
+    def _state(self) -> threading.local:
+        if not hasattr(self._local, "callbacks"):
+            self._local.callbacks = weakref.WeakSet()
+            self._local.objs = []
+        return self._local
+
+
+class _CommitCallback:
+    """On-commit callback for an object of an OnCommitCollector.
+
+    Must not be referenced by the object or the collector,
+    so it is freed as soon as Django discards it.
+    """
+
+    __slots__ = ("collector", "obj", "__weakref__")
+
+    def __init__(self, collector: OnCommitCollector, obj) -> None:
+        self.collector = collector
+        self.obj = obj
+
+    def __call__(self) -> None:
+        self.collector._committed(self, self.obj)
+
+
+def _dispatch_to_task(batch: List[NotificationPayload]) -> None:
+    start_forwarding_task(batch)
+
+
+def _dispatch_to_priority_task(batch: List[NotificationPayload]) -> None:
+    start_forwarding_task(batch, high_priority=True)
+
+
+def _dispatch_to_digest_task(batch: List[NotificationPayload]) -> None:
+    start_forwarding_task(batch, digest=True)
+
+
+notification_batcher = NotificationBatcher(
+    dispatch=_dispatch_to_task,
+    max_size=DISCORDNOTIFY_BATCH_SIZE,
+    window=DISCORDNOTIFY_BATCH_WINDOW,
+)
+atexit.register(notification_batcher.flush)
+
+# high priority notifications are dispatched immediately
+priority_batcher = NotificationBatcher(
+    dispatch=_dispatch_to_priority_task, max_size=DISCORDNOTIFY_BATCH_SIZE, window=0
+)
+
+# notifications routed to digests by rules
+digest_batcher = NotificationBatcher(
+    dispatch=_dispatch_to_digest_task,
+    max_size=DISCORDNOTIFY_BATCH_SIZE,
+    window=DISCORDNOTIFY_BATCH_WINDOW,
+)
+atexit.register(digest_batcher.flush)
+
+# identical notifications for many users are posted once to a channel
+broadcast_detector = BroadcastDetector(
+    forward=notification_batcher.extend,
+    broadcast=start_broadcast_task,
+    min_users=DISCORDNOTIFY_BROADCAST_MIN_USERS,
+    window=DISCORDNOTIFY_BROADCAST_WINDOW,
+    enabled=bool(DISCORDNOTIFY_BROADCAST_CHANNEL),
+)
+atexit.register(broadcast_detector.flush)
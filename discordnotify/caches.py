@@ -0,0 +1,218 @@
+"""Caches for speeding up the processing of new notifications."""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, NamedTuple, Optional
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from allianceauth.services.modules.discord.models import DiscordUser
+
+from .app_settings import (
+    DISCORDNOTIFY_MEMBERSHIP_CACHE_TIMEOUT,
+    DISCORDNOTIFY_UID_CACHE_SHARED,
+    DISCORDNOTIFY_UID_CACHE_SIZE,
+    DISCORDNOTIFY_UID_CACHE_TIMEOUT,
+)
+from .metrics import uid_cache_hits, uid_cache_misses
+
+# marks users without a Discord account in the cache
+NO_ACCOUNT = 0
+
+
+class DiscordUidCache:
+    """Bounded LRU cache mapping user IDs to Discord UIDs.
+
+    Users without a Discord account are cached as NO_ACCOUNT.
+    Hits and misses are counted in the metrics,
+    with every user ID that had to be fetched from the database as miss.
+    Can optionally be backed by Django's cache, so all processes share entries.
+
+    Entries are invalidated by signals in the current process and in Django's cache.
+    Entries cached locally by other processes expire after the timeout.
+    """
+
+    CACHE_KEY_PREFIX = "DISCORDNOTIFY_DISCORD_UID"
+
+    def __init__(self, max_size: int, timeout: int, shared: bool = False) -> None:
+        self.max_size = max_size
+        self.timeout = timeout
+        self.shared = shared
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get_many(self, user_ids: Iterable[int]) -> Dict[int, int]:
+        """Return Discord UIDs for given user IDs. Will query missing ones."""
+        user_ids = set(user_ids)
+        result = self._get_local(user_ids)
+        missing_ids = user_ids - result.keys()
+        if missing_ids and self.shared:
+            shared = self._get_shared(missing_ids)
+            self._set_local(shared)
+            result.update(shared)
+            missing_ids -= shared.keys()
+        uid_cache_hits.inc(len(user_ids) - len(missing_ids))
+        uid_cache_misses.inc(len(missing_ids))
+        if missing_ids:
+            fetched = dict.fromkeys(missing_ids, NO_ACCOUNT)
+            fetched.update(
+                DiscordUser.objects.filter(user_id__in=missing_ids).values_list(
+                    "user_id", "uid"
+                )
+            )
+            self._set_local(fetched)
+            if self.shared:
+                cache.set_many(
+                    {self._make_key(key): value for key, value in fetched.items()},
+                    timeout=self.timeout,
+                )
+            result.update(fetched)
+        return result
+
+    def get(self, user_id: int) -> Optional[int]:
+        """Return Discord UID for a user or None if he has no Discord account."""
+        return self.get_many([user_id])[user_id] or None
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._data.pop(user_id, None)
+        if self.shared:
+            cache.delete(self._make_key(user_id))
+
+    def clear(self) -> None:
+        """Clear the local cache."""
+        with self._lock:
+            self._data.clear()
+
+    def _get_local(self, user_ids: set) -> Dict[int, int]:
+        result = {}
+        now = time.monotonic()
+        with self._lock:
+            for user_id in user_ids:
+                try:
+                    discord_uid, expires_at = self._data[user_id]
+                except KeyError:
+                    continue
+                if expires_at < now:
+                    del self._data[user_id]
+                    continue
+                self._data.move_to_end(user_id)
+                result[user_id] = discord_uid
+        return result
+
+    def _set_local(self, discord_uids: Dict[int, int]) -> None:
+        if self.max_size <= 0:
+            return
+        expires_at = time.monotonic() + self.timeout
+        with self._lock:
+            for user_id, discord_uid in discord_uids.items():
+                self._data[user_id] = (discord_uid, expires_at)
+                self._data.move_to_end(user_id)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def _get_shared(self, user_ids: set) -> Dict[int, int]:
+        keys = {self._make_key(user_id): user_id for user_id in user_ids}
+        return {keys[key]: value for key, value in cache.get_many(keys).items()}
+
+    @classmethod
+    def _make_key(cls, user_id: int) -> str:
+        return f"{cls.CACHE_KEY_PREFIX}_{user_id}"
+
+
+discord_uid_cache = DiscordUidCache(
+    max_size=DISCORDNOTIFY_UID_CACHE_SIZE,
+    timeout=DISCORDNOTIFY_UID_CACHE_TIMEOUT,
+    shared=DISCORDNOTIFY_UID_CACHE_SHARED,
+)
+
+
+class Membership(NamedTuple):
+    """Groups and state of a user."""
+
+    groups: FrozenSet[str]
+    state: str
+
+
+NO_MEMBERSHIP = Membership(groups=frozenset(), state="")
+
+
+class MembershipCache:
+    """Bounded snapshot of group memberships and states of users in this process.
+
+    Missing users are fetched with a single query.
+    Entries are invalidated by signals in the current process
+    and expire after the timeout in other processes.
+    """
+
+    MAX_SIZE = 10000
+
+    def __init__(self, timeout: int) -> None:
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get_many(self, user_ids: Iterable[int]) -> Dict[int, Membership]:
+        """Return memberships for given user IDs. Will query missing ones."""
+        user_ids = set(user_ids)
+        result = {}
+        now = time.monotonic()
+        with self._lock:
+            for user_id in user_ids:
+                try:
+                    membership, expires_at = self._data[user_id]
+                except KeyError:
+                    continue
+                if expires_at < now:
+                    del self._data[user_id]
+                    continue
+                self._data.move_to_end(user_id)
+                result[user_id] = membership
+        missing_ids = user_ids - result.keys()
+        if missing_ids:
+            fetched = self._fetch(missing_ids)
+            expires_at = time.monotonic() + self.timeout
+            with self._lock:
+                for user_id, membership in fetched.items():
+                    self._data[user_id] = (membership, expires_at)
+                    self._data.move_to_end(user_id)
+                while len(self._data) > self.MAX_SIZE:
+                    self._data.popitem(last=False)
+            result.update(fetched)
+        return result
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._data.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    @staticmethod
+    def _fetch(user_ids: set) -> Dict[int, Membership]:
+        groups = {user_id: set() for user_id in user_ids}
+        states = dict.fromkeys(user_ids, "")
+        for user_id, state, group in User.objects.filter(id__in=user_ids).values_list(
+            "id", "profile__state__name", "groups__name"
+        ):
+            states[user_id] = state or ""
+            if group:
+                groups[user_id].add(group)
+        return {
+            user_id: Membership(
+                groups=frozenset(groups[user_id]), state=states[user_id]
+            )
+            for user_id in user_ids
+        }
+
+
+membership_cache = MembershipCache(timeout=DISCORDNOTIFY_MEMBERSHIP_CACHE_TIMEOUT)
@@ -0,0 +1,86 @@
+"""Process-wide pool of long-lived gRPC channels to Discord Proxy."""
+
+import atexit
+import os
+import threading
+from typing import Dict
+
+import grpc
+
+from allianceauth.services.hooks import get_extension_logger
+from app_utils.logging import LoggerAddTag
+
+from . import __title__
+from .app_settings import (
+    DISCORDNOTIFY_DISCORDPROXY_KEEPALIVE_TIME,
+    DISCORDNOTIFY_DISCORDPROXY_KEEPALIVE_TIMEOUT,
+)
+
+logger = LoggerAddTag(get_extension_logger(__name__), __title__)
+
+
+def channel_options() -> list:
+    """Return the options for creating channels to Discord Proxy."""
+    return [
+        ("grpc.keepalive_time_ms", DISCORDNOTIFY_DISCORDPROXY_KEEPALIVE_TIME * 1000),
+        (
+            "grpc.keepalive_timeout_ms",
+            DISCORDNOTIFY_DISCORDPROXY_KEEPALIVE_TIMEOUT * 1000,
+        ),
+        ("grpc.keepalive_permit_without_calls", 0),
+        ("grpc.http2.max_pings_without_data", 0),
+    ]
+
+
+class ChannelPool:
+    """A pool of gRPC channels, which are kept open and reused across tasks.
+
+    Channels are keyed by their target address and belong to the process
+    that created them. A forked child process (e.g. a Celery prefork worker)
+    will therefore never use the channels of its parent,
+    but create new ones on first use.
+    """
+
+    def __init__(self, options: list = None) -> None:
+        self._options = list(options) if options is not None else None
+        self._channels: Dict[str, grpc.Channel] = {}
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._channels)
+
+    def get(self, target: str) -> grpc.Channel:
+        """Return the channel for a target. Will create it when needed."""
+        with self._lock:
+            self._discard_if_forked()
+            try:
+                return self._channels[target]
+            except KeyError:
+                options = (
+                    self._options if self._options is not None else channel_options()
+                )
+                channel = grpc.insecure_channel(target, options=options)
+                self._channels[target] = channel
+                logger.debug("Opened gRPC channel to %s", target)
+                return channel
+
+    def close(self) -> None:
+        """Close all channels of this process."""
+        with self._lock:
+            self._discard_if_forked()
+            for target, channel in self._channels.items():
+                channel.close()
+                logger.debug("Closed gRPC channel to %s", target)
+            self._channels = {}
+
+    def _discard_if_forked(self) -> None:
+        pid = os.getpid()
+        if pid != self._pid:
+            # channels inherited from the parent must not be used or closed here
+            self._channels = {}
+            self._pid = pid
+
+
+channel_pool = ChannelPool()
+atexit.register(channel_pool.close)
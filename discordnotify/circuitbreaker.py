@@ -0,0 +1,222 @@
+"""Circuit breaker, which stops requests to Discord Proxy while it is down."""
+
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Optional
+
+import grpc
+
+from django.core.cache import cache
+
+from allianceauth.services.hooks import get_extension_logger
+from app_utils.logging import LoggerAddTag
+
+from . import __title__
+from .app_settings import (
+    DISCORDNOTIFY_CIRCUIT_BREAKER_RESET_TIMEOUT,
+    DISCORDNOTIFY_CIRCUIT_BREAKER_SHARED,
+    DISCORDNOTIFY_CIRCUIT_BREAKER_THRESHOLD,
+)
+
+logger = LoggerAddTag(get_extension_logger(__name__), __title__)
+
+# gRPC status codes of errors that indicate Discord Proxy is down
+FAILURE_STATUS_CODES = frozenset(
+    {grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED}
+)
+
+
+class CircuitOpenError(Exception):
+    """A request was not made, because Discord Proxy is considered down."""
+
+
+def is_failure(error: Optional[Exception]) -> bool:
+    """Report whether an error indicates that Discord Proxy is down."""
+    return (
+        isinstance(error, grpc.RpcError)
+        and hasattr(error, "code")
+        and error.code() in FAILURE_STATUS_CODES
+    )
+
+
+class CircuitBreaker(ABC):
+    """Base class for circuit breakers.
+
+    The circuit opens after threshold consecutive failed requests.
+    While open requests are rejected.
+    After reset_timeout seconds a single request is allowed as probe (half-open).
+    The circuit closes again when a request succeeds.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float) -> None:
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+
+    @abstractmethod
+    def allow_request(self) -> bool:
+        """Report whether a request can be made now."""
+
+    @abstractmethod
+    def open_for(self) -> float:
+        """Return seconds until the next probe is allowed. 0 when not open."""
+
+    def check(self) -> None:
+        """Raise CircuitOpenError if no request can be made now."""
+        if not self.allow_request():
+            raise CircuitOpenError("Discord Proxy is considered down")
+
+    def record(self, error: Optional[Exception] = None) -> None:
+        """Record the result of a request."""
+        if is_failure(error):
+            self._record_failure()
+        else:
+            self._record_success()
+
+    @abstractmethod
+    def _record_failure(self) -> None:
+        """Count a failed request and open the circuit at the threshold."""
+
+    @abstractmethod
+    def _record_success(self) -> None:
+        """Close the circuit after a successful request."""
+
+    def _log_opened(self) -> None:
+        logger.warning(
+            "Discord Proxy is not available. Pausing requests for %s seconds.",
+            self.reset_timeout,
+        )
+
+
+class LocalCircuitBreaker(CircuitBreaker):
+    """Circuit breaker with its state in the current process."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._failures = 0
+        self._open_until = None
+        self._probe_until = 0
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if self._open_until is None:
+                return True
+            if now < self._open_until or now < self._probe_until:
+                return False
+            self._probe_until = now + self.reset_timeout
+            return True
+
+    def open_for(self) -> float:
+        with self._lock:
+            if self._open_until is None:
+                return 0
+            return max(0, self._open_until - time.monotonic())
+
+    def _record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._open_until is None and self._failures < self.threshold:
+                return
+            if self._open_until is None:
+                self._log_opened()
+            self._open_until = time.monotonic() + self.reset_timeout
+
+    def _record_success(self) -> None:
+        with self._lock:
+            if self._open_until is not None:
+                logger.info("Discord Proxy is available again.")
+            self._failures = 0
+            self._open_until = None
+            self._probe_until = 0
+
+
+class CacheCircuitBreaker(CircuitBreaker):
+    """Circuit breaker with its state in Django's cache, which is shared by all workers.
+
+    Failures are counted as consecutive when they occur within reset_timeout.
+    """
+
+    CACHE_KEY_PREFIX = "DISCORDNOTIFY_CIRCUIT_BREAKER"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        # whether this process may have to reset the shared state on success
+        self._needs_reset = False
+
+    def allow_request(self) -> bool:
+        open_until = cache.get(self._make_key("open_until"))
+        if open_until is None:
+            return True
+        self._needs_reset = True
+        if time.time() < open_until:
+            return False
+        return bool(
+            cache.add(self._make_key("probe"), 1, timeout=math.ceil(self.reset_timeout))
+        )
+
+    def open_for(self) -> float:
+        open_until = cache.get(self._make_key("open_until"))
+        if open_until is None:
+            return 0
+        return max(0, open_until - time.time())
+
+    def _record_failure(self) -> None:
+        self._needs_reset = True
+        failures_key = self._make_key("failures")
+        cache.add(failures_key, 0, timeout=math.ceil(self.reset_timeout))
+        try:
+            failures = cache.incr(failures_key)
+        except ValueError:  # key has expired in between
+            failures = 1
+        open_key = self._make_key("open_until")
+        is_open = cache.get(open_key) is not None
+        if is_open or failures >= self.threshold:
+            if not is_open:
+                self._log_opened()
+            cache.set(open_key, time.time() + self.reset_timeout, timeout=None)
+
+    def _record_success(self) -> None:
+        if not self._needs_reset:
+            return
+        self._needs_reset = False
+        cache.delete_many(
+            [self._make_key(name) for name in ("failures", "open_until", "probe")]
+        )
+
+    def _make_key(self, name: str) -> str:
+        return f"{self.CACHE_KEY_PREFIX}_{name}"
+
+
+class NoCircuitBreaker(CircuitBreaker):
+    """Circuit breaker that never opens."""
+
+    def allow_request(self) -> bool:
+        return True
+
+    def open_for(self) -> float:
+        return 0
+
+    def _record_failure(self) -> None:
+        pass
+
+    def _record_success(self) -> None:
+        pass
+
+
+def _create_circuit_breaker() -> CircuitBreaker:
+    if DISCORDNOTIFY_CIRCUIT_BREAKER_THRESHOLD <= 0:
+        CircuitBreakerClass = NoCircuitBreaker
+    elif DISCORDNOTIFY_CIRCUIT_BREAKER_SHARED:
+        CircuitBreakerClass = CacheCircuitBreaker
+    else:
+        CircuitBreakerClass = LocalCircuitBreaker
+    return CircuitBreakerClass(
+        threshold=DISCORDNOTIFY_CIRCUIT_BREAKER_THRESHOLD,
+        reset_timeout=DISCORDNOTIFY_CIRCUIT_BREAKER_RESET_TIMEOUT,
+    )
+
+
+circuit_breaker = _create_circuit_breaker()
@@ -1,16 +1,60 @@
+import random
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
 import grpc
-from discordproxy.discord_api_pb2 import Embed, SendDirectMessageRequest
+from discordproxy.discord_api_pb2 import (
+    Embed,
+    SendChannelMessageRequest,
+    SendDirectMessageRequest,
+)
 from discordproxy.discord_api_pb2_grpc import DiscordApiStub
 
-from django.conf import settings
+from django.contrib.auth.models import User
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 from allianceauth.notifications.models import Notification
 from allianceauth.services.hooks import get_extension_logger
 from app_utils.logging import LoggerAddTag
-from app_utils.urls import reverse_absolute, static_file_absolute_url
 
 from . import __title__
-from .app_settings import DISCORDNOTIFY_DISCORDPROXY_PORT, DISCORDNOTIFY_MARK_AS_VIEWED
+from .app_settings import (
+    DISCORDNOTIFY_ASYNC_SENDER,
+    DISCORDNOTIFY_BROADCAST_CHANNEL,
+    DISCORDNOTIFY_BROADCAST_ROLES,
+    DISCORDNOTIFY_DELIVERY_LOG_ENABLED,
+    DISCORDNOTIFY_DIGEST_ENABLED,
+    DISCORDNOTIFY_MARK_AS_VIEWED,
+    DISCORDNOTIFY_MAX_MESSAGE_PARTS,
+    DISCORDNOTIFY_MAX_RETRIES,
+    DISCORDNOTIFY_RATE_LIMIT_RETRIES,
+    DISCORDNOTIFY_RETRY_BACKOFF,
+    DISCORDNOTIFY_RETRY_BACKOFF_MAX,
+    DISCORDNOTIFY_SEND_CONCURRENCY,
+    DISCORDNOTIFY_SEND_TIMEOUT,
+    DISCORDNOTIFY_SUPERUSER_ONLY,
+)
+from .balancer import proxy_balancer
+from .caches import NO_ACCOUNT, discord_uid_cache
+from .channels import channel_pool
+from .circuitbreaker import CircuitOpenError, circuit_breaker
+from .dedup import deduplicator
+from .embeds import embed_template
+from .metrics import (
+    batch_size,
+    delivery_lag_seconds,
+    notifications_forwarded,
+    notifications_skipped,
+    record_rpc,
+    registry,
+)
+from .models import DeliveryRecord, FailedDelivery
+from .ratelimit import parse_rate_limit, rate_limiter
+from .routing import DIGEST, DROP, REDIRECT, priority_router, rule_engine
+from .splitting import split_text
 
 logger = LoggerAddTag(get_extension_logger(__name__), __title__)
 
@@ -27,10 +71,210 @@ COLOR_MAP = {
     "danger": COLOR_DANGER,
 }
 
+LEVEL_SEVERITY = {"info": 1, "success": 2, "warning": 3, "danger": 4}
+
 # limits
 MAX_LENGTH_TITLE = 256
 MAX_LENGTH_DESCRIPTION = 2048
 
+# max latency stored in delivery records (about 24 days)
+MAX_LATENCY_MS = 2**31 - 1
+
+# max length of messages passed to tasks,
+# which is long enough so that truncation is still detected
+MAX_LENGTH_MESSAGE = (
+    MAX_LENGTH_DESCRIPTION * max(1, DISCORDNOTIFY_MAX_MESSAGE_PARTS) + 1
+)
+
+# digests
+DIGEST_MIN_ENTRY_LENGTH = 200
+DIGEST_SEPARATOR = "\n\n"
+
+# gRPC status codes of errors that might go away when trying again later
+TRANSIENT_STATUS_CODES = frozenset(
+    {
+        grpc.StatusCode.ABORTED,
+        grpc.StatusCode.CANCELLED,
+        grpc.StatusCode.DEADLINE_EXCEEDED,
+        grpc.StatusCode.INTERNAL,
+        grpc.StatusCode.RESOURCE_EXHAUSTED,
+        grpc.StatusCode.UNAVAILABLE,
+        grpc.StatusCode.UNKNOWN,
+    }
+)
+
+
+# number of fields of serialized payloads without parts_sent
+PAYLOAD_MIN_FIELDS = 6
+
+
+class NotificationPayload(NamedTuple):
+    """A notification to be forwarded to a Discord user.
+
+    Is passed to tasks as plain list, since JSON serializers like simplejson
+    would turn the named tuple into an object.
+    A compact payload only contains notification ID and Discord UID
+    and the number of parts already sent, if any.
+    Retries only send the parts of a split notification not yet sent.
+    """
+
+    notification_id: int
+    discord_uid: int
+    title: str
+    message: str
+    level: str
+    timestamp: str
+    parts_sent: int = 0
+
+    @classmethod
+    def from_notification(
+        cls, notification: Notification, discord_uid: int
+    ) -> "NotificationPayload":
+        """Create a payload for a notification.
+
+        Title and message are cut to what can be shown in an embed,
+        but long enough so that truncation is still detected.
+        """
+        return cls(
+            notification_id=notification.id,
+            discord_uid=discord_uid,
+            title=notification.title.strip()[:MAX_LENGTH_TITLE],
+            message=notification.message.strip()[:MAX_LENGTH_MESSAGE],
+            level=notification.level,
+            timestamp=notification.timestamp.isoformat(),
+        )
+
+    @staticmethod
+    def compact(item: Sequence) -> list:
+        """Return the compact form of a payload or of its serialized form."""
+        parts_sent = item[PAYLOAD_MIN_FIELDS] if len(item) > PAYLOAD_MIN_FIELDS else 0
+        if parts_sent:
+            return [item[0], item[1], parts_sent]
+        return [item[0], item[1]]
+
+
+class SendResult(NamedTuple):
+    """Outcome of sending the parts of a message."""
+
+    sent: int
+    error: Optional[Exception] = None
+
+
+class PendingPayloads(NamedTuple):
+    """Payloads which were not delivered and need to be forwarded again.
+
+    Payloads to retry failed with a transient error and count as attempt.
+    Payloads postponed were not sent, because Discord Proxy was considered down.
+    """
+
+    retry: List[NotificationPayload]
+    postponed: List[NotificationPayload]
+
+
+def resolve_payloads(items: Iterable[list]) -> List[NotificationPayload]:
+    """Create payloads from task arguments. Loads the content for compact payloads.
+
+    Payloads serialized as objects (e.g. by tasks queued by older versions)
+    are also accepted.
+    Compact payloads for notifications that no longer exist are dropped.
+    """
+    payloads = []
+    compact_items = []
+    for item in items:
+        if isinstance(item, dict):
+            payloads.append(NotificationPayload(**item))
+        elif len(item) >= PAYLOAD_MIN_FIELDS:
+            payloads.append(NotificationPayload(*item))
+        else:
+            compact_items.append(item)
+    if not compact_items:
+        return payloads
+    notifications = {
+        obj["id"]: obj
+        for obj in Notification.objects.filter(
+            id__in=[item[0] for item in compact_items]
+        ).values("id", "title", "message", "level", "timestamp")
+    }
+    for notification_id, discord_uid, *rest in compact_items:
+        try:
+            obj = notifications[notification_id]
+        except KeyError:
+            logger.info("Notification %d no longer exists", notification_id)
+            continue
+        payload = NotificationPayload.from_notification(
+            Notification(**obj), discord_uid
+        )
+        payloads.append(payload._replace(parts_sent=rest[0] if rest else 0))
+    return payloads
+
+
+class RoutedPayloads(NamedTuple):
+    """Payloads of new notifications by where they are forwarded to."""
+
+    normal: List[NotificationPayload]
+    priority: List[NotificationPayload]
+    digest: List[NotificationPayload]
+    channels: Dict[int, List[NotificationPayload]]
+
+
+def create_payloads(notifications: Iterable[Notification]) -> RoutedPayloads:
+    """Create payloads for all notifications that should be forwarded
+    and route them according to the rules.
+
+    Discord UIDs are taken from the cache
+    and missing ones are resolved with a single query for all notifications.
+    Notifications redirected to a channel are forwarded
+    even when their user has no Discord account.
+    """
+    notifications = list(notifications)
+    user_ids = {obj.user_id for obj in notifications}
+    actions = rule_engine.decide_many(notifications)
+    if DISCORDNOTIFY_SUPERUSER_ONLY:
+        superuser_ids = set(
+            User.objects.filter(id__in=user_ids, is_superuser=True).values_list(
+                "id", flat=True
+            )
+        )
+    discord_uids = discord_uid_cache.get_many(user_ids)
+    high_priority_user_ids = priority_router.high_priority_user_ids(user_ids)
+    result = RoutedPayloads(normal=[], priority=[], digest=[], channels={})
+    for instance, action in zip(notifications, actions):
+        if DISCORDNOTIFY_SUPERUSER_ONLY and instance.user_id not in superuser_ids:
+            logger.debug(
+                "Ignoring notification %d for user %d",
+                instance.id,
+                instance.user_id,
+            )
+            notifications_skipped.inc(reason="superuser_only")
+            continue
+        if action.action == DROP:
+            logger.debug("Dropping notification %d by rule", instance.id)
+            notifications_skipped.inc(reason="rule")
+            continue
+        discord_uid = discord_uids[instance.user_id]
+        if action.action == REDIRECT:
+            result.channels.setdefault(action.channel_id, []).append(
+                NotificationPayload.from_notification(instance, discord_uid)
+            )
+            continue
+        if discord_uid == NO_ACCOUNT:
+            logger.info(
+                "Can not forward notification %d to user %d, "
+                "because he has no Discord account",
+                instance.id,
+                instance.user_id,
+            )
+            notifications_skipped.inc(reason="no_account")
+            continue
+        payload = NotificationPayload.from_notification(instance, discord_uid)
+        if action.action == DIGEST:
+            result.digest.append(payload)
+        elif priority_router.is_high_priority(instance, high_priority_user_ids):
+            result.priority.append(payload)
+        else:
+            result.normal.append(payload)
+    return result
+
 
 def forward_notification_to_discord(
     notification_id: int,
@@ -39,48 +283,628 @@ def forward_notification_to_discord(
     message: str,
     level: str,
     timestamp: str,
-):
+    attempt: int = 0,
+    parts_sent: int = 0,
+) -> PendingPayloads:
+    """Forward a notification.
+
+    Returns PendingPayloads(retry, postponed) with the payload
+    in retry or postponed if it needs to be forwarded again.
+    """
     logger.info("Forwarding notification %d to %s", notification_id, discord_uid)
-    description = message.strip()
-    if len(description) > MAX_LENGTH_DESCRIPTION:
-        description = description[: (MAX_LENGTH_DESCRIPTION - 6)] + " [...]"
-    embed = Embed(
-        author=Embed.Author(
-            name="Alliance Auth Notification",
-            icon_url=static_file_absolute_url("icons/apple-touch-icon.png"),
-        ),
-        title=title.strip()[:MAX_LENGTH_TITLE],
-        url=reverse_absolute("notifications:view", args=[notification_id]),
+    payload = NotificationPayload(
+        notification_id=notification_id,
+        discord_uid=discord_uid,
+        title=title,
+        message=message,
+        level=level,
+        timestamp=timestamp,
+        parts_sent=parts_sent,
+    )
+    return forward_notifications_to_discord([payload], attempt=attempt)
+
+
+def forward_notifications_to_discord(
+    payloads: Iterable[NotificationPayload],
+    attempt: int = 0,
+    high_priority: bool = False,
+    digest: bool = False,
+    skip_dedup: bool = False,
+) -> PendingPayloads:
+    """Forward many notifications at once.
+
+    Messages are sent over the same channel
+    with up to DISCORDNOTIFY_SEND_CONCURRENCY requests in flight.
+    Messages with high priority may use the reserved part of the global rate limit.
+    With digest all payloads for the same user are combined into one message,
+    as in digest mode.
+
+    Duplicates of notifications sent recently to the same user are suppressed
+    and counted, except when retrying or with skip_dedup.
+    Notifications that are delivered again (e.g. by redrive) need skip_dedup,
+    since they were registered when first sent.
+    Notifications that failed or were postponed are unregistered again,
+    so they do not suppress identical notifications.
+
+    Returns PendingPayloads(retry, postponed)
+    with the payloads that need to be forwarded again.
+    Payloads that failed permanently or on the last attempt
+    are stored as failed deliveries.
+    """
+    payloads = list(payloads)
+    logger.info("Forwarding %d notifications", len(payloads))
+    batch_size.observe(len(payloads))
+    duplicates = []
+    duplicate_ids = []
+    registered = {}
+    if attempt == 0 and not skip_dedup and deduplicator.is_enabled:
+        payloads, duplicates, registered = _deduplicate(payloads)
+        duplicate_ids = [payload.notification_id for payload in duplicates]
+    groups = _group_payloads(payloads, digest=digest)
+    messages = [
+        (
+            group[0].discord_uid,
+            (
+                _create_embeds(group[0])[group[0].parts_sent :]
+                if len(group) == 1
+                else [_create_digest_embed(group)]
+            ),
+        )
+        for group in groups
+    ]
+    results = _send_messages_to_discord_users(messages, high_priority=high_priority)
+    delivered = []
+    pending = PendingPayloads(retry=[], postponed=[])
+    failures = []
+    for group, (sent, error) in zip(groups, results):
+        for payload in group:
+            if not error:
+                delivered.append(payload)
+                continue
+            if len(group) == 1:
+                payload = payload._replace(parts_sent=payload.parts_sent + sent)
+            if isinstance(error, CircuitOpenError):
+                pending.postponed.append(payload)
+                continue
+            _log_error(payload, error)
+            if is_transient_error(error) and attempt < DISCORDNOTIFY_MAX_RETRIES:
+                pending.retry.append(payload)
+            else:
+                failures.append((payload, error))
+    for payload in pending.postponed + [payload for payload, _ in failures]:
+        original = registered.get(payload.notification_id)
+        if original:
+            deduplicator.release(original.discord_uid, original.title, original.message)
+    _mark_as_viewed([payload.notification_id for payload in delivered] + duplicate_ids)
+    _store_failed_deliveries(failures, attempts=attempt + 1)
+    _record_deliveries(delivered)
+    if DISCORDNOTIFY_DELIVERY_LOG_ENABLED:
+        _store_delivery_records(
+            delivered=delivered,
+            failed=[payload for payload, _ in failures],
+            suppressed=duplicates,
+            attempts=attempt + 1,
+        )
+    return pending
+
+
+def forward_notifications_to_channel(
+    channel_id: int, payloads: Iterable[NotificationPayload], attempt: int = 0
+) -> PendingPayloads:
+    """Forward notifications to a Discord channel, mentioning their users.
+
+    Messages are sent one after the other to keep their order
+    and to stay within the rate limit of the channel.
+
+    Returns the payloads that need to be forwarded again,
+    with the number of parts already sent.
+    Payloads that failed permanently or on the last attempt
+    are stored as failed deliveries for the channel.
+    """
+    payloads = list(payloads)
+    logger.info("Forwarding %d notifications to channel %d", len(payloads), channel_id)
+    delivered = []
+    pending = PendingPayloads(retry=[], postponed=[])
+    failures = []
+    for payload in payloads:
+        content = f"<@{payload.discord_uid}>" if payload.discord_uid else ""
+        sent = 0
+        try:
+            for embed in _create_embeds(payload)[payload.parts_sent :]:
+                _send_message_to_discord_channel(
+                    channel_id=channel_id, content=content, embed=embed
+                )
+                sent += 1
+        except Exception as ex:
+            payload = payload._replace(parts_sent=payload.parts_sent + sent)
+            if isinstance(ex, CircuitOpenError):
+                pending.postponed.append(payload)
+                continue
+            _log_error(payload, ex)
+            if is_transient_error(ex) and attempt < DISCORDNOTIFY_MAX_RETRIES:
+                pending.retry.append(payload)
+            else:
+                failures.append((payload, ex))
+        else:
+            delivered.append(payload)
+    _mark_as_viewed([payload.notification_id for payload in delivered])
+    _store_failed_deliveries(failures, attempts=attempt + 1, channel_id=channel_id)
+    _record_deliveries(delivered)
+    if DISCORDNOTIFY_DELIVERY_LOG_ENABLED:
+        _store_delivery_records(
+            delivered=delivered,
+            failed=[payload for payload, _ in failures],
+            suppressed=[],
+            attempts=attempt + 1,
+        )
+    return pending
+
+
+def forward_broadcast(
+    payload: NotificationPayload,
+    recipients: List[Tuple[int, int]],
+    post: bool = True,
+    attempt: int = 0,
+) -> SendResult:
+    """Forward an identical notification for many users
+    as one message to the broadcast channel, mentioning the broadcast roles.
+
+    Recipients are pairs of notification ID and Discord UID.
+    Without post the message has already been posted
+    and the notifications are only recorded as delivered.
+    Parts of the message already sent are skipped.
+
+    Returns the number of parts sent and the error, if any.
+    """
+    logger.info(
+        "Forwarding notification %d as broadcast for %d users",
+        payload.notification_id,
+        len(recipients),
+    )
+    sent = 0
+    if post:
+        content = " ".join(
+            f"<@&{role_id}>" for role_id in DISCORDNOTIFY_BROADCAST_ROLES
+        )
+        embeds = _create_embeds(payload, url=embed_template.notification_list_url())
+        try:
+            for embed in embeds[payload.parts_sent :]:
+                _send_message_to_discord_channel(
+                    channel_id=DISCORDNOTIFY_BROADCAST_CHANNEL,
+                    content=content,
+                    embed=embed,
+                )
+                sent += 1
+        except Exception as ex:
+            if not isinstance(ex, CircuitOpenError):
+                _log_error(payload, ex)
+            return SendResult(sent, ex)
+    delivered = [
+        payload._replace(
+            notification_id=notification_id, discord_uid=discord_uid, parts_sent=0
+        )
+        for notification_id, discord_uid in recipients
+    ]
+    _mark_as_viewed([obj.notification_id for obj in delivered])
+    _record_deliveries(delivered)
+    if DISCORDNOTIFY_DELIVERY_LOG_ENABLED:
+        _store_delivery_records(
+            delivered=delivered, failed=[], suppressed=[], attempts=attempt + 1
+        )
+    return SendResult(sent)
+
+
+def _deduplicate(
+    payloads: List[NotificationPayload],
+) -> Tuple[
+    List[NotificationPayload],
+    List[NotificationPayload],
+    Dict[int, NotificationPayload],
+]:
+    """Split payloads into those to send and duplicates to suppress.
+
+    Payloads to send get a counter for the duplicates suppressed before.
+    Also returns the payloads as registered by notification ID,
+    which is needed for unregistering them.
+    """
+    unique_payloads = []
+    duplicates = []
+    registered = {}
+    for payload in payloads:
+        repeated = deduplicator.check(
+            payload.discord_uid, payload.title, payload.message
+        )
+        if repeated is None:
+            duplicates.append(payload)
+            continue
+        registered[payload.notification_id] = payload
+        if repeated:
+            suffix = f" (repeated {repeated}×)"
+            title = payload.title.strip()[: MAX_LENGTH_TITLE - len(suffix)] + suffix
+            payload = payload._replace(title=title)
+        unique_payloads.append(payload)
+    if duplicates:
+        logger.info("Suppressed %d duplicate notifications", len(duplicates))
+        notifications_skipped.inc(len(duplicates), reason="duplicate")
+    return unique_payloads, duplicates, registered
+
+
+def _record_deliveries(payloads: List[NotificationPayload]) -> None:
+    """Record metrics about delivered notifications."""
+    notifications_forwarded.inc(len(payloads))
+    now = timezone.now()
+    lags = []
+    for payload in payloads:
+        timestamp = parse_datetime(payload.timestamp)
+        if timestamp:
+            lags.append(max(0, (now - timestamp).total_seconds()))
+    delivery_lag_seconds.observe_many(lags)
+    registry.flush(force=False)
+
+
+def _store_delivery_records(
+    delivered: List[NotificationPayload],
+    failed: List[NotificationPayload],
+    suppressed: List[NotificationPayload],
+    attempts: int,
+) -> None:
+    """Store the outcome for all payloads of a batch with a single insert."""
+    now = timezone.now()
+    objs = []
+    for status, payloads in (
+        (DeliveryRecord.Status.SENT, delivered),
+        (DeliveryRecord.Status.FAILED, failed),
+        (DeliveryRecord.Status.SUPPRESSED, suppressed),
+    ):
+        for payload in payloads:
+            latency_ms = None
+            if status == DeliveryRecord.Status.SENT:
+                timestamp = parse_datetime(payload.timestamp)
+                if timestamp:
+                    latency_ms = min(
+                        MAX_LATENCY_MS,
+                        max(0, int((now - timestamp).total_seconds() * 1000)),
+                    )
+            objs.append(
+                DeliveryRecord(
+                    notification_id=payload.notification_id,
+                    discord_uid=payload.discord_uid,
+                    status=status,
+                    attempts=attempts,
+                    latency_ms=latency_ms,
+                    sent_at=now,
+                )
+            )
+    DeliveryRecord.objects.bulk_create(objs, batch_size=500)
+
+
+def is_transient_error(error: Exception) -> bool:
+    """Report whether sending might succeed when trying again later.
+
+    Other exceptions than gRPC errors are bugs and never transient.
+    """
+    if not isinstance(error, grpc.RpcError):
+        return False
+    if hasattr(error, "code"):
+        return error.code() in TRANSIENT_STATUS_CODES
+    return True
+
+
+def retry_countdown(attempt: int) -> float:
+    """Return the delay before the next retry as exponential backoff with jitter."""
+    backoff = min(
+        DISCORDNOTIFY_RETRY_BACKOFF_MAX, DISCORDNOTIFY_RETRY_BACKOFF * 2**attempt
+    )
+    return random.uniform(backoff / 2, backoff)
+
+
+def _log_error(payload: NotificationPayload, error: Exception) -> None:
+    if isinstance(error, grpc.RpcError) and hasattr(error, "code"):
+        logger.error(
+            "Failed to send notification %d to Discord API: %s: %s",
+            payload.notification_id,
+            error.code(),
+            error.details(),
+        )
+    else:
+        logger.error(
+            "Unexpected error when sending notification %d to %s",
+            payload.notification_id,
+            payload.discord_uid,
+            exc_info=error,
+        )
+
+
+def _store_failed_deliveries(
+    failures: List[Tuple[NotificationPayload, Exception]],
+    attempts: int,
+    channel_id: int = None,
+) -> None:
+    if not failures:
+        return
+    existing_ids = set(
+        Notification.objects.filter(
+            id__in=[payload.notification_id for payload, _ in failures]
+        ).values_list("id", flat=True)
+    )
+    objs = [
+        FailedDelivery(
+            notification_id=payload.notification_id,
+            discord_uid=payload.discord_uid,
+            channel_id=channel_id,
+            status_code=_status_code_name(error)[:32],
+            details=_error_details(error)[:1000],
+            attempts=attempts,
+        )
+        for payload, error in failures
+        if payload.notification_id in existing_ids
+    ]
+    FailedDelivery.objects.bulk_create(objs)
+    logger.warning("Stored %d failed deliveries", len(objs))
+
+
+def _status_code_name(error: Exception) -> str:
+    if isinstance(error, grpc.RpcError) and hasattr(error, "code"):
+        return error.code().name
+    return type(error).__name__
+
+
+def _error_details(error: Exception) -> str:
+    if isinstance(error, grpc.RpcError) and hasattr(error, "details"):
+        return error.details() or ""
+    return str(error)
+
+
+def _create_embeds(payload: NotificationPayload, url: str = None) -> List[Embed]:
+    """Create the embeds for a notification.
+
+    Long messages are split into up to DISCORDNOTIFY_MAX_MESSAGE_PARTS embeds,
+    which are sent as consecutive messages.
+    Embeds link to the notification, unless another URL is given.
+    """
+    descriptions = split_text(
+        payload.message.strip(),
+        max_length=MAX_LENGTH_DESCRIPTION,
+        max_parts=DISCORDNOTIFY_MAX_MESSAGE_PARTS,
+    ) or [""]
+    title = payload.title.strip()
+    url = url or embed_template.notification_url(payload.notification_id)
+    color = COLOR_MAP.get(payload.level, None)
+    if len(descriptions) == 1:
+        return [
+            embed_template.create(
+                title=title[:MAX_LENGTH_TITLE],
+                url=url,
+                description=descriptions[0],
+                color=color,
+                timestamp=payload.timestamp,
+            )
+        ]
+    embeds = []
+    for num, description in enumerate(descriptions, start=1):
+        suffix = f" ({num}/{len(descriptions)})"
+        embeds.append(
+            embed_template.create(
+                title=title[: MAX_LENGTH_TITLE - len(suffix)] + suffix,
+                url=url,
+                description=description,
+                color=color,
+                timestamp=payload.timestamp,
+            )
+        )
+    return embeds
+
+
+def _group_payloads(
+    payloads: List[NotificationPayload], digest: bool = False
+) -> List[List[NotificationPayload]]:
+    """Group payloads into messages.
+
+    In digest mode all payloads for the same user become one message.
+    Payloads with parts already sent are always sent on their own.
+    """
+    if not DISCORDNOTIFY_DIGEST_ENABLED and not digest:
+        return [[payload] for payload in payloads]
+    groups = OrderedDict()
+    for payload in payloads:
+        if payload.parts_sent:
+            groups[(payload.notification_id, payload.discord_uid)] = [payload]
+        else:
+            groups.setdefault(payload.discord_uid, []).append(payload)
+    return list(groups.values())
+
+
+def _create_digest_embed(payloads: List[NotificationPayload]) -> Embed:
+    """Create one embed summarizing several notifications for the same user."""
+    more_template = "\n\n... and {} more"
+    budget = MAX_LENGTH_DESCRIPTION - len(more_template.format(len(payloads)))
+    max_entry_length = max(
+        DIGEST_MIN_ENTRY_LENGTH, budget // len(payloads) - len(DIGEST_SEPARATOR)
+    )
+    entries = []
+    length = 0
+    for payload in payloads:
+        entry = f"**{payload.title.strip()}**\n{payload.message.strip()}".strip()
+        if len(entry) > max_entry_length:
+            entry = entry[: (max_entry_length - 6)] + " [...]"
+        new_length = length + len(entry) + (len(DIGEST_SEPARATOR) if entries else 0)
+        if new_length > budget:
+            break
+        entries.append(entry)
+        length = new_length
+    description = DIGEST_SEPARATOR.join(entries)
+    if len(entries) < len(payloads):
+        description += more_template.format(len(payloads) - len(entries))
+    level = max(
+        (payload.level for payload in payloads),
+        key=lambda level: LEVEL_SEVERITY.get(level, 0),
+    )
+    return embed_template.create(
+        title=f"{len(payloads)} new notifications",
+        url=embed_template.notification_list_url(),
         description=description,
         color=COLOR_MAP.get(level, None),
-        timestamp=timestamp,
-        footer=Embed.Footer(text=settings.SITE_NAME),
+        timestamp=max(payload.timestamp for payload in payloads),
     )
-    _send_message_to_discord_user(discord_uid=discord_uid, embed=embed)
-    _mark_as_viewed(notification_id)
 
 
-def _send_message_to_discord_user(discord_uid: int, embed: Embed):
-    with grpc.insecure_channel(
-        f"localhost:{DISCORDNOTIFY_DISCORDPROXY_PORT}"
-    ) as channel:
-        client = DiscordApiStub(channel)
-        request = SendDirectMessageRequest(user_id=discord_uid, embed=embed)
+def _send_messages_to_discord_users(
+    messages: List[Tuple[int, List[Embed]]], high_priority: bool = False
+) -> List[SendResult]:
+    """Send messages to Discord users with bounded concurrency.
+
+    Each message can consist of several embeds, which are sent in order.
+    Uses the async sender when enabled and available, else falls back to threads.
+    Returns for each message the number of embeds sent and the error, if any.
+    """
+    if DISCORDNOTIFY_ASYNC_SENDER and len(messages) > 1:
         try:
-            client.SendDirectMessage(request)
-        except grpc.RpcError as e:
-            logger.error(
-                "Failed to send message to Discord API: %s: %s",
-                e.code(),
-                e.details(),
+            from . import aio
+        except ImportError:
+            logger.warning("Async sender not available. Falling back to sync sender.")
+        else:
+            if aio.can_run():
+                return aio.send_messages_to_discord_users(
+                    messages,
+                    concurrency=DISCORDNOTIFY_SEND_CONCURRENCY,
+                    high_priority=high_priority,
+                )
+
+    def send_message(message: Tuple[int, List[Embed]]) -> SendResult:
+        return _send_message_to_discord_user_safe(*message, high_priority)
+
+    max_workers = min(DISCORDNOTIFY_SEND_CONCURRENCY, len(messages))
+    if max_workers <= 1:
+        return [send_message(message) for message in messages]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(send_message, messages))
+
+
+def _send_message_to_discord_user_safe(
+    discord_uid: int, embeds: List[Embed], high_priority: bool = False
+) -> SendResult:
+    sent = 0
+    try:
+        for embed in embeds:
+            _send_message_to_discord_user(
+                discord_uid=discord_uid, embed=embed, high_priority=high_priority
+            )
+            sent += 1
+    except Exception as ex:
+        return SendResult(sent, ex)
+    return SendResult(sent)
+
+
+def _send_message_to_discord_user(
+    discord_uid: int, embed: Embed, high_priority: bool = False
+) -> None:
+    """Send a message to a Discord user. Raises grpc.RpcError on failure."""
+    _send_request(
+        "SendDirectMessage",
+        SendDirectMessageRequest(user_id=discord_uid, embed=embed),
+        rate_limit_key=discord_uid,
+        high_priority=high_priority,
+    )
+
+
+def _send_message_to_discord_channel(
+    channel_id: int, content: str, embed: Embed
+) -> None:
+    """Send a message to a Discord channel. Raises grpc.RpcError on failure."""
+    _send_request(
+        "SendChannelMessage",
+        SendChannelMessageRequest(channel_id=channel_id, content=content, embed=embed),
+        rate_limit_key=channel_id,
+    )
+
+
+class ProxyRequest:
+    """A request to Discord Proxy with failover and retries when rate limited.
+
+    Holds the retry state and decisions shared by the sync and the async sender,
+    which only differ in how they make the call and wait.
+    The rate limit key is the ID of the DM channel or channel of the message.
+    check(), succeeded() and failed() may access Django's cache
+    and must not be called directly on an event loop.
+    """
+
+    def __init__(self, rate_limit_key: int, high_priority: bool = False) -> None:
+        self.rate_limit_key = rate_limit_key
+        self.high_priority = high_priority
+        self.attempt = 0
+        self.tried_targets: List[str] = []
+
+    def check(self) -> None:
+        """Raise CircuitOpenError if no request can be made now."""
+        circuit_breaker.check()
+
+    def acquire_target(self) -> str:
+        """Choose the Discord Proxy instance for the next try."""
+        return proxy_balancer.acquire(exclude=self.tried_targets)
+
+    def succeeded(self, target: str, duration: float) -> None:
+        """Record a successful try."""
+        record_rpc(duration)
+        proxy_balancer.release(target)
+        circuit_breaker.record()
+
+    def failed(self, target: str, duration: float, error: Exception) -> bool:
+        """Record a failed try. Returns True when the request should be made again."""
+        if not isinstance(error, grpc.RpcError):
+            proxy_balancer.release(target)
+            return False
+        record_rpc(duration, error)
+        proxy_balancer.release(target, error)
+        if proxy_balancer.can_failover(error, self.tried_targets + [target]):
+            self.tried_targets.append(target)
+            logger.warning(
+                "Discord Proxy at %s is not available. Trying next one.", target
             )
+            return True
+        circuit_breaker.record(error)
+        rate_limit = parse_rate_limit(error)
+        if not rate_limit:
+            return False
+        rate_limiter.penalize(self.rate_limit_key, rate_limit)
+        if self.attempt >= DISCORDNOTIFY_RATE_LIMIT_RETRIES:
+            return False
+        self.attempt += 1
+        logger.warning(
+            "Rate limited when sending message to %s. Retrying.", self.rate_limit_key
+        )
+        return True
+
 
+def _send_request(
+    method: str, request, rate_limit_key: int, high_priority: bool = False
+) -> None:
+    """Send a request to Discord Proxy with failover and retries when rate limited.
 
-def _mark_as_viewed(notification_id):
-    if DISCORDNOTIFY_MARK_AS_VIEWED:
+    Raises grpc.RpcError on failure.
+    """
+    proxy_request = ProxyRequest(rate_limit_key, high_priority)
+    while True:
+        proxy_request.check()
+        rate_limiter.acquire(rate_limit_key, high_priority)
+        target = proxy_request.acquire_target()
+        client = DiscordApiStub(channel_pool.get(target))
+        started = time.monotonic()
         try:
-            notif = Notification.objects.get(id=notification_id)
-        except Notification.DoesNotExist:
-            return
+            getattr(client, method)(request, timeout=DISCORDNOTIFY_SEND_TIMEOUT)
+        except Exception as ex:
+            if not proxy_request.failed(target, time.monotonic() - started, ex):
+                raise
         else:
-            notif.mark_viewed()
+            proxy_request.succeeded(target, time.monotonic() - started)
+            return
+
+
+def _mark_as_viewed(notification_ids: List[int]):
+    """Mark notifications as viewed with a single update.
+
+    This happens after all messages of a batch have been sent.
+    Should the process crash in between, those notifications will remain unviewed
+    even though they have been delivered to Discord.
+    """
+    if DISCORDNOTIFY_MARK_AS_VIEWED and notification_ids:
+        Notification.objects.filter(id__in=notification_ids).update(viewed=True)
@@ -0,0 +1,115 @@
+"""Suppression of identical notifications sent repeatedly to the same user."""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from django.core.cache import cache
+
+from .app_settings import (
+    DISCORDNOTIFY_DEDUP_COUNTER,
+    DISCORDNOTIFY_DEDUP_SHARED,
+    DISCORDNOTIFY_DEDUP_TIMEOUT,
+)
+
+
+class Deduplicator:
+    """Detects notifications with the same title and message for the same user
+    within timeout seconds.
+
+    Can count suppressed duplicates, so they can be reported with the next message.
+    Counts are kept for COUNTER_TIMEOUT seconds.
+    """
+
+    CACHE_KEY_PREFIX = "DISCORDNOTIFY_DEDUP"
+    COUNTER_TIMEOUT = 86400
+    MAX_LOCAL_SIZE = 10000
+
+    def __init__(
+        self, timeout: float, shared: bool = True, count_duplicates: bool = True
+    ) -> None:
+        self.timeout = timeout
+        self.shared = shared
+        self.count_duplicates = count_duplicates
+        self._sent_until = OrderedDict()
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def is_enabled(self) -> bool:
+        return self.timeout > 0
+
+    def check(self, discord_uid: int, title: str, message: str) -> Optional[int]:
+        """Register a notification for sending.
+
+        Returns None when it is a duplicate and should be suppressed,
+        else how many duplicates were suppressed since it was last sent.
+        """
+        key = self._make_key(discord_uid, title, message)
+        if self.shared:
+            return self._check_shared(key)
+        return self._check_local(key)
+
+    def release(self, discord_uid: int, title: str, message: str) -> None:
+        """Unregister a notification which was not sent after all,
+        so the next identical notification is sent.
+        """
+        key = self._make_key(discord_uid, title, message)
+        if self.shared:
+            cache.delete(key)
+        else:
+            with self._lock:
+                self._sent_until.pop(key, None)
+
+    def clear(self) -> None:
+        """Clear the local state."""
+        with self._lock:
+            self._sent_until.clear()
+            self._counts.clear()
+
+    def _check_shared(self, key: str) -> Optional[int]:
+        count_key = f"{key}_count"
+        if not cache.add(key, 1, timeout=self.timeout):
+            if self.count_duplicates:
+                cache.add(count_key, 0, timeout=self.COUNTER_TIMEOUT)
+                try:
+                    cache.incr(count_key)
+                except ValueError:  # key has expired in between
+                    cache.set(count_key, 1, timeout=self.COUNTER_TIMEOUT)
+            return None
+        if not self.count_duplicates:
+            return 0
+        count = cache.get(count_key, 0)
+        if count:
+            cache.delete(count_key)
+        return count
+
+    def _check_local(self, key: str) -> Optional[int]:
+        now = time.monotonic()
+        with self._lock:
+            if self._sent_until.get(key, 0) > now:
+                if self.count_duplicates:
+                    self._counts[key] = self._counts.get(key, 0) + 1
+                    self._counts.move_to_end(key)
+                return None
+            self._sent_until[key] = now + self.timeout
+            self._sent_until.move_to_end(key)
+            for data in (self._sent_until, self._counts):
+                while len(data) > self.MAX_LOCAL_SIZE:
+                    data.popitem(last=False)
+            return self._counts.pop(key, 0)
+
+    def _make_key(self, discord_uid: int, title: str, message: str) -> str:
+        digest = hashlib.sha256(
+            f"{discord_uid}\x00{title}\x00{message}".encode("utf-8")
+        ).hexdigest()
+        return f"{self.CACHE_KEY_PREFIX}_{digest}"
+
+
+deduplicator = Deduplicator(
+    timeout=DISCORDNOTIFY_DEDUP_TIMEOUT,
+    shared=DISCORDNOTIFY_DEDUP_SHARED,
+    count_duplicates=DISCORDNOTIFY_DEDUP_COUNTER,
+)
@@ -0,0 +1,68 @@
+"""Prebuilt parts of the embeds for forwarded notifications."""
+
+import threading
+
+from discordproxy.discord_api_pb2 import Embed
+
+from django.conf import settings
+
+from app_utils.urls import reverse_absolute, static_file_absolute_url
+
+# placeholder for the notification ID when reversing the notification URL
+_URL_PLACEHOLDER = "DISCORDNOTIFYID"
+
+
+class EmbedTemplate:
+    """Embed prototype with all parts that are the same for every notification.
+
+    It is built once per process and must be cleared when settings change.
+    """
+
+    def __init__(self) -> None:
+        self._prototype = None
+        self._url_parts = None
+        self._list_url = None
+        self._lock = threading.Lock()
+
+    def create(self, **kwargs) -> Embed:
+        """Create a new embed from the prototype and set the given fields.
+
+        Fields with the value None are left unset.
+        """
+        embed = Embed()
+        embed.CopyFrom(self._get()[0])
+        for name, value in kwargs.items():
+            if value is not None:
+                setattr(embed, name, value)
+        return embed
+
+    def notification_url(self, notification_id: int) -> str:
+        """Return the absolute URL for viewing a notification."""
+        prefix, suffix = self._get()[1]
+        return f"{prefix}{notification_id}{suffix}"
+
+    def notification_list_url(self) -> str:
+        """Return the absolute URL for the list of notifications."""
+        return self._get()[2]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._prototype = None
+
+    def _get(self) -> tuple:
+        with self._lock:
+            if self._prototype is None:
+                self._prototype = Embed(
+                    author=Embed.Author(
+                        name="Alliance Auth Notification",
+                        icon_url=static_file_absolute_url("icons/apple-touch-icon.png"),
+                    ),
+                    footer=Embed.Footer(text=settings.SITE_NAME),
+                )
+                url = reverse_absolute("notifications:view", args=[_URL_PLACEHOLDER])
+                self._url_parts = tuple(url.split(_URL_PLACEHOLDER, 1))
+                self._list_url = reverse_absolute("notifications:list")
+            return self._prototype, self._url_parts, self._list_url
+
+
+embed_template = EmbedTemplate()
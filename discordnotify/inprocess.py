@@ -0,0 +1,158 @@
+"""In-process delivery of notifications with a pool of background threads."""
+
+import atexit
+import os
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
+
+from django.db import close_old_connections
+
+from allianceauth.services.hooks import get_extension_logger
+from app_utils.logging import LoggerAddTag
+
+from . import __title__
+from .app_settings import (
+    DISCORDNOTIFY_INPROCESS_DRAIN_TIMEOUT,
+    DISCORDNOTIFY_INPROCESS_ENABLED,
+    DISCORDNOTIFY_INPROCESS_QUEUE_SIZE,
+    DISCORDNOTIFY_INPROCESS_WORKERS,
+)
+
+logger = LoggerAddTag(get_extension_logger(__name__), __title__)
+
+_STOP = object()
+
+
+class InProcessSender:
+    """Runs jobs in background threads of the current process.
+
+    Jobs are Celery tasks, which are called directly with keyword arguments.
+    They are queued in a bounded queue. When the queue is full new jobs
+    are rejected, so the caller can start them as Celery tasks instead.
+    Threads are started on first use and belong to the process that started them,
+    so a forked child process starts its own.
+    """
+
+    def __init__(self, workers: int, queue_size: int, enabled: bool = True) -> None:
+        self.workers = max(1, int(workers))
+        self.queue_size = max(1, int(queue_size))
+        self.enabled = enabled
+        self._queue: Optional[queue.Queue] = None
+        self._threads: List[threading.Thread] = []
+        self._pid = None
+        self._accepting = True
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._queue.unfinished_tasks if self._queue else 0
+
+    def submit(self, task: Callable, **kwargs) -> bool:
+        """Queue a job. Returns False when it was rejected."""
+        if not self.enabled or not self._accepting:
+            return False
+        job_queue = self._start()
+        try:
+            job_queue.put_nowait((task, kwargs))
+        except queue.Full:
+            logger.warning("In-process queue is full. Rejecting job.")
+            return False
+        return True
+
+    def drain(self, timeout: float = DISCORDNOTIFY_INPROCESS_DRAIN_TIMEOUT) -> bool:
+        """Stop accepting jobs and wait until all queued jobs are done
+        or the timeout has elapsed. Then stop the threads.
+
+        Jobs still queued after the timeout are started as Celery tasks.
+        Returns True when all jobs were done.
+        """
+        with self._lock:
+            job_queue = self._queue
+            threads = self._threads
+            if not job_queue or self._pid != os.getpid():
+                return True
+            self._accepting = False
+        deadline = time.monotonic() + timeout
+        while job_queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+        is_drained = not job_queue.unfinished_tasks
+        if not is_drained:
+            self._hand_over(job_queue)
+        for _ in threads:
+            try:
+                job_queue.put_nowait(_STOP)
+            except queue.Full:
+                break
+        with self._lock:
+            self._queue = None
+            self._threads = []
+            self._accepting = True
+        return is_drained
+
+    @staticmethod
+    def _hand_over(job_queue: queue.Queue) -> None:
+        """Start all queued jobs as Celery tasks."""
+        handed_over = 0
+        while True:
+            try:
+                task, kwargs = job_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                task.apply_async(kwargs=kwargs)
+            except Exception:
+                logger.exception("Failed to hand over in-process job to Celery")
+            else:
+                handed_over += 1
+            job_queue.task_done()
+        logger.warning(
+            "Handed over %d in-process jobs to Celery on shutdown. "
+            "Abandoning %d running jobs.",
+            handed_over,
+            job_queue.unfinished_tasks,
+        )
+
+    def _start(self) -> queue.Queue:
+        """Return the queue of this process and start its threads if needed."""
+        pid = os.getpid()
+        with self._lock:
+            if self._queue is None or self._pid != pid:
+                self._pid = pid
+                self._queue = queue.Queue(maxsize=self.queue_size)
+                self._threads = [
+                    threading.Thread(
+                        target=self._run,
+                        args=(self._queue,),
+                        name=f"discordnotify-{num}",
+                        daemon=True,
+                    )
+                    for num in range(self.workers)
+                ]
+                for thread in self._threads:
+                    thread.start()
+            return self._queue
+
+    @staticmethod
+    def _run(job_queue: queue.Queue) -> None:
+        while True:
+            job = job_queue.get()
+            if job is _STOP:
+                job_queue.task_done()
+                return
+            task, kwargs = job
+            try:
+                task(**kwargs)
+            except Exception:
+                logger.exception("In-process job failed")
+            finally:
+                close_old_connections()
+                job_queue.task_done()
+
+
+inprocess_sender = InProcessSender(
+    workers=DISCORDNOTIFY_INPROCESS_WORKERS,
+    queue_size=DISCORDNOTIFY_INPROCESS_QUEUE_SIZE,
+    enabled=DISCORDNOTIFY_INPROCESS_ENABLED,
+)
+atexit.register(inprocess_sender.drain)
@@ -0,0 +1,699 @@
+"""Benchmark and soak test for the forwarding pipeline with a fake Discord Proxy.
+
+Shared by the commands discordnotify_benchmark and discordnotify_soak.
+"""
+
+import json
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent import futures
+from contextlib import contextmanager
+from typing import List, NamedTuple, Optional, Tuple
+
+import grpc
+from celery import current_app
+from discordproxy.discord_api_pb2 import SendDirectMessageResponse
+from discordproxy.discord_api_pb2_grpc import (
+    DiscordApiServicer,
+    add_DiscordApiServicer_to_server,
+)
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.backends.signals import connection_created
+from django.test.utils import CaptureQueriesContext
+from django.utils.dateparse import parse_datetime
+
+from allianceauth.notifications import notify
+from allianceauth.services.modules.discord.models import DiscordUser
+
+from ... import __title__, __version__, core, tasks
+from ...app_settings import DISCORDNOTIFY_DISCORDPROXY_PORT, DISCORDNOTIFY_ENABLED
+from ...balancer import proxy_balancer
+from ...batching import (
+    broadcast_detector,
+    digest_batcher,
+    notification_batcher,
+    priority_batcher,
+)
+from ...circuitbreaker import NoCircuitBreaker, _create_circuit_breaker
+from ...dedup import Deduplicator
+from ...ratelimit import NoRateLimiter, _create_rate_limiter
+
+USERNAME_PREFIX = "discordnotify_benchmark_"
+DISCORD_UID_OFFSET = 10**17
+
+# Prefix for cache keys of rate limiter and circuit breaker with throttling
+CACHE_KEY_PREFIX = "DISCORDNOTIFY_BENCHMARK"
+
+
+class FakeDiscordProxy(DiscordApiServicer):
+    """Fake Discord Proxy server, which accepts direct messages.
+
+    Requests can be delayed and can fail randomly with errors or rate limits.
+    Always fails for user IDs in failing_uids.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0,
+        error_rate: float = 0,
+        rate_limit_rate: float = 0,
+        failing_uids: set = None,
+        max_workers: int = 50,
+        seed: int = None,
+    ) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.failing_uids = failing_uids or set()
+        self.max_workers = max_workers
+        self.requests = 0
+        self.received_uids = []
+        self.latencies = []
+        self.last_received_at = None
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._random = random.Random(seed)
+        self._server = None
+        self._lock = threading.Lock()
+
+    def start(self, port: int = 0) -> int:
+        """Start the server and return its port."""
+        self._server = grpc.server(
+            futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        )
+        add_DiscordApiServicer_to_server(self, self._server)
+        port = self._server.add_insecure_port(f"localhost:{port}")
+        if not port:
+            raise RuntimeError("Failed to bind fake Discord Proxy")
+        self._server.start()
+        return port
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.stop(None)
+            self._server = None
+
+    def SendDirectMessage(self, request, context):
+        with self._lock:
+            self.requests += 1
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+            dice = self._random.random()
+        time.sleep(self.latency)
+        with self._lock:
+            self._in_flight -= 1
+        if dice < self.rate_limit_rate:
+            context.abort(
+                grpc.StatusCode.RESOURCE_EXHAUSTED, self._rate_limit_details()
+            )
+        if dice < self.rate_limit_rate + self.error_rate:
+            context.abort(grpc.StatusCode.UNAVAILABLE, "Fake error")
+        if request.user_id in self.failing_uids:
+            context.abort(grpc.StatusCode.NOT_FOUND, "Unknown user")
+        received_at = time.time()
+        created_at = parse_datetime(request.embed.timestamp)
+        with self._lock:
+            self.received_uids.append(request.user_id)
+            self.last_received_at = received_at
+            if created_at:
+                self.latencies.append(received_at - created_at.timestamp())
+        return SendDirectMessageResponse()
+
+    @staticmethod
+    def _rate_limit_details() -> str:
+        """Return the details Discord Proxy reports for a rate limit."""
+        return json.dumps(
+            {
+                "type": "HTTPException",
+                "status": 429,
+                "code": 0,
+                "text": "You are being rate limited.",
+            }
+        )
+
+
+class BenchmarkReport(NamedTuple):
+    """Results of a benchmark run."""
+
+    mode: str
+    throttling: Optional[bool]
+    notifications: int
+    users: int
+    messages: int
+    duration: float
+    messages_per_second: float
+    latency_p50: Optional[float]
+    latency_p99: Optional[float]
+    db_queries_per_notification: Optional[float]
+    rpcs_per_notification: float
+
+
+def run_benchmark(
+    proxy: FakeDiscordProxy,
+    num_notifications: int = 10000,
+    num_users: int = 1000,
+    eager: bool = True,
+    timeout: float = 600,
+    idle_timeout: float = 5,
+    throttling: bool = False,
+) -> BenchmarkReport:
+    """Create notifications for benchmark users and measure how they are forwarded.
+
+    All notifications are created in one transaction like for a group broadcast.
+    In eager mode tasks are run in the current process, else by Celery workers.
+    DB queries are only counted in eager mode
+    and without the queries for creating notifications.
+    See _throttling() for how throttling is handled.
+
+    Benchmark users are created for the run and deleted afterwards.
+    """
+    with _prepared_run(num_users, eager, throttling) as users, CaptureQueriesContext(
+        connection
+    ) as ctx:
+        started_at = time.time()
+        with transaction.atomic():
+            for num in range(num_notifications):
+                notify(
+                    users[num % num_users],
+                    title=f"Benchmark notification #{num + 1}",
+                    message="This notification was created by a benchmark.",
+                )
+            creation_queries = len(ctx.captured_queries)
+        _drain(proxy, timeout, idle_timeout)
+    messages = len(proxy.received_uids)
+    duration = (proxy.last_received_at or time.time()) - started_at
+    latencies = sorted(proxy.latencies)
+    if eager:
+        forwarding_queries = len(ctx.captured_queries) - creation_queries
+        db_queries_per_notification = forwarding_queries / num_notifications
+    else:
+        db_queries_per_notification = None
+    return BenchmarkReport(
+        mode="eager" if eager else "worker",
+        throttling=throttling if eager else None,
+        notifications=num_notifications,
+        users=num_users,
+        messages=messages,
+        duration=duration,
+        messages_per_second=messages / duration if duration > 0 else 0,
+        latency_p50=_percentile(latencies, 50),
+        latency_p99=_percentile(latencies, 99),
+        db_queries_per_notification=db_queries_per_notification,
+        rpcs_per_notification=proxy.requests / num_notifications,
+    )
+
+
+class SoakReport(NamedTuple):
+    """Results of a soak test run.
+
+    Rates are per second. The backlog is the number of notifications created,
+    but not yet received by the proxy. Samples show how it developed over time.
+    """
+
+    version: str
+    mode: str
+    throttling: Optional[bool]
+    target_rate: float
+    duration: float
+    users: int
+    notifications: int
+    enqueue_rate: float
+    messages: int
+    delivery_rate: float
+    max_backlog: int
+    backlog_growth_per_second: float
+    saturated: bool
+    drain_duration: Optional[float]
+    latency_p50: Optional[float]
+    latency_p99: Optional[float]
+    cpu_percent: Optional[float]
+    db_queries_per_notification: Optional[float]
+    samples: List[dict]
+
+
+def run_soak_test(
+    proxy: FakeDiscordProxy,
+    rate: float = 50,
+    duration: float = 60,
+    num_users: int = 100,
+    eager: bool = True,
+    sample_interval: float = 1,
+    drain_timeout: float = 120,
+    idle_timeout: float = 5,
+    throttling: bool = False,
+) -> SoakReport:
+    """Create notifications at a constant rate and measure whether forwarding keeps up.
+
+    Notifications due since the last tick are created together in one transaction.
+    After duration seconds no more notifications are created
+    and the test waits until all have been forwarded or drain_timeout has elapsed.
+    The pipeline counts as saturated when the backlog grew
+    by more than 5% of the target rate per second while creating notifications.
+
+    In eager mode tasks are run in the current process, else by Celery workers.
+    CPU usage of this process and DB queries of all its threads are only reported
+    in eager mode. Queries for creating notifications are not counted.
+    See _throttling() for how throttling is handled.
+
+    Soak test users are created for the run and deleted afterwards.
+    """
+    samples = []
+    stop_sampling = threading.Event()
+    query_counter = _QueryCounter()
+    created = [0]
+    try:
+        with _prepared_run(num_users, eager, throttling) as users, _counting_queries(
+            query_counter, eager
+        ):
+            started = time.monotonic()
+            sampler = threading.Thread(
+                target=_sample,
+                args=(proxy, created, samples, started, sample_interval, stop_sampling),
+                kwargs={"measure_cpu": eager},
+                daemon=True,
+            )
+            sampler.start()
+            end = started + duration
+            while True:
+                now = time.monotonic()
+                if now >= end:
+                    break
+                due = int((now - started) * rate) + 1 - created[0]
+                if due <= 0:
+                    time.sleep(min(0.01, end - now))
+                    continue
+                # queries after commit are for forwarding
+                with transaction.atomic(), query_counter.creating():
+                    for _ in range(due):
+                        num = created[0]
+                        notify(
+                            users[num % num_users],
+                            title=f"Soak test notification #{num + 1}",
+                            message="This notification was created by a soak test.",
+                        )
+                        created[0] += 1
+            production_duration = time.monotonic() - started
+            delivered_while_producing = len(proxy.received_uids)
+            production_ended_at = time.time()
+            _drain(proxy, drain_timeout, idle_timeout)
+            stop_sampling.set()
+            sampler.join()
+    finally:
+        stop_sampling.set()
+    notifications = created[0]
+    messages = len(proxy.received_uids)
+    latencies = sorted(proxy.latencies)
+    backlog_samples = [
+        (sample["elapsed"], sample["backlog"])
+        for sample in samples
+        if sample["elapsed"] <= production_duration
+    ]
+    growth = _slope(backlog_samples)
+    cpu_samples = [
+        sample["cpu_percent"] for sample in samples if sample["cpu_percent"] is not None
+    ]
+    if messages >= notifications and proxy.last_received_at:
+        drain_duration = max(0, proxy.last_received_at - production_ended_at)
+    else:
+        drain_duration = None
+    return SoakReport(
+        version=__version__,
+        mode="eager" if eager else "worker",
+        throttling=throttling if eager else None,
+        target_rate=rate,
+        duration=production_duration,
+        users=num_users,
+        notifications=notifications,
+        enqueue_rate=notifications / production_duration,
+        messages=messages,
+        delivery_rate=delivered_while_producing / production_duration,
+        max_backlog=max((sample["backlog"] for sample in samples), default=0),
+        backlog_growth_per_second=growth,
+        saturated=growth > rate * 0.05,
+        drain_duration=drain_duration,
+        latency_p50=_percentile(latencies, 50),
+        latency_p99=_percentile(latencies, 99),
+        cpu_percent=sum(cpu_samples) / len(cpu_samples) if cpu_samples else None,
+        db_queries_per_notification=(
+            query_counter.count / notifications if eager and notifications else None
+        ),
+        samples=samples,
+    )
+
+
+class _QueryCounter:
+    """Counts DB queries of all threads,
+    except for those made while creating notifications.
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        if not getattr(self._local, "is_creating", False):
+            with self._lock:
+                self.count += 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def creating(self):
+        self._local.is_creating = True
+        try:
+            yield
+        finally:
+            self._local.is_creating = False
+
+
+@contextmanager
+def _counting_queries(query_counter: _QueryCounter, enabled: bool = True):
+    """Count queries on the connection of this thread
+    and on all connections created meanwhile.
+    """
+    if not enabled:
+        yield
+        return
+    wrapped = []
+
+    def install(connection, **kwargs):
+        if query_counter not in connection.execute_wrappers:
+            connection.execute_wrappers.append(query_counter)
+            wrapped.append(connection)
+
+    install(connection)
+    connection_created.connect(install, weak=False)
+    try:
+        yield
+    finally:
+        connection_created.disconnect(install)
+        for obj in wrapped:
+            if query_counter in obj.execute_wrappers:
+                obj.execute_wrappers.remove(query_counter)
+
+
+def _sample(
+    proxy: FakeDiscordProxy,
+    created: List[int],
+    samples: List[dict],
+    started: float,
+    interval: float,
+    stop: threading.Event,
+    measure_cpu: bool = True,
+) -> None:
+    """Record the progress every interval seconds until stopped.
+
+    CPU usage is measured for this process, including all its threads.
+    """
+    last_time = time.monotonic()
+    last_cpu = time.process_time()
+    while not stop.wait(interval):
+        now = time.monotonic()
+        cpu = time.process_time()
+        delivered = len(proxy.received_uids)
+        samples.append(
+            {
+                "elapsed": round(now - started, 3),
+                "created": created[0],
+                "delivered": delivered,
+                "backlog": max(0, created[0] - delivered),
+                "cpu_percent": (
+                    round((cpu - last_cpu) / (now - last_time) * 100, 1)
+                    if measure_cpu
+                    else None
+                ),
+            }
+        )
+        last_time = now
+        last_cpu = cpu
+
+
+def _slope(points: List[Tuple[float, float]]) -> float:
+    """Return the slope of the least squares line through points."""
+    if len(points) < 2:
+        return 0.0
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if not variance:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+
+@contextmanager
+def _throttling(enabled: bool):
+    """Replace rate limiter, circuit breaker and deduplicator of this process,
+    so a run measures forwarding and does not touch their production state.
+
+    Without throttling requests are neither paced nor stopped.
+    With throttling the configured rate limiter and circuit breaker are used,
+    but with their own cache keys. Duplicates are never suppressed.
+
+    Celery workers keep their own, so in worker mode throttling is as configured.
+    """
+    if enabled:
+        limiter = _create_rate_limiter()
+        breaker = _create_circuit_breaker()
+        for obj in (limiter, breaker):
+            if hasattr(obj, "CACHE_KEY_PREFIX"):
+                obj.CACHE_KEY_PREFIX = f"{CACHE_KEY_PREFIX}_{obj.CACHE_KEY_PREFIX}"
+    else:
+        limiter = NoRateLimiter(global_limit=1, user_limit=1, user_period=1)
+        breaker = NoCircuitBreaker(threshold=0, reset_timeout=0)
+    replacements = {
+        "rate_limiter": limiter,
+        "circuit_breaker": breaker,
+        "deduplicator": Deduplicator(timeout=0),
+    }
+    modules = [core, tasks]
+    try:
+        from ... import aio
+    except ImportError:
+        pass
+    else:
+        modules.append(aio)
+    originals = []
+    for module in modules:
+        for name, obj in replacements.items():
+            if hasattr(module, name):
+                originals.append((module, name, getattr(module, name)))
+                setattr(module, name, obj)
+    try:
+        yield
+    finally:
+        for module, name, obj in reversed(originals):
+            setattr(module, name, obj)
+
+
+@contextmanager
+def _prepared_run(num_users: int, eager: bool, throttling: bool):
+    """Create users for a run and delete them afterwards.
+
+    Meanwhile tasks are run eagerly when eager is True
+    and throttling is replaced as described for _throttling().
+    """
+    users = _create_users(num_users)
+    try:
+        with _tasks_always_eager(eager), _throttling(throttling):
+            yield users
+    finally:
+        _delete_users()
+
+
+def _drain(proxy: FakeDiscordProxy, timeout: float, idle_timeout: float) -> None:
+    """Dispatch all pending notifications and wait until they were forwarded."""
+    _flush_batchers()
+    _wait_until_idle(proxy, timeout, idle_timeout)
+
+
+def _flush_batchers() -> None:
+    """Dispatch all pending notifications now."""
+    priority_batcher.flush()
+    broadcast_detector.flush()
+    notification_batcher.flush()
+    digest_batcher.flush()
+
+
+def _create_users(num_users: int) -> List[User]:
+    users = []
+    for num in range(num_users):
+        user, _ = User.objects.get_or_create(username=f"{USERNAME_PREFIX}{num + 1}")
+        DiscordUser.objects.get_or_create(
+            user=user, defaults={"uid": DISCORD_UID_OFFSET + num + 1}
+        )
+        users.append(user)
+    return users
+
+
+def _delete_users() -> None:
+    """Delete benchmark users.
+
+    Discord accounts are deleted first, so Auth does not try to remove
+    those users from the Discord server.
+    """
+    DiscordUser.objects.filter(user__username__startswith=USERNAME_PREFIX).delete()
+    User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+
+@contextmanager
+def _tasks_always_eager(eager: bool):
+    """Run tasks eagerly in this process when eager is True."""
+    if not eager:
+        yield
+        return
+    changes = current_app.conf.changes
+    had_change = "task_always_eager" in changes
+    old_value = changes.get("task_always_eager")
+    current_app.conf.task_always_eager = True
+    try:
+        yield
+    finally:
+        if had_change:
+            current_app.conf.task_always_eager = old_value
+        else:
+            changes.pop("task_always_eager", None)
+
+
+def _wait_until_idle(
+    proxy: FakeDiscordProxy, timeout: float, idle_timeout: float
+) -> None:
+    """Wait until the proxy has received no requests for idle_timeout seconds."""
+    deadline = time.monotonic() + timeout
+    last_requests = -1
+    idle_since = time.monotonic()
+    while time.monotonic() < deadline:
+        if proxy.requests != last_requests:
+            last_requests = proxy.requests
+            idle_since = time.monotonic()
+        elif time.monotonic() - idle_since >= idle_timeout:
+            return
+        time.sleep(0.1)
+
+
+def _percentile(values: List[float], percent: float) -> Optional[float]:
+    """Return the percentile of sorted values with the nearest-rank method."""
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[int(rank) - 1]
+
+
+class FakeProxyCommand(BaseCommand, ABC):
+    """Base for commands which create notifications for users created for a run
+    and forward them to a fake Discord Proxy.
+
+    Subclasses describe what a run creates, run it and write its report.
+    """
+
+    # name of a run in messages
+    run_name = "run"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--mode",
+            choices=["eager", "worker"],
+            default="eager",
+            help=(
+                "Run tasks in this process (eager) "
+                "or with Celery workers on this host (worker)"
+            ),
+        )
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.05,
+            help="Latency of the fake Discord Proxy in seconds",
+        )
+        parser.add_argument(
+            "--error-rate",
+            type=float,
+            default=0,
+            help="Share of requests failing with UNAVAILABLE",
+        )
+        parser.add_argument(
+            "--rate-limit-rate",
+            type=float,
+            default=0,
+            help="Share of requests failing with a rate limit",
+        )
+        parser.add_argument(
+            "--throttling",
+            action="store_true",
+            help=(
+                "Pace and stop requests with the configured rate limiter "
+                "and circuit breaker (only in eager mode)"
+            ),
+        )
+        parser.add_argument(
+            "--noinput",
+            "--no-input",
+            action="store_true",
+            help="Do NOT prompt the user for input of any kind.",
+        )
+
+    def handle(self, *args, **options):
+        if not DISCORDNOTIFY_ENABLED:
+            raise CommandError("Discord Notify is disabled.")
+        if proxy_balancer.targets != [f"localhost:{DISCORDNOTIFY_DISCORDPROXY_PORT}"]:
+            raise CommandError(
+                f"The {self.run_name} can not be run "
+                "with DISCORDNOTIFY_DISCORDPROXY_TARGETS."
+            )
+        self.check_options(options)
+        out = self.messages_out()
+        out.write(
+            f"{__title__}: This {self.run_name} will create "
+            f"{self.describe(options)} and delete them afterwards. "
+            f"It needs port {DISCORDNOTIFY_DISCORDPROXY_PORT} for a fake Discord Proxy, "
+            "so Discord Proxy must not be running."
+        )
+        if not options["noinput"]:
+            user_input = input("Are you sure you want to proceed? (y/N)?")
+            if user_input.lower() != "y":
+                out.write(self.style.WARNING("Aborted"))
+                return
+        proxy = FakeDiscordProxy(
+            latency=options["latency"],
+            error_rate=options["error_rate"],
+            rate_limit_rate=options["rate_limit_rate"],
+        )
+        try:
+            proxy.start(DISCORDNOTIFY_DISCORDPROXY_PORT)
+        except RuntimeError as ex:
+            raise CommandError(str(ex)) from ex
+        try:
+            report = self.run(
+                proxy,
+                eager=options["mode"] == "eager",
+                throttling=options["throttling"],
+                options=options,
+            )
+        finally:
+            proxy.stop()
+        self.write_report(report, options)
+
+    def messages_out(self):
+        """Return the stream for messages other than the report."""
+        return self.stdout
+
+    def check_options(self, options: dict) -> None:
+        """Raise CommandError for invalid options."""
+
+    @abstractmethod
+    def describe(self, options: dict) -> str:
+        """Return what a run will create, e.g. users and notifications."""
+
+    @abstractmethod
+    def run(
+        self, proxy: FakeDiscordProxy, eager: bool, throttling: bool, options: dict
+    ) -> NamedTuple:
+        """Forward the notifications of a run and return its report."""
+
+    @abstractmethod
+    def write_report(self, report: NamedTuple, options: dict) -> None:
+        """Write the report of a run."""
@@ -0,0 +1,240 @@
+import argparse
+import datetime as dt
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from allianceauth.notifications.models import Notification
+
+from ... import __title__
+from ...app_settings import (
+    DISCORDNOTIFY_BATCH_SIZE,
+    DISCORDNOTIFY_DELIVERY_LOG_ENABLED,
+    DISCORDNOTIFY_ENABLED,
+    DISCORDNOTIFY_MARK_AS_VIEWED,
+)
+from ...core import (
+    create_payloads,
+    forward_notifications_to_channel,
+    forward_notifications_to_discord,
+    retry_countdown,
+)
+from ...models import DeliveryRecord, FailedDelivery, HeldNotification
+from ...tasks import start_channel_forwarding_task, start_forwarding_task
+
+
+def datetime_arg(value: str) -> dt.datetime:
+    """Parse a date or datetime given as command argument."""
+    result = parse_datetime(value)
+    if result is None:
+        date = parse_date(value)
+        if date is None:
+            raise argparse.ArgumentTypeError(f"Invalid date or datetime: {value}")
+        result = dt.datetime.combine(date, dt.time())
+    if timezone.is_naive(result):
+        result = timezone.make_aware(result)
+    return result
+
+
+class Command(BaseCommand):
+    help = (
+        "Forward notifications created within a time range, "
+        "which were never forwarded, e.g. because the app was disabled"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--since",
+            type=datetime_arg,
+            required=True,
+            help="Only forward notifications created at or after this date or datetime",
+        )
+        parser.add_argument(
+            "--until",
+            type=datetime_arg,
+            help=(
+                "Only forward notifications created before this date or datetime. "
+                "Default is now."
+            ),
+        )
+        parser.add_argument(
+            "--include-viewed",
+            action="store_true",
+            help="Also forward notifications which were already viewed",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=DISCORDNOTIFY_BATCH_SIZE,
+            help="Number of notifications forwarded by each task",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=2000,
+            help="Number of notifications fetched from the database at once",
+        )
+        parser.add_argument(
+            "--direct",
+            action="store_true",
+            help=(
+                "Forward notifications from this process instead of starting tasks. "
+                "Notifications which need to be retried are still handed to tasks."
+            ),
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help=(
+                "Run even though already forwarded notifications can not be told "
+                "apart, since neither DISCORDNOTIFY_MARK_AS_VIEWED "
+                "nor DISCORDNOTIFY_DELIVERY_LOG_ENABLED is enabled"
+            ),
+        )
+        parser.add_argument(
+            "--noinput",
+            "--no-input",
+            action="store_true",
+            help="Do NOT prompt the user for input of any kind.",
+        )
+
+    def handle(self, *args, **options):
+        if not DISCORDNOTIFY_ENABLED:
+            raise CommandError("Discord Notify is disabled.")
+        if not (
+            DISCORDNOTIFY_MARK_AS_VIEWED
+            or DISCORDNOTIFY_DELIVERY_LOG_ENABLED
+            or options["force"]
+        ):
+            raise CommandError(
+                "Can not tell which notifications were already forwarded, "
+                "so they would be sent again. Enable DISCORDNOTIFY_MARK_AS_VIEWED "
+                "or DISCORDNOTIFY_DELIVERY_LOG_ENABLED or use --force."
+            )
+        until = options["until"] or timezone.now()
+        if options["since"] >= until:
+            raise CommandError("--since must be before --until.")
+        notifications = self._notifications(
+            options["since"], until, options["include_viewed"]
+        )
+        total = notifications.count()
+        if not total:
+            self.stdout.write("No notifications found.")
+            return
+        self.stdout.write(f"{__title__}: Found {total:,} notifications to forward.")
+        if not options["noinput"]:
+            user_input = input("Are you sure you want to proceed? (y/N)?")
+            if user_input.lower() != "y":
+                self.stdout.write(self.style.WARNING("Aborted"))
+                return
+        batch_size = max(1, options["batch_size"])
+        chunk_size = max(batch_size, options["chunk_size"])
+        started = time.monotonic()
+        processed = 0
+        forwarded = 0
+        last_id = 0
+        while True:
+            # keyset pagination keeps every query fast and memory constant
+            page = notifications.filter(id__gt=last_id).order_by("id")[:chunk_size]
+            page_count = 0
+            batch = []
+            for notification in page.iterator(chunk_size=chunk_size):
+                page_count += 1
+                last_id = notification.id
+                batch.append(notification)
+                if len(batch) >= batch_size:
+                    forwarded += self._forward(batch, options["direct"])
+                    batch = []
+            if batch:
+                forwarded += self._forward(batch, options["direct"])
+            processed += page_count
+            if page_count:
+                rate = processed / max(time.monotonic() - started, 0.001)
+                self.stdout.write(
+                    f"Processed {processed:,} / {total:,} notifications, "
+                    f"forwarding {forwarded:,} ({rate:,.0f} / s)"
+                )
+            if page_count < chunk_size:
+                break
+        self.stdout.write(self.style.SUCCESS("Done"))
+
+    @staticmethod
+    def _notifications(since: dt.datetime, until: dt.datetime, include_viewed: bool):
+        notifications = Notification.objects.filter(
+            timestamp__gte=since, timestamp__lt=until
+        ).only("id", "user_id", "title", "message", "level", "timestamp")
+        if not include_viewed:
+            notifications = notifications.filter(viewed=False)
+        # failed deliveries are delivered again with discordnotify_redrive
+        # and held notifications are released by the scheduler
+        return (
+            notifications.exclude(
+                Exists(FailedDelivery.objects.filter(notification_id=OuterRef("pk")))
+            )
+            .exclude(
+                Exists(HeldNotification.objects.filter(notification_id=OuterRef("pk")))
+            )
+            .exclude(
+                Exists(
+                    DeliveryRecord.objects.filter(
+                        notification_id=OuterRef("pk"),
+                        status__in=[
+                            DeliveryRecord.Status.SENT,
+                            DeliveryRecord.Status.SUPPRESSED,
+                        ],
+                    )
+                )
+            )
+        )
+
+    @staticmethod
+    def _forward(notifications: list, direct: bool) -> int:
+        routed = create_payloads(notifications)
+        # backfilled notifications are not urgent anymore
+        lanes = [(routed.normal + routed.priority, False), (routed.digest, True)]
+        forwarded = 0
+        for payloads, digest in lanes:
+            if not payloads:
+                continue
+            if direct:
+                pending = forward_notifications_to_discord(
+                    payloads, digest=digest, skip_dedup=True
+                )
+                if pending.postponed:
+                    start_forwarding_task(
+                        pending.postponed,
+                        countdown=retry_countdown(0),
+                        digest=digest,
+                        skip_dedup=True,
+                    )
+                if pending.retry:
+                    start_forwarding_task(
+                        pending.retry,
+                        attempt=1,
+                        countdown=retry_countdown(0),
+                        digest=digest,
+                    )
+            else:
+                start_forwarding_task(payloads, digest=digest, skip_dedup=True)
+            forwarded += len(payloads)
+        for channel_id, payloads in routed.channels.items():
+            if direct:
+                pending = forward_notifications_to_channel(channel_id, payloads)
+                if pending.postponed:
+                    start_channel_forwarding_task(
+                        channel_id, pending.postponed, countdown=retry_countdown(0)
+                    )
+                if pending.retry:
+                    start_channel_forwarding_task(
+                        channel_id,
+                        pending.retry,
+                        attempt=1,
+                        countdown=retry_countdown(0),
+                    )
+            else:
+                start_channel_forwarding_task(channel_id, payloads)
+            forwarded += len(payloads)
+        return forwarded
@@ -0,0 +1,66 @@
+import json
+
+from django.core.management.base import CommandError
+
+from ._benchmark import FakeProxyCommand, run_benchmark
+
+
+class Command(FakeProxyCommand):
+    help = (
+        "Measure the throughput of forwarding notifications "
+        "with a fake Discord Proxy. Do NOT run this on a production system."
+    )
+    run_name = "benchmark"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--notifications",
+            type=int,
+            default=10000,
+            help="Number of notifications to create",
+        )
+        parser.add_argument(
+            "--users", type=int, default=1000, help="Number of users to create"
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=600,
+            help="Max duration of the benchmark in seconds",
+        )
+        parser.add_argument(
+            "--json", action="store_true", help="Output the report as JSON"
+        )
+        super().add_arguments(parser)
+
+    def check_options(self, options):
+        if options["notifications"] < 1 or options["users"] < 1:
+            raise CommandError("Need at least one notification and one user.")
+
+    def describe(self, options):
+        return (
+            f"{options['users']:,} users "
+            f"and {options['notifications']:,} notifications"
+        )
+
+    def run(self, proxy, eager, throttling, options):
+        return run_benchmark(
+            proxy,
+            num_notifications=options["notifications"],
+            num_users=options["users"],
+            eager=eager,
+            throttling=throttling,
+            timeout=options["timeout"],
+        )
+
+    def write_report(self, report, options):
+        if options["json"]:
+            self.stdout.write(json.dumps(report._asdict(), indent=2))
+            return
+        for key, value in report._asdict().items():
+            if isinstance(value, float):
+                value = f"{value:,.3f}"
+            elif value is None:
+                value = "-"
+            self.stdout.write(f"{key.replace('_', ' ').capitalize()}: {value}")
+        self.stdout.write(self.style.SUCCESS("Done"))
@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ... import __title__
+from ...app_settings import DISCORDNOTIFY_BATCH_SIZE
+from ...core import NotificationPayload
+from ...models import FailedDelivery
+from ...tasks import start_channel_forwarding_task, start_forwarding_task
+
+
+class Command(BaseCommand):
+    help = "Deliver failed notifications to Discord again"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--status-code",
+            help="Only deliver notifications that failed with this gRPC status code",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=DISCORDNOTIFY_BATCH_SIZE,
+            help="Number of notifications forwarded by each task",
+        )
+        parser.add_argument(
+            "--noinput",
+            "--no-input",
+            action="store_true",
+            help="Do NOT prompt the user for input of any kind.",
+        )
+
+    def handle(self, *args, **options):
+        failed_deliveries = FailedDelivery.objects.all()
+        if options["status_code"]:
+            failed_deliveries = failed_deliveries.filter(
+                status_code=options["status_code"].upper()
+            )
+        total = failed_deliveries.count()
+        if not total:
+            self.stdout.write("No failed deliveries found.")
+            return
+        self.stdout.write(f"{__title__}: Found {total:,} failed deliveries.")
+        if not options["noinput"]:
+            user_input = input("Are you sure you want to proceed? (y/N)?")
+            if user_input.lower() != "y":
+                self.stdout.write(self.style.WARNING("Aborted"))
+                return
+        batch_size = max(1, options["batch_size"])
+        last_id = 0
+        redriven = 0
+        while True:
+            batch = list(
+                failed_deliveries.filter(id__gt=last_id)
+                .select_related("notification")
+                .order_by("id")[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+            channels = {}
+            for obj in batch:
+                channels.setdefault(obj.channel_id, []).append(
+                    NotificationPayload.from_notification(
+                        obj.notification, obj.discord_uid
+                    )
+                )
+            with transaction.atomic():
+                FailedDelivery.objects.filter(id__in=[obj.id for obj in batch]).delete()
+                for channel_id, payloads in channels.items():
+                    transaction.on_commit(
+                        lambda channel_id=channel_id, payloads=payloads: (
+                            start_channel_forwarding_task(channel_id, payloads)
+                            if channel_id
+                            else start_forwarding_task(payloads, skip_dedup=True)
+                        )
+                    )
+            redriven += len(batch)
+            self.stdout.write(f"Started delivery for {redriven:,} / {total:,}")
+        self.stdout.write(self.style.SUCCESS("Done"))
@@ -0,0 +1,94 @@
+import json
+
+from django.core.management.base import CommandError
+
+from ._benchmark import FakeProxyCommand, run_soak_test
+
+
+class Command(FakeProxyCommand):
+    help = (
+        "Create notifications at a constant rate for a while "
+        "and report whether forwarding them to a fake Discord Proxy keeps up. "
+        "Do NOT run this on a production system."
+    )
+    run_name = "soak test"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=50,
+            help="Number of notifications to create per second",
+        )
+        parser.add_argument(
+            "--duration",
+            type=float,
+            default=60,
+            help="Time in seconds for creating notifications",
+        )
+        parser.add_argument(
+            "--users", type=int, default=100, help="Number of users to create"
+        )
+        parser.add_argument(
+            "--sample-interval",
+            type=float,
+            default=1,
+            help="Time in seconds between samples of the backlog",
+        )
+        parser.add_argument(
+            "--drain-timeout",
+            type=float,
+            default=120,
+            help="Max time in seconds for forwarding the backlog at the end",
+        )
+        parser.add_argument(
+            "--output", help="Write the JSON report to this file instead of stdout"
+        )
+        super().add_arguments(parser)
+
+    def messages_out(self):
+        # stdout is kept for the report
+        return self.stderr
+
+    def check_options(self, options):
+        if options["rate"] <= 0 or options["duration"] <= 0 or options["users"] < 1:
+            raise CommandError(
+                "Need a positive rate and duration and at least one user."
+            )
+        if options["sample_interval"] <= 0:
+            raise CommandError("--sample-interval must be positive.")
+
+    def describe(self, options):
+        return (
+            f"{options['users']:,} users "
+            f"and about {int(options['rate'] * options['duration']):,} notifications"
+        )
+
+    def run(self, proxy, eager, throttling, options):
+        return run_soak_test(
+            proxy,
+            rate=options["rate"],
+            duration=options["duration"],
+            num_users=options["users"],
+            eager=eager,
+            throttling=throttling,
+            sample_interval=options["sample_interval"],
+            drain_timeout=options["drain_timeout"],
+        )
+
+    def write_report(self, report, options):
+        output = json.dumps(report._asdict(), indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(output + "\n")
+        else:
+            self.stdout.write(output)
+        if report.saturated:
+            self.stderr.write(
+                self.style.WARNING(
+                    f"Saturated: The backlog grew by "
+                    f"{report.backlog_growth_per_second:,.1f} notifications per second."
+                )
+            )
+        else:
+            self.stderr.write(self.style.SUCCESS("Done"))
@@ -0,0 +1,302 @@
+"""Metrics about forwarding notifications in the Prometheus text format."""
+
+import atexit
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import grpc
+
+from django.core.cache import cache
+
+from .app_settings import DISCORDNOTIFY_METRICS_ENABLED, DISCORDNOTIFY_METRICS_SHARED
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsRegistry:
+    """Registry for metrics.
+
+    Values are kept in the current process. In shared mode values are collected
+    locally and added to counters in Django's cache with every flush,
+    so the metrics of all processes are aggregated.
+    Unforced flushes write to the cache at most once every flush_interval seconds.
+    """
+
+    CACHE_KEY_PREFIX = "DISCORDNOTIFY_METRICS"
+    # values are stored as integers in Django's cache with this precision
+    SCALE = 1000
+
+    def __init__(
+        self, enabled: bool = True, shared: bool = False, flush_interval: float = 10
+    ) -> None:
+        self.enabled = enabled
+        self.shared = shared
+        self.flush_interval = flush_interval
+        self._metrics = []
+        self._values: Dict[str, float] = {}
+        self._pending: Dict[str, float] = {}
+        self._next_flush = 0.0
+        self._lock = threading.Lock()
+
+    def register(self, metric: "Metric") -> None:
+        self._metrics.append(metric)
+
+    def add(self, samples: Iterable[Tuple[str, float]]) -> None:
+        """Add amounts to samples."""
+        with self._lock:
+            values = self._pending if self.shared else self._values
+            for sample, amount in samples:
+                values[sample] = values.get(sample, 0) + amount
+
+    def flush(self, force: bool = True) -> None:
+        """Add pending values to Django's cache. Does nothing when not shared.
+
+        Unless forced pending values are only written when the flush interval
+        has passed since the last write.
+        """
+        if not self.shared:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if not self._pending or (not force and now < self._next_flush):
+                return
+            self._next_flush = now + self.flush_interval
+            pending, self._pending = self._pending, {}
+            for sample, amount in pending.items():
+                self._values[sample] = self._values.get(sample, 0) + amount
+            known_samples = set(self._values.keys())
+        for sample, amount in pending.items():
+            key = self._make_key(sample)
+            cache.add(key, 0, timeout=None)
+            try:
+                cache.incr(key, int(round(amount * self.SCALE)))
+            except ValueError:  # key was deleted in between
+                cache.set(key, int(round(amount * self.SCALE)), timeout=None)
+        index = set(cache.get(self._index_key(), []))
+        if not known_samples <= index:
+            cache.set(self._index_key(), sorted(index | known_samples), timeout=None)
+
+    def values(self) -> Dict[str, float]:
+        """Return current values of all samples."""
+        if not self.shared:
+            with self._lock:
+                return dict(self._values)
+        self.flush()
+        samples = cache.get(self._index_key(), [])
+        values = cache.get_many([self._make_key(sample) for sample in samples])
+        return {
+            sample: values.get(self._make_key(sample), 0) / self.SCALE
+            for sample in samples
+        }
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text format."""
+        values = self.values()
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.TYPE}")
+            for sample in metric.samples(values):
+                lines.append(f"{sample} {_format_value(values[sample])}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self) -> None:
+        """Clear all values, including those in Django's cache when shared."""
+        with self._lock:
+            self._values.clear()
+            self._pending.clear()
+        if self.shared:
+            samples = cache.get(self._index_key(), [])
+            cache.delete_many([self._make_key(sample) for sample in samples])
+            cache.delete(self._index_key())
+
+    def _index_key(self) -> str:
+        return f"{self.CACHE_KEY_PREFIX}_index"
+
+    def _make_key(self, sample: str) -> str:
+        return f"{self.CACHE_KEY_PREFIX}_{sample}"
+
+
+class Metric:
+    """Base class for metrics."""
+
+    TYPE = "untyped"
+
+    def __init__(
+        self,
+        registry: MetricsRegistry,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._registry = registry
+        registry.register(self)
+
+    def samples(self, values: Dict[str, float]) -> List[str]:
+        """Return the samples of this metric within values."""
+        return sorted(
+            sample
+            for sample in values.keys()
+            if sample.split("{", 1)[0] in self._sample_names()
+        )
+
+    def _sample_names(self) -> Tuple[str, ...]:
+        return (self.name,)
+
+    def _sample(self, suffix: str, labels: dict, **extra_labels) -> str:
+        if set(labels.keys()) != set(self.labelnames):
+            raise ValueError(f"Labels must be: {', '.join(self.labelnames)}")
+        labels = {**labels, **extra_labels}
+        if not labels:
+            return f"{self.name}{suffix}"
+        label_str = ",".join(
+            f'{key}="{_escape(str(value))}"' for key, value in labels.items()
+        )
+        return f"{self.name}{suffix}{{{label_str}}}"
+
+
+class Counter(Metric):
+    """A value which can only go up."""
+
+    TYPE = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if self._registry.enabled and amount:
+            self._registry.add([(self._sample("", labels), amount)])
+
+
+class Histogram(Metric):
+    """Observations counted in cumulative buckets."""
+
+    TYPE = "histogram"
+
+    def __init__(self, *args, buckets: Iterable[float], **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels) -> None:
+        self.observe_many([value], **labels)
+
+    def observe_many(self, values: Iterable[float], **labels) -> None:
+        if not self._registry.enabled:
+            return
+        counts = [0] * len(self.buckets)
+        total = 0
+        num = 0
+        for value in values:
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[idx] += 1
+            total += value
+            num += 1
+        if not num:
+            return
+        samples = [
+            (self._sample("_bucket", labels, le=_format_value(bound)), count)
+            for bound, count in zip(self.buckets, counts)
+        ]
+        samples.append((self._sample("_sum", labels), total))
+        samples.append((self._sample("_count", labels), num))
+        self._registry.add(samples)
+
+    def samples(self, values: Dict[str, float]) -> List[str]:
+        samples = super().samples(values)
+        suffix_order = {"_bucket": 0, "_sum": 1, "_count": 2}
+        return sorted(
+            samples,
+            key=lambda sample: (
+                suffix_order[sample.split("{", 1)[0][len(self.name) :]],
+                _bucket_bound(sample),
+            ),
+        )
+
+    def _sample_names(self) -> Tuple[str, ...]:
+        return (f"{self.name}_bucket", f"{self.name}_sum", f"{self.name}_count")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _bucket_bound(sample: str) -> float:
+    _, sep, rest = sample.partition('le="')
+    if not sep:
+        return 0
+    bound = rest.split('"', 1)[0]
+    return float("inf") if bound == "+Inf" else float(bound)
+
+
+registry = MetricsRegistry(
+    enabled=DISCORDNOTIFY_METRICS_ENABLED, shared=DISCORDNOTIFY_METRICS_SHARED
+)
+atexit.register(registry.flush)
+
+notifications_seen = Counter(
+    registry,
+    "discordnotify_notifications_seen_total",
+    "New notifications seen by Discord Notify.",
+)
+notifications_forwarded = Counter(
+    registry,
+    "discordnotify_notifications_forwarded_total",
+    "Notifications successfully forwarded to Discord.",
+)
+notifications_skipped = Counter(
+    registry,
+    "discordnotify_notifications_skipped_total",
+    "New notifications which were not forwarded.",
+    labelnames=["reason"],
+)
+rpc_duration_seconds = Histogram(
+    registry,
+    "discordnotify_rpc_duration_seconds",
+    "Duration of requests to Discord Proxy.",
+    buckets=[0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+)
+rpc_errors = Counter(
+    registry,
+    "discordnotify_rpc_errors_total",
+    "Failed requests to Discord Proxy by gRPC status code.",
+    labelnames=["code"],
+)
+delivery_lag_seconds = Histogram(
+    registry,
+    "discordnotify_delivery_lag_seconds",
+    "Time from creating a notification until it was sent to Discord.",
+    buckets=[0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600],
+)
+batch_size = Histogram(
+    registry,
+    "discordnotify_batch_size",
+    "Number of notifications forwarded together by a task.",
+    buckets=[1, 5, 10, 25, 50, 100, 250, 500],
+)
+uid_cache_hits = Counter(
+    registry,
+    "discordnotify_uid_cache_hits_total",
+    "Users whose Discord UID was found in the cache.",
+)
+uid_cache_misses = Counter(
+    registry,
+    "discordnotify_uid_cache_misses_total",
+    "Users whose Discord UID had to be fetched from the database.",
+)
+
+
+def record_rpc(duration: float, error: Optional[grpc.RpcError] = None) -> None:
+    """Record metrics about a request to Discord Proxy."""
+    rpc_duration_seconds.observe(duration)
+    if error is not None:
+        rpc_errors.inc(code=error.code().name)
@@ -0,0 +1,48 @@
+# Generated by Django 3.1.14 on 2026-10-17 14:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ("notifications", "0005_fix_level_choices"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FailedDelivery",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("discord_uid", models.BigIntegerField()),
+                (
+                    "status_code",
+                    models.CharField(
+                        help_text="gRPC status code of the last attempt", max_length=32
+                    ),
+                ),
+                ("details", models.TextField(blank=True, default="")),
+                ("attempts", models.PositiveIntegerField(default=1)),
+                ("created_at", models.DateTimeField(auto_now_add=True, db_index=True)),
+                (
+                    "notification",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="notifications.notification",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 3.1.14 on 2026-10-17 15:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("discordnotify", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeliveryRecord",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("notification_id", models.PositiveIntegerField()),
+                ("discord_uid", models.BigIntegerField()),
+                (
+                    "status",
+                    models.PositiveSmallIntegerField(
+                        choices=[
+                            (1, "sent"),
+                            (2, "failed"),
+                            (3, "suppressed duplicate"),
+                        ]
+                    ),
+                ),
+                ("attempts", models.PositiveSmallIntegerField(default=1)),
+                (
+                    "latency_ms",
+                    models.PositiveIntegerField(
+                        default=None,
+                        help_text="Time from creating the notification until it was forwarded",
+                        null=True,
+                    ),
+                ),
+                ("sent_at", models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="deliveryrecord",
+            index=models.Index(
+                fields=["notification_id", "status"],
+                name="discordnoti_notific_d08865_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="deliveryrecord",
+            index=models.Index(
+                fields=["discord_uid", "sent_at"], name="discordnoti_discord_0f733f_idx"
+            ),
+        ),
+    ]
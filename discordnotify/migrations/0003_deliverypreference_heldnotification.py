@@ -0,0 +1,100 @@
+# Generated by Django 3.1.14 on 2026-10-17 15:22
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("notifications", "0005_fix_level_choices"),
+        ("discordnotify", "0002_deliveryrecord"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="HeldNotification",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("discord_uid", models.BigIntegerField()),
+                ("release_at", models.DateTimeField()),
+                (
+                    "notification",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="notifications.notification",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="DeliveryPreference",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "quiet_hours_start",
+                    models.TimeField(
+                        blank=True,
+                        default=None,
+                        help_text="In the user's timezone",
+                        null=True,
+                    ),
+                ),
+                (
+                    "quiet_hours_end",
+                    models.TimeField(
+                        blank=True,
+                        default=None,
+                        help_text="In the user's timezone",
+                        null=True,
+                    ),
+                ),
+                ("timezone", models.CharField(default="UTC", max_length=64)),
+                (
+                    "min_interval",
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text="Deliver notifications at most every this many minutes",
+                    ),
+                ),
+                (
+                    "last_delivered_at",
+                    models.DateTimeField(blank=True, default=None, null=True),
+                ),
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="discordnotify_preference",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="heldnotification",
+            index=models.Index(
+                fields=["release_at", "discord_uid"],
+                name="discordnoti_release_1f8b56_idx",
+            ),
+        ),
+    ]
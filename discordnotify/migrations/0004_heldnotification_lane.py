@@ -0,0 +1,22 @@
+# Generated by Django 3.1.14 on 2026-10-17 16:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("discordnotify", "0003_deliverypreference_heldnotification"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="heldnotification",
+            name="lane",
+            field=models.PositiveSmallIntegerField(
+                choices=[(1, "normal"), (2, "digest")],
+                default=1,
+                help_text="Lane the notification is forwarded in when released",
+            ),
+        ),
+    ]
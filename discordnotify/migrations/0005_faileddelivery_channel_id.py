@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-17 17:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("discordnotify", "0004_heldnotification_lane"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="faileddelivery",
+            name="channel_id",
+            field=models.BigIntegerField(
+                blank=True,
+                default=None,
+                help_text="Discord channel the notification was redirected to",
+                null=True,
+            ),
+        ),
+    ]
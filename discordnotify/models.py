@@ -0,0 +1,125 @@
+import pytz
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import models
+
+from allianceauth.notifications.models import Notification
+
+
+class FailedDelivery(models.Model):
+    """A notification that could not be delivered to Discord.
+
+    Can be delivered again with the management command discordnotify_redrive.
+    Notifications redirected to a channel are delivered to that channel again.
+    """
+
+    notification = models.ForeignKey(
+        Notification, on_delete=models.CASCADE, related_name="+"
+    )
+    discord_uid = models.BigIntegerField()
+    channel_id = models.BigIntegerField(
+        null=True,
+        default=None,
+        blank=True,
+        help_text="Discord channel the notification was redirected to",
+    )
+    status_code = models.CharField(
+        max_length=32, help_text="gRPC status code of the last attempt"
+    )
+    details = models.TextField(default="", blank=True)
+    attempts = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self) -> str:
+        return f"{self.notification_id}:{self.discord_uid}:{self.status_code}"
+
+
+class DeliveryRecord(models.Model):
+    """The outcome of forwarding a notification to a Discord user.
+
+    Notifications are referenced by ID only,
+    so records are kept when notifications are deleted.
+    Records are pruned after DISCORDNOTIFY_DELIVERY_LOG_RETENTION days.
+    """
+
+    class Status(models.IntegerChoices):
+        SENT = 1, "sent"
+        FAILED = 2, "failed"
+        SUPPRESSED = 3, "suppressed duplicate"
+
+    notification_id = models.PositiveIntegerField()
+    discord_uid = models.BigIntegerField()
+    status = models.PositiveSmallIntegerField(choices=Status.choices)
+    attempts = models.PositiveSmallIntegerField(default=1)
+    latency_ms = models.PositiveIntegerField(
+        null=True,
+        default=None,
+        help_text="Time from creating the notification until it was forwarded",
+    )
+    sent_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["notification_id", "status"]),
+            models.Index(fields=["discord_uid", "sent_at"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.notification_id}:{self.discord_uid}:{self.get_status_display()}"
+
+
+class DeliveryPreference(models.Model):
+    """When a user wants to receive non-urgent notifications on Discord."""
+
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, related_name="discordnotify_preference"
+    )
+    quiet_hours_start = models.TimeField(
+        null=True, default=None, blank=True, help_text="In the user's timezone"
+    )
+    quiet_hours_end = models.TimeField(
+        null=True, default=None, blank=True, help_text="In the user's timezone"
+    )
+    timezone = models.CharField(max_length=64, default="UTC")
+    min_interval = models.PositiveIntegerField(
+        default=0,
+        help_text="Deliver notifications at most every this many minutes",
+    )
+    last_delivered_at = models.DateTimeField(null=True, default=None, blank=True)
+
+    def __str__(self) -> str:
+        return str(self.user)
+
+    def clean(self):
+        try:
+            pytz.timezone(self.timezone)
+        except pytz.UnknownTimeZoneError:
+            raise ValidationError({"timezone": "Unknown timezone"}) from None
+        if (self.quiet_hours_start is None) != (self.quiet_hours_end is None):
+            raise ValidationError("Quiet hours need a start and an end")
+
+
+class HeldNotification(models.Model):
+    """A notification held back until it can be delivered."""
+
+    class Lane(models.IntegerChoices):
+        NORMAL = 1, "normal"
+        DIGEST = 2, "digest"
+
+    notification = models.ForeignKey(
+        Notification, on_delete=models.CASCADE, related_name="+"
+    )
+    discord_uid = models.BigIntegerField()
+    release_at = models.DateTimeField()
+    lane = models.PositiveSmallIntegerField(
+        choices=Lane.choices,
+        default=Lane.NORMAL,
+        help_text="Lane the notification is forwarded in when released",
+    )
+
+    class Meta:
+        indexes = [models.Index(fields=["release_at", "discord_uid"])]
+
+    def __str__(self) -> str:
+        return f"{self.notification_id}:{self.discord_uid}:{self.release_at}"
@@ -0,0 +1,285 @@
+"""Pacing of requests to Discord Proxy, so we stay within Discord's rate limits."""
+
+import asyncio
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import grpc
+
+from django.core.cache import cache
+
+from allianceauth.services.hooks import get_extension_logger
+from app_utils.logging import LoggerAddTag
+
+from . import __title__
+from .app_settings import (
+    DISCORDNOTIFY_RATE_LIMIT_ENABLED,
+    DISCORDNOTIFY_RATE_LIMIT_GLOBAL,
+    DISCORDNOTIFY_RATE_LIMIT_PER_USER,
+    DISCORDNOTIFY_RATE_LIMIT_PER_USER_PERIOD,
+    DISCORDNOTIFY_RATE_LIMIT_PRIORITY_RESERVED,
+    DISCORDNOTIFY_RATE_LIMIT_SHARED,
+)
+
+logger = LoggerAddTag(get_extension_logger(__name__), __title__)
+
+
+class RateLimit(NamedTuple):
+    """A rate limit reported by Discord.
+
+    Rate limits parsed from Discord Proxy errors are never global,
+    because Discord Proxy does not report that.
+    """
+
+    retry_after: float
+    is_global: bool
+
+
+def parse_rate_limit(error: grpc.RpcError) -> Optional[RateLimit]:
+    """Parse the rate limit from an error returned by Discord Proxy.
+
+    Discord Proxy reports HTTP errors from Discord as JSON details
+    with the HTTP status and Discord's error message,
+    but without the time to wait or whether the rate limit is global.
+    A rate limited user is therefore blocked
+    for DISCORDNOTIFY_RATE_LIMIT_PER_USER_PERIOD seconds.
+
+    Returns None if the error is not about a rate limit.
+    """
+    if error.code() != grpc.StatusCode.RESOURCE_EXHAUSTED:
+        return None
+    try:
+        details = json.loads(error.details())
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(details, dict) or details.get("status") != 429:
+        return None
+    return RateLimit(
+        retry_after=float(DISCORDNOTIFY_RATE_LIMIT_PER_USER_PERIOD), is_global=False
+    )
+
+
+class RateLimiter(ABC):
+    """Base class for rate limiters.
+
+    Each request needs a token from the global bucket
+    and from the bucket of the DM channel of its user.
+
+    Requests with normal priority can not use the last priority_reserved tokens
+    of the global bucket, so requests with high priority never wait behind them.
+    """
+
+    GLOBAL_PERIOD = 1
+
+    def __init__(
+        self,
+        global_limit: int,
+        user_limit: int,
+        user_period: float,
+        priority_reserved: int = 0,
+    ) -> None:
+        self.global_limit = global_limit
+        self.user_limit = user_limit
+        self.user_period = user_period
+        self.priority_reserved = max(0, min(priority_reserved, global_limit - 1))
+
+    @abstractmethod
+    def reserve(self, discord_uid: int, high_priority: bool = False) -> float:
+        """Try to take tokens for sending a message to a user.
+
+        Returns 0 when tokens were taken, else the seconds to wait before trying again.
+        """
+
+    @abstractmethod
+    def penalize(self, discord_uid: int, rate_limit: RateLimit) -> None:
+        """Block sending for a user or globally after Discord reported a rate limit."""
+
+    def acquire(self, discord_uid: int, high_priority: bool = False) -> None:
+        """Wait until a message can be sent to a user."""
+        while True:
+            wait = self.reserve(discord_uid, high_priority)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(
+        self, discord_uid: int, high_priority: bool = False
+    ) -> None:
+        """Wait until a message can be sent to a user without blocking the loop.
+
+        Tokens are reserved in the default executor of the loop,
+        since that can mean a round trip to Django's cache.
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            wait = await loop.run_in_executor(
+                None, self.reserve, discord_uid, high_priority
+            )
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+class LocalRateLimiter(RateLimiter):
+    """Rate limiter with token buckets in the current process."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._blocked_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, discord_uid: int, high_priority: bool = False) -> float:
+        user_key = f"user_{discord_uid}"
+        now = time.monotonic()
+        global_floor = 0 if high_priority else self.priority_reserved
+        with self._lock:
+            wait = max(
+                self._blocked_until.get("global", 0) - now,
+                self._blocked_until.get(user_key, 0) - now,
+            )
+            if wait > 0:
+                return wait
+            buckets = (
+                ("global", self.global_limit, self.GLOBAL_PERIOD, global_floor),
+                (user_key, self.user_limit, self.user_period, 0),
+            )
+            for key, capacity, period, floor in buckets:
+                wait = max(
+                    wait, self._wait_for_token(key, capacity, period, now, floor)
+                )
+            if wait > 0:
+                return wait
+            for key, capacity, period, _ in buckets:
+                tokens, _ = self._refill(key, capacity, period, now)
+                self._buckets[key] = (tokens - 1, now)
+            self._forget_full_buckets(now)
+        return 0
+
+    def penalize(self, discord_uid: int, rate_limit: RateLimit) -> None:
+        key = "global" if rate_limit.is_global else f"user_{discord_uid}"
+        with self._lock:
+            self._blocked_until[key] = time.monotonic() + rate_limit.retry_after
+
+    def _wait_for_token(self, key, capacity, period, now, floor=0) -> float:
+        """Return seconds to wait until a token above floor is available."""
+        tokens, _ = self._refill(key, capacity, period, now)
+        if tokens >= 1 + floor:
+            return 0
+        return (1 + floor - tokens) * period / capacity
+
+    def _refill(self, key, capacity, period, now) -> Tuple[float, float]:
+        tokens, updated_at = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * capacity / period)
+        return tokens, now
+
+    def _forget_full_buckets(self, now) -> None:
+        """Remove buckets which are full again, so memory stays bounded."""
+        if len(self._buckets) < 10000:
+            return
+        for key in list(self._buckets.keys()):
+            if key != "global" and now - self._buckets[key][1] > self.user_period:
+                del self._buckets[key]
+        for key in [key for key, until in self._blocked_until.items() if until < now]:
+            del self._blocked_until[key]
+
+
+class CacheRateLimiter(RateLimiter):
+    """Rate limiter with buckets in Django's cache, which are shared by all workers.
+
+    Buckets are refilled completely at the start of each period.
+    """
+
+    CACHE_KEY_PREFIX = "DISCORDNOTIFY_RATE_LIMIT"
+
+    def reserve(self, discord_uid: int, high_priority: bool = False) -> float:
+        now = time.time()
+        blocked_keys = [self._blocked_key("global"), self._blocked_key(discord_uid)]
+        blocked_until = cache.get_many(blocked_keys).values()
+        wait = max([until - now for until in blocked_until] + [0])
+        if wait > 0:
+            return wait
+        global_reserved = 0 if high_priority else self.priority_reserved
+        buckets = []
+        for name, capacity, period in (
+            (f"user_{discord_uid}", self.user_limit, self.user_period),
+            ("global", self.global_limit - global_reserved, self.GLOBAL_PERIOD),
+        ):
+            window = int(now // period)
+            key = f"{self.CACHE_KEY_PREFIX}_{name}_{window}"
+            buckets.append((key, capacity, period, (window + 1) * period - now))
+        counts = cache.get_many([key for key, *_ in buckets])
+        wait = max(
+            [
+                refill_in
+                for key, capacity, _, refill_in in buckets
+                if (counts.get(key) or 0) >= capacity
+            ]
+            + [0]
+        )
+        if wait > 0:
+            return wait
+        taken = []
+        for key, capacity, period, refill_in in buckets:
+            cache.add(key, 0, timeout=int(period) + 1)
+            try:
+                count = cache.incr(key)
+            except ValueError:  # key has expired in between
+                count = 1
+            taken.append(key)
+            if count > capacity:
+                # another worker took the last token in between
+                self._give_back(taken)
+                return refill_in
+        return 0
+
+    def penalize(self, discord_uid: int, rate_limit: RateLimit) -> None:
+        key = self._blocked_key("global" if rate_limit.is_global else discord_uid)
+        cache.set(
+            key,
+            time.time() + rate_limit.retry_after,
+            timeout=int(rate_limit.retry_after) + 1,
+        )
+
+    @staticmethod
+    def _give_back(keys) -> None:
+        """Return the tokens taken from these buckets."""
+        for key in keys:
+            try:
+                cache.decr(key)
+            except ValueError:  # key has expired in between
+                pass
+
+    def _blocked_key(self, name) -> str:
+        return f"{self.CACHE_KEY_PREFIX}_blocked_{name}"
+
+
+class NoRateLimiter(RateLimiter):
+    """Rate limiter that never waits."""
+
+    def reserve(self, discord_uid: int, high_priority: bool = False) -> float:
+        return 0
+
+    def penalize(self, discord_uid: int, rate_limit: RateLimit) -> None:
+        pass
+
+
+def _create_rate_limiter() -> RateLimiter:
+    if not DISCORDNOTIFY_RATE_LIMIT_ENABLED:
+        RateLimiterClass = NoRateLimiter
+    elif DISCORDNOTIFY_RATE_LIMIT_SHARED:
+        RateLimiterClass = CacheRateLimiter
+    else:
+        RateLimiterClass = LocalRateLimiter
+    return RateLimiterClass(
+        global_limit=DISCORDNOTIFY_RATE_LIMIT_GLOBAL,
+        user_limit=DISCORDNOTIFY_RATE_LIMIT_PER_USER,
+        user_period=DISCORDNOTIFY_RATE_LIMIT_PER_USER_PERIOD,
+        priority_reserved=DISCORDNOTIFY_RATE_LIMIT_PRIORITY_RESERVED,
+    )
+
+
+rate_limiter = _create_rate_limiter()
@@ -0,0 +1,287 @@
+"""Routing of notifications into lanes and by user defined rules."""
+
+import re
+import threading
+from collections import OrderedDict
+from typing import (
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Pattern,
+    Set,
+    Tuple,
+)
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+
+from allianceauth.notifications.models import Notification
+
+from .app_settings import (
+    DISCORDNOTIFY_PRIORITY_GROUPS,
+    DISCORDNOTIFY_PRIORITY_LEVELS,
+    DISCORDNOTIFY_PRIORITY_TITLE_PATTERN,
+    DISCORDNOTIFY_RULES,
+)
+from .caches import NO_MEMBERSHIP, Membership, membership_cache
+
+# actions of rules
+FORWARD = "forward"
+DROP = "drop"
+DIGEST = "digest"
+REDIRECT = "redirect"
+
+ACTIONS = frozenset({FORWARD, DROP, DIGEST, REDIRECT})
+RULE_KEYS = frozenset({"levels", "groups", "states", "title", "action", "channel"})
+
+
+class PriorityRouter:
+    """Decides which notifications are forwarded in the high priority lane.
+
+    A notification has high priority when its level is one of levels,
+    its user is a member of one of groups or its title matches title_pattern.
+    """
+
+    def __init__(
+        self, levels: Iterable[str], groups: Iterable[str], title_pattern: str
+    ) -> None:
+        self.levels = frozenset(levels)
+        self.groups = frozenset(groups)
+        self.title_regex = re.compile(title_pattern) if title_pattern else None
+
+    def high_priority_user_ids(self, user_ids: Iterable[int]) -> Set[int]:
+        """Return IDs of users who are members of a priority group."""
+        if not self.groups:
+            return set()
+        return set(
+            User.groups.through.objects.filter(
+                user_id__in=user_ids, group__name__in=self.groups
+            ).values_list("user_id", flat=True)
+        )
+
+    def is_high_priority(
+        self, notification: Notification, high_priority_user_ids: Set[int] = None
+    ) -> bool:
+        if notification.level in self.levels:
+            return True
+        if high_priority_user_ids and notification.user_id in high_priority_user_ids:
+            return True
+        return bool(self.title_regex and self.title_regex.search(notification.title))
+
+
+priority_router = PriorityRouter(
+    levels=DISCORDNOTIFY_PRIORITY_LEVELS,
+    groups=DISCORDNOTIFY_PRIORITY_GROUPS,
+    title_pattern=DISCORDNOTIFY_PRIORITY_TITLE_PATTERN,
+)
+
+
+class RuleAction(NamedTuple):
+    """What to do with a notification."""
+
+    action: str
+    channel_id: Optional[int] = None
+
+
+DEFAULT_ACTION = RuleAction(FORWARD)
+
+
+class Rule(NamedTuple):
+    """A compiled routing rule. Empty conditions match everything."""
+
+    levels: FrozenSet[str]
+    groups: FrozenSet[str]
+    states: FrozenSet[str]
+    title_regex: Optional[Pattern]
+    result: RuleAction
+
+    def matches(self, title: str, membership: Membership) -> bool:
+        """Report whether the rule matches. The level is matched by the index."""
+        return self.matches_membership(membership) and (
+            not self.title_regex or bool(self.title_regex.search(title))
+        )
+
+    def matches_membership(self, membership: Membership) -> bool:
+        """Report whether the conditions on groups and states match."""
+        if self.groups and self.groups.isdisjoint(membership.groups):
+            return False
+        return not self.states or membership.state in self.states
+
+
+class TitleMatcher:
+    """Matches a title against the title conditions of many rules at once.
+
+    Every pattern is put into an optional lookahead with a named group,
+    so one match of the combined regex tells which patterns occur in a title.
+    Patterns with their own groups or with inline flags can not be combined
+    and are searched separately.
+    """
+
+    def __init__(self, rules: Iterable[Rule]) -> None:
+        parts = []
+        self._separate: Dict[int, Pattern] = {}
+        for idx, rule in enumerate(rules):
+            regex = rule.title_regex
+            if not regex:
+                continue
+            if regex.groups or regex.flags != re.UNICODE:
+                self._separate[idx] = regex
+            else:
+                parts.append(rf"(?:(?=[\s\S]*?(?P<r{idx}>{regex.pattern}))|)")
+        self._combined = re.compile(r"\A" + "".join(parts)) if parts else None
+
+    def matching(self, title: str) -> Set[int]:
+        """Return the indexes of the rules whose title pattern occurs in title."""
+        result = set()
+        if self._combined:
+            match = self._combined.match(title)
+            result.update(
+                int(name[1:]) for name, value in match.groupdict().items() if value
+            )
+        result.update(
+            idx for idx, regex in self._separate.items() if regex.search(title)
+        )
+        return result
+
+
+def compile_rules(configs: Iterable[dict]) -> List[Rule]:
+    """Compile rules from their configuration.
+
+    Raises ImproperlyConfigured for invalid rules.
+    """
+    rules = []
+    for num, config in enumerate(configs, start=1):
+        if not isinstance(config, dict):
+            raise ImproperlyConfigured(f"DISCORDNOTIFY_RULES: rule {num} is no dict")
+        unknown_keys = config.keys() - RULE_KEYS
+        if unknown_keys:
+            raise ImproperlyConfigured(
+                f"DISCORDNOTIFY_RULES: rule {num} has unknown keys: "
+                + ", ".join(sorted(unknown_keys))
+            )
+        action = config.get("action", FORWARD)
+        if action not in ACTIONS:
+            raise ImproperlyConfigured(
+                f"DISCORDNOTIFY_RULES: rule {num} has invalid action: {action}"
+            )
+        channel_id = None
+        if action == REDIRECT:
+            try:
+                channel_id = int(config["channel"])
+            except (KeyError, TypeError, ValueError):
+                raise ImproperlyConfigured(
+                    f"DISCORDNOTIFY_RULES: rule {num} needs a channel ID for redirect"
+                ) from None
+        for key in ("levels", "groups", "states"):
+            if not isinstance(config.get(key, []), (list, tuple)):
+                raise ImproperlyConfigured(
+                    f"DISCORDNOTIFY_RULES: rule {num} needs a list for {key}"
+                )
+        try:
+            title_regex = re.compile(config["title"]) if config.get("title") else None
+        except re.error as ex:
+            raise ImproperlyConfigured(
+                f"DISCORDNOTIFY_RULES: rule {num} has invalid title pattern: {ex}"
+            ) from None
+        rules.append(
+            Rule(
+                levels=frozenset(config.get("levels", [])),
+                groups=frozenset(config.get("groups", [])),
+                states=frozenset(config.get("states", [])),
+                title_regex=title_regex,
+                result=RuleAction(action, channel_id),
+            )
+        )
+    return rules
+
+
+class RuleEngine:
+    """Decides what to do with notifications according to rules.
+
+    Rules are indexed by level, so only rules which can match the level
+    of a notification are checked. Their title patterns are checked
+    with one combined regex per level. The first matching rule wins
+    and notifications matching no rule are forwarded.
+    Memberships of users are taken from the membership cache
+    and only when a rule has conditions on groups or states.
+    Decisions are memoized, since titles tend to repeat.
+    """
+
+    MAX_MEMO_SIZE = 4096
+
+    def __init__(self, rules: Iterable[Rule]) -> None:
+        self.rules = tuple(rules)
+        self._any_level = self._index(rule for rule in self.rules if not rule.levels)
+        levels = {level for rule in self.rules for level in rule.levels}
+        self._by_level: Dict[str, Tuple[tuple, TitleMatcher]] = {
+            level: self._index(
+                rule for rule in self.rules if not rule.levels or level in rule.levels
+            )
+            for level in levels
+        }
+        self.needs_membership = any(rule.groups or rule.states for rule in self.rules)
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def is_enabled(self) -> bool:
+        return bool(self.rules)
+
+    def decide(
+        self, level: str, title: str, membership: Membership = NO_MEMBERSHIP
+    ) -> RuleAction:
+        """Return the action for a notification."""
+        candidates, title_matcher = self._by_level.get(level, self._any_level)
+        if not candidates:
+            return DEFAULT_ACTION
+        key = (level, title, membership)
+        with self._lock:
+            try:
+                result = self._memo[key]
+            except KeyError:
+                pass
+            else:
+                self._memo.move_to_end(key)
+                return result
+        title_matches = title_matcher.matching(title)
+        result = next(
+            (
+                rule.result
+                for idx, rule in enumerate(candidates)
+                if (not rule.title_regex or idx in title_matches)
+                and rule.matches_membership(membership)
+            ),
+            DEFAULT_ACTION,
+        )
+        with self._lock:
+            self._memo[key] = result
+            if len(self._memo) > self.MAX_MEMO_SIZE:
+                self._memo.popitem(last=False)
+        return result
+
+    @staticmethod
+    def _index(rules: Iterable[Rule]) -> Tuple[tuple, TitleMatcher]:
+        rules = tuple(rules)
+        return rules, TitleMatcher(rules)
+
+    def decide_many(self, notifications: List[Notification]) -> List[RuleAction]:
+        """Return the actions for notifications in the same order."""
+        if not self.rules:
+            return [DEFAULT_ACTION] * len(notifications)
+        memberships = {}
+        if self.needs_membership:
+            memberships = membership_cache.get_many(
+                {obj.user_id for obj in notifications}
+            )
+        return [
+            self.decide(
+                obj.level, obj.title, memberships.get(obj.user_id, NO_MEMBERSHIP)
+            )
+            for obj in notifications
+        ]
+
+
+rule_engine = RuleEngine(compile_rules(DISCORDNOTIFY_RULES))
@@ -0,0 +1,139 @@
+"""Deferred delivery of non-urgent notifications according to user preferences."""
+
+import datetime as dt
+from typing import Iterable, List, Optional
+
+import pytz
+
+from django.db.models import F
+from django.utils import timezone
+
+from allianceauth.services.hooks import get_extension_logger
+from app_utils.logging import LoggerAddTag
+
+from . import __title__
+from .app_settings import DISCORDNOTIFY_SCHEDULER_ENABLED
+from .core import NotificationPayload
+from .models import DeliveryPreference, HeldNotification
+
+logger = LoggerAddTag(get_extension_logger(__name__), __title__)
+
+
+def next_delivery_time(preference: DeliveryPreference, now: dt.datetime) -> dt.datetime:
+    """Return the earliest time a notification can be delivered to a user."""
+    release_at = now
+    if preference.min_interval and preference.last_delivered_at:
+        release_at = max(
+            now,
+            preference.last_delivered_at
+            + dt.timedelta(minutes=preference.min_interval),
+        )
+    quiet_hours_end = _quiet_hours_end(preference, release_at)
+    return quiet_hours_end or release_at
+
+
+def _quiet_hours_end(
+    preference: DeliveryPreference, moment: dt.datetime
+) -> Optional[dt.datetime]:
+    """Return when the quiet hours end if moment is within them, else None."""
+    start = preference.quiet_hours_start
+    end = preference.quiet_hours_end
+    if start is None or end is None or start == end:
+        return None
+    try:
+        tz = pytz.timezone(preference.timezone)
+    except pytz.UnknownTimeZoneError:
+        tz = pytz.utc
+    local_moment = moment.astimezone(tz)
+    local_time = local_moment.time()
+    end_date = local_moment.date()
+    if start < end:
+        if not start <= local_time < end:
+            return None
+    else:  # quiet hours span midnight
+        if end <= local_time < start:
+            return None
+        if local_time >= start:
+            end_date += dt.timedelta(days=1)
+    return tz.localize(dt.datetime.combine(end_date, end)).astimezone(pytz.utc)
+
+
+class DeliveryScheduler:
+    """Holds back non-urgent notifications for users with delivery preferences.
+
+    Held notifications are stored with their release time
+    and forwarded by the periodic task task_release_held_notifications.
+    """
+
+    def __init__(self, enabled: bool) -> None:
+        self.enabled = enabled
+
+    def hold(
+        self, payloads: List[NotificationPayload], digest: bool = False
+    ) -> List[NotificationPayload]:
+        """Hold back payloads for users who do not want them now.
+
+        With digest the payloads are from the digest lane
+        and are released into it again.
+        Returns the payloads to forward now.
+        """
+        if not self.enabled or not payloads:
+            return payloads
+        preferences = {
+            obj.discord_uid: obj
+            for obj in DeliveryPreference.objects.filter(
+                user__discord__uid__in={payload.discord_uid for payload in payloads}
+            ).annotate(discord_uid=F("user__discord__uid"))
+        }
+        if not preferences:
+            return payloads
+        now = timezone.now()
+        release_times = {
+            discord_uid: next_delivery_time(preference, now)
+            for discord_uid, preference in preferences.items()
+        }
+        payloads_now = []
+        held = []
+        for payload in payloads:
+            release_at = release_times.get(payload.discord_uid)
+            if release_at and release_at > now:
+                held.append(
+                    HeldNotification(
+                        notification_id=payload.notification_id,
+                        discord_uid=payload.discord_uid,
+                        release_at=release_at,
+                        lane=(
+                            HeldNotification.Lane.DIGEST
+                            if digest
+                            else HeldNotification.Lane.NORMAL
+                        ),
+                    )
+                )
+            else:
+                payloads_now.append(payload)
+        if held:
+            HeldNotification.objects.bulk_create(held, batch_size=500)
+            logger.info("Holding back %d notifications", len(held))
+        self.mark_delivered(
+            [
+                discord_uid
+                for discord_uid, release_at in release_times.items()
+                if release_at <= now and preferences[discord_uid].min_interval
+            ],
+            now,
+        )
+        return payloads_now
+
+    @staticmethod
+    def mark_delivered(discord_uids: Iterable[int], now: dt.datetime) -> None:
+        """Record that notifications have been delivered to these users now,
+        which starts their next interval.
+        """
+        discord_uids = list(discord_uids)
+        if discord_uids:
+            DeliveryPreference.objects.filter(
+                user__discord__uid__in=discord_uids, min_interval__gt=0
+            ).update(last_delivered_at=now)
+
+
+delivery_scheduler = DeliveryScheduler(enabled=DISCORDNOTIFY_SCHEDULER_ENABLED)
@@ -1,14 +1,35 @@
-from django.core.exceptions import ObjectDoesNotExist
-from django.db.models.signals import post_save
+from typing import List
+
+from celery.signals import worker_process_shutdown
+
+from django.contrib.auth.models import User
+from django.core.signals import setting_changed
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 
+from allianceauth.authentication.models import UserProfile
 from allianceauth.notifications.models import Notification
 from allianceauth.services.hooks import get_extension_logger
+from allianceauth.services.modules.discord.models import DiscordUser
 from app_utils.logging import LoggerAddTag
 
 from . import __title__
-from .app_settings import DISCORDNOTIFY_ENABLED, DISCORDNOTIFY_SUPERUSER_ONLY
-from .tasks import task_forward_notification_to_discord
+from .app_settings import DISCORDNOTIFY_ENABLED
+from .batching import (
+    OnCommitCollector,
+    broadcast_detector,
+    digest_batcher,
+    notification_batcher,
+    priority_batcher,
+)
+from .caches import discord_uid_cache, membership_cache
+from .channels import channel_pool
+from .core import create_payloads
+from .embeds import embed_template
+from .inprocess import inprocess_sender
+from .metrics import notifications_seen, registry
+from .scheduling import delivery_scheduler
+from .tasks import start_channel_forwarding_task
 
 logger = LoggerAddTag(get_extension_logger(__name__), __title__)
 
@@ -16,27 +37,83 @@ logger = LoggerAddTag(get_extension_logger(__name__), __title__)
 @receiver(post_save, sender=Notification)
 def forward_new_notifications(instance, created, **kwargs):
     if DISCORDNOTIFY_ENABLED:
-        if created and (not DISCORDNOTIFY_SUPERUSER_ONLY or instance.user.is_superuser):
+        if created:
             logger.info(
-                "Processing notification %d for: %s", instance.id, instance.user
-            )
-            try:
-                discord_uid = instance.user.discord.uid
-            except (AttributeError, ObjectDoesNotExist):
-                logger.info(
-                    "Can not forward notification to user %s, because he has no Discord account",
-                    instance.user,
-                )
-                return
-            # we are passing through the instance attributes, because it is not garanteed
-            # that the object has already been saved
-            task_forward_notification_to_discord.delay(
-                notification_id=instance.id,
-                discord_uid=discord_uid,
-                title=instance.title,
-                message=instance.message,
-                level=instance.level,
-                timestamp=instance.timestamp.isoformat(),
+                "Processing notification %d for user %d", instance.id, instance.user_id
             )
+            new_notifications_collector.add(instance)
         else:
-            logger.debug("Ignoring notification %d for: %s", instance.id, instance.user)
+            logger.debug(
+                "Ignoring notification %d for user %d", instance.id, instance.user_id
+            )
+
+
+def _forward_notifications(notifications: List[Notification]):
+    """Forward notifications to their users on Discord.
+
+    Notifications with high priority are dispatched separately and immediately.
+    Others can be held back according to the delivery preferences of their users.
+    Notifications redirected to channels are dispatched immediately.
+    Identical notifications for many users can be collapsed into a broadcast.
+    """
+    try:
+        notifications_seen.inc(len(notifications))
+        routed = create_payloads(notifications)
+        priority_batcher.extend(routed.priority)
+        broadcast_detector.extend(delivery_scheduler.hold(routed.normal))
+        digest_batcher.extend(delivery_scheduler.hold(routed.digest, digest=True))
+        for channel_id, payloads in routed.channels.items():
+            start_channel_forwarding_task(channel_id, payloads)
+    except Exception:
+        logger.exception("Failed to forward %d notifications", len(notifications))
+    finally:
+        registry.flush(force=False)
+
+
+new_notifications_collector = OnCommitCollector(process=_forward_notifications)
+
+
+@receiver(post_save, sender=DiscordUser)
+@receiver(post_delete, sender=DiscordUser)
+def invalidate_discord_uid(instance, **kwargs):
+    discord_uid_cache.invalidate(instance.user_id)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_membership_groups(instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if not reverse:
+        membership_cache.invalidate(instance.pk)
+    elif pk_set:
+        for user_id in pk_set:
+            membership_cache.invalidate(user_id)
+    else:  # all users were removed from a group
+        membership_cache.clear()
+
+
+@receiver(post_save, sender=UserProfile)
+def invalidate_membership_state(instance, **kwargs):
+    membership_cache.invalidate(instance.user_id)
+
+
+@receiver(setting_changed)
+def clear_embed_template(**kwargs):
+    embed_template.clear()
+
+
+@worker_process_shutdown.connect
+def close_grpc_channels(**kwargs):
+    priority_batcher.flush()
+    broadcast_detector.flush()
+    notification_batcher.flush()
+    digest_batcher.flush()
+    inprocess_sender.drain()
+    channel_pool.close()
+    try:
+        from .aio import aio_channel_pool
+    except ImportError:
+        pass
+    else:
+        aio_channel_pool.close()
+    registry.flush()
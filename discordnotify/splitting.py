@@ -0,0 +1,62 @@
+"""Splitting of long texts into parts, which fit into a Discord message."""
+
+from typing import List
+
+TRUNCATION_MARKER = " [...]"
+
+# separators for breaking texts in order of preference
+SEPARATORS = ("\n\n", "\n", " ")
+
+
+def split_text(text: str, max_length: int, max_parts: int = 0) -> List[str]:
+    """Split a text into the fewest parts of at most max_length characters.
+
+    Parts are filled greedily and broken at paragraphs, lines or words
+    within the second half of a part, else hard.
+    When there are more than max_parts parts (if given),
+    the last part is truncated and marked with TRUNCATION_MARKER.
+
+    Runs in linear time. Every character is searched at most twice
+    and copied once into its part.
+    """
+    if max_length <= len(TRUNCATION_MARKER):
+        raise ValueError("max_length too small")
+    parts = []
+    text_length = len(text)
+    start = _skip_whitespace(text, 0)
+    while start < text_length:
+        if text_length - start <= max_length:
+            parts.append(text[start:])
+            break
+        if max_parts and len(parts) == max_parts - 1:
+            end = _trim_end(text, start, start + max_length - len(TRUNCATION_MARKER))
+            parts.append(text[start:end] + TRUNCATION_MARKER)
+            break
+        end = _break_position(text, start, max_length)
+        parts.append(text[start : _trim_end(text, start, end)])
+        start = _skip_whitespace(text, end)
+    return parts
+
+
+def _break_position(text: str, start: int, max_length: int) -> int:
+    """Return the position for breaking the part starting at start."""
+    limit = start + max_length
+    min_end = start + max_length // 2
+    for separator in SEPARATORS:
+        position = text.rfind(separator, min_end, limit)
+        if position != -1:
+            return position
+    return limit
+
+
+def _skip_whitespace(text: str, position: int) -> int:
+    text_length = len(text)
+    while position < text_length and text[position].isspace():
+        position += 1
+    return position
+
+
+def _trim_end(text: str, start: int, end: int) -> int:
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return end
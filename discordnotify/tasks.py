@@ -1,29 +1,463 @@
+import datetime as dt
+from typing import Iterable, List
+
 from celery import shared_task
 
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
 from allianceauth.services.hooks import get_extension_logger
 from app_utils.logging import LoggerAddTag
 
 from . import __title__
-from .core import forward_notification_to_discord
+from .app_settings import (
+    DISCORDNOTIFY_BATCH_SIZE,
+    DISCORDNOTIFY_BULK_QUEUE,
+    DISCORDNOTIFY_COMPACT_PAYLOADS,
+    DISCORDNOTIFY_DELIVERY_LOG_RETENTION,
+    DISCORDNOTIFY_MAX_RETRIES,
+    DISCORDNOTIFY_PRIORITY_QUEUE,
+    DISCORDNOTIFY_SCHEDULER_RELEASE_LIMIT,
+)
+from .circuitbreaker import CircuitOpenError, circuit_breaker
+from .core import (
+    NotificationPayload,
+    forward_broadcast,
+    forward_notification_to_discord,
+    forward_notifications_to_channel,
+    forward_notifications_to_discord,
+    is_transient_error,
+    resolve_payloads,
+    retry_countdown,
+)
+from .inprocess import inprocess_sender
+from .models import DeliveryRecord, HeldNotification
+from .scheduling import delivery_scheduler
 
 logger = LoggerAddTag(get_extension_logger(__name__), __title__)
 
+# Celery priorities of the lanes. With Redis as broker lower numbers are consumed
+# first and priorities are rounded down to the steps 0, 3, 6 and 9,
+# so tasks of the normal lane wait behind high priority and other tasks
+PRIORITY_TASK_PRIORITY = 0
+BULK_TASK_PRIORITY = 6
 
-@shared_task
+# Number of delivery records deleted at once when pruning
+PRUNE_BATCH_SIZE = 1000
+
+# Ensures only one task releases held notifications at a time
+RELEASE_LOCK_KEY = "DISCORDNOTIFY_RELEASE_HELD_NOTIFICATIONS_LOCK"
+RELEASE_LOCK_TIMEOUT = 600
+
+
+@shared_task(bind=True, max_retries=None)
 def task_forward_notification_to_discord(
+    self,
     notification_id: int,
     discord_uid: int,
     title: str,
     message: str,
     level: str,
     timestamp: str,
+    parts_sent: int = 0,
 ):
     logger.info("Started task to forward notification %d", notification_id)
-    forward_notification_to_discord(
+    attempt = min(self.request.retries, DISCORDNOTIFY_MAX_RETRIES)
+    pending = forward_notification_to_discord(
         notification_id=notification_id,
         discord_uid=discord_uid,
         title=title,
         message=message,
         level=level,
         timestamp=timestamp,
+        attempt=attempt,
+        parts_sent=parts_sent,
     )
+    if pending.postponed:
+        _postpone(pending.postponed, attempt=attempt, skip_dedup=True)
+    if pending.retry:
+        raise self.retry(
+            kwargs=pending.retry[0]._asdict(), countdown=retry_countdown(attempt)
+        )
+
+
+@shared_task
+def task_forward_notifications_bulk(
+    payloads: list,
+    attempt: int = 0,
+    high_priority: bool = False,
+    digest: bool = False,
+    skip_dedup: bool = False,
+):
+    """Forward a batch of notifications.
+
+    Each payload is a NotificationPayload, which can be compact.
+    With digest the notifications of each user are combined into one message.
+    With skip_dedup duplicates are not suppressed.
+    Notifications that failed with a transient error are retried by a new task.
+    While Discord Proxy is considered down the whole batch is postponed
+    without counting as attempt, as are notifications refused during the batch.
+    """
+    logger.info("Started task to forward %d notifications", len(payloads))
+    open_for = circuit_breaker.open_for()
+    if open_for > 0:
+        logger.warning(
+            "Discord Proxy is considered down. "
+            "Postponing %d notifications for %d seconds",
+            len(payloads),
+            open_for,
+        )
+        start_forwarding_task(
+            payloads,
+            high_priority=high_priority,
+            attempt=attempt,
+            countdown=open_for,
+            digest=digest,
+            skip_dedup=skip_dedup,
+        )
+        return
+    pending = forward_notifications_to_discord(
+        resolve_payloads(payloads),
+        attempt=attempt,
+        high_priority=high_priority,
+        digest=digest,
+        skip_dedup=skip_dedup,
+    )
+    if pending.postponed:
+        # these were already checked for duplicates
+        _postpone(
+            pending.postponed,
+            high_priority=high_priority,
+            attempt=attempt,
+            digest=digest,
+            skip_dedup=True,
+        )
+    if pending.retry:
+        countdown = retry_countdown(attempt)
+        logger.warning(
+            "Retrying %d notifications in %d seconds", len(pending.retry), countdown
+        )
+        start_forwarding_task(
+            pending.retry,
+            high_priority=high_priority,
+            attempt=attempt + 1,
+            countdown=countdown,
+            digest=digest,
+        )
+
+
+def _postpone_countdown() -> float:
+    """Return the delay for notifications refused while Discord Proxy
+    was considered down. This is at least the delay of a first retry,
+    since no time is left when the circuit breaker is already probing.
+    """
+    return max(circuit_breaker.open_for(), retry_countdown(0))
+
+
+def _postpone(payloads: List[NotificationPayload], **kwargs) -> None:
+    countdown = _postpone_countdown()
+    logger.warning(
+        "Discord Proxy is considered down. "
+        "Postponing %d notifications for %d seconds",
+        len(payloads),
+        countdown,
+    )
+    start_forwarding_task(payloads, countdown=countdown, **kwargs)
+
+
+def serialize_payloads(payloads: Iterable, compact: bool = False) -> List[list]:
+    """Return payloads as plain lists for passing them to a task.
+
+    Named tuples must not be passed to tasks,
+    because some JSON serializers (e.g. simplejson) turn them into objects.
+    Jobs for in-process delivery get the same arguments,
+    so they can be handed over to Celery.
+    """
+    if compact:
+        return [NotificationPayload.compact(payload) for payload in payloads]
+    return [list(payload) for payload in payloads]
+
+
+def start_forwarding_task(
+    payloads: List[NotificationPayload],
+    high_priority: bool = False,
+    attempt: int = 0,
+    countdown: float = None,
+    digest: bool = False,
+    skip_dedup: bool = False,
+) -> None:
+    """Start a task for forwarding payloads in the lane for their priority.
+
+    Payloads to forward now are forwarded in-process when enabled,
+    except for high priority, which would queue behind bulk batches there.
+    Payloads are made compact when DISCORDNOTIFY_COMPACT_PAYLOADS is enabled.
+    """
+    if (
+        not countdown
+        and not high_priority
+        and inprocess_sender.submit(
+            task_forward_notifications_bulk,
+            payloads=serialize_payloads(payloads),
+            attempt=attempt,
+            digest=digest,
+            skip_dedup=skip_dedup,
+        )
+    ):
+        return
+    payloads = serialize_payloads(payloads, compact=DISCORDNOTIFY_COMPACT_PAYLOADS)
+    task_forward_notifications_bulk.apply_async(
+        kwargs={
+            "payloads": payloads,
+            "attempt": attempt,
+            "high_priority": high_priority,
+            "digest": digest,
+            "skip_dedup": skip_dedup,
+        },
+        countdown=countdown,
+        **_lane_options(high_priority),
+    )
+
+
+def _lane_options(high_priority: bool = False) -> dict:
+    """Return the Celery options for starting a task in a lane."""
+    if high_priority:
+        options = {"priority": PRIORITY_TASK_PRIORITY}
+        queue = DISCORDNOTIFY_PRIORITY_QUEUE
+    else:
+        options = {"priority": BULK_TASK_PRIORITY}
+        queue = DISCORDNOTIFY_BULK_QUEUE
+    if queue:
+        options["queue"] = queue
+    return options
+
+
+@shared_task
+def task_forward_notifications_to_channel(
+    channel_id: int, payloads: list, attempt: int = 0
+):
+    """Forward notifications redirected to a Discord channel.
+
+    Each payload is a NotificationPayload, which can be compact.
+    Retries and postponing work as for task_forward_notifications_bulk.
+    """
+    logger.info(
+        "Started task to forward %d notifications to channel %d",
+        len(payloads),
+        channel_id,
+    )
+    open_for = circuit_breaker.open_for()
+    if open_for > 0:
+        logger.warning(
+            "Discord Proxy is considered down. "
+            "Postponing %d notifications for %d seconds",
+            len(payloads),
+            open_for,
+        )
+        start_channel_forwarding_task(
+            channel_id, payloads, attempt=attempt, countdown=open_for
+        )
+        return
+    pending = forward_notifications_to_channel(
+        channel_id, resolve_payloads(payloads), attempt=attempt
+    )
+    if pending.postponed:
+        countdown = _postpone_countdown()
+        logger.warning(
+            "Discord Proxy is considered down. "
+            "Postponing %d notifications for %d seconds",
+            len(pending.postponed),
+            countdown,
+        )
+        start_channel_forwarding_task(
+            channel_id, pending.postponed, attempt=attempt, countdown=countdown
+        )
+    if pending.retry:
+        countdown = retry_countdown(attempt)
+        logger.warning(
+            "Retrying %d notifications in %d seconds", len(pending.retry), countdown
+        )
+        start_channel_forwarding_task(
+            channel_id, pending.retry, attempt=attempt + 1, countdown=countdown
+        )
+
+
+def start_channel_forwarding_task(
+    channel_id: int,
+    payloads: List[NotificationPayload],
+    attempt: int = 0,
+    countdown: float = None,
+) -> None:
+    """Start a task for forwarding payloads to a Discord channel."""
+    if not countdown and inprocess_sender.submit(
+        task_forward_notifications_to_channel,
+        channel_id=channel_id,
+        payloads=serialize_payloads(payloads),
+        attempt=attempt,
+    ):
+        return
+    payloads = serialize_payloads(payloads, compact=DISCORDNOTIFY_COMPACT_PAYLOADS)
+    task_forward_notifications_to_channel.apply_async(
+        kwargs={"channel_id": channel_id, "payloads": payloads, "attempt": attempt},
+        countdown=countdown,
+        **_lane_options(),
+    )
+
+
+@shared_task
+def task_forward_broadcast(
+    payload: list, recipients: list, post: bool = True, attempt: int = 0
+):
+    """Forward an identical notification for many users as one broadcast.
+
+    When the broadcast can not be posted for good,
+    the notifications are forwarded to their users as direct messages instead.
+    """
+    logger.info(
+        "Started task to forward broadcast for %d notifications", len(recipients)
+    )
+    if post:
+        open_for = circuit_breaker.open_for()
+        if open_for > 0:
+            logger.warning(
+                "Discord Proxy is considered down. "
+                "Postponing broadcast for %d seconds",
+                open_for,
+            )
+            _start_broadcast_task(payload, recipients, post, attempt, open_for)
+            return
+    payload = NotificationPayload(*payload)
+    sent, error = forward_broadcast(
+        payload,
+        [tuple(recipient) for recipient in recipients],
+        post=post,
+        attempt=attempt,
+    )
+    if not error:
+        return
+    payload = payload._replace(parts_sent=payload.parts_sent + sent)
+    if isinstance(error, CircuitOpenError):
+        countdown = _postpone_countdown()
+        logger.warning(
+            "Discord Proxy is considered down. Postponing broadcast for %d seconds",
+            countdown,
+        )
+        _start_broadcast_task(list(payload), recipients, post, attempt, countdown)
+    elif is_transient_error(error) and attempt < DISCORDNOTIFY_MAX_RETRIES:
+        countdown = retry_countdown(attempt)
+        logger.warning("Retrying broadcast in %d seconds", countdown)
+        _start_broadcast_task(list(payload), recipients, post, attempt + 1, countdown)
+    else:
+        logger.warning(
+            "Failed to post broadcast. "
+            "Forwarding %d notifications as direct messages instead",
+            len(recipients),
+        )
+        start_forwarding_task(recipients)
+
+
+def start_broadcast_task(payloads: List[NotificationPayload], post: bool = True):
+    """Start a task for forwarding identical payloads for many users as broadcast.
+
+    Without post the broadcast has already been posted.
+    """
+    recipients = [
+        [payload.notification_id, payload.discord_uid] for payload in payloads
+    ]
+    _start_broadcast_task(list(payloads[0]), recipients, post)
+
+
+def _start_broadcast_task(
+    payload: list,
+    recipients: list,
+    post: bool,
+    attempt: int = 0,
+    countdown: float = None,
+) -> None:
+    if not countdown and inprocess_sender.submit(
+        task_forward_broadcast,
+        payload=payload,
+        recipients=recipients,
+        post=post,
+        attempt=attempt,
+    ):
+        return
+    task_forward_broadcast.apply_async(
+        kwargs={
+            "payload": payload,
+            "recipients": recipients,
+            "post": post,
+            "attempt": attempt,
+        },
+        countdown=countdown,
+        **_lane_options(),
+    )
+
+
+@shared_task
+def task_prune_delivery_records():
+    """Delete delivery records older than DISCORDNOTIFY_DELIVERY_LOG_RETENTION days.
+
+    Records are deleted in small batches by primary key,
+    so the table is never locked for long.
+    """
+    cutoff = timezone.now() - dt.timedelta(days=DISCORDNOTIFY_DELIVERY_LOG_RETENTION)
+    old_records = DeliveryRecord.objects.filter(sent_at__lt=cutoff).order_by("id")
+    deleted = 0
+    while True:
+        ids = list(old_records.values_list("id", flat=True)[:PRUNE_BATCH_SIZE])
+        if not ids:
+            break
+        deleted += DeliveryRecord.objects.filter(id__in=ids).delete()[0]
+    logger.info("Deleted %d delivery records older than %s", deleted, cutoff)
+
+
+@shared_task
+def task_release_held_notifications():
+    """Forward held notifications which are due.
+
+    Notifications are released in batches ordered by release time and user,
+    so notifications of the same user usually end up in the same batch.
+    Notifications held from the digest lane are released into it again.
+    At most DISCORDNOTIFY_SCHEDULER_RELEASE_LIMIT notifications are released
+    per run, which spreads bursts (e.g. when quiet hours end) over several runs.
+    """
+    if not cache.add(RELEASE_LOCK_KEY, 1, timeout=RELEASE_LOCK_TIMEOUT):
+        logger.info("Held notifications are already being released")
+        return
+    try:
+        now = timezone.now()
+        released = 0
+        while released < DISCORDNOTIFY_SCHEDULER_RELEASE_LIMIT:
+            limit = min(
+                DISCORDNOTIFY_BATCH_SIZE,
+                DISCORDNOTIFY_SCHEDULER_RELEASE_LIMIT - released,
+            )
+            batch = list(
+                HeldNotification.objects.filter(release_at__lte=now)
+                .order_by("release_at", "discord_uid", "id")
+                .values_list("id", "notification_id", "discord_uid", "lane")[:limit]
+            )
+            if not batch:
+                break
+            lanes = {}
+            for _, notification_id, discord_uid, lane in batch:
+                lanes.setdefault(lane, []).append([notification_id, discord_uid])
+            with transaction.atomic():
+                HeldNotification.objects.filter(
+                    id__in=[obj_id for obj_id, *_ in batch]
+                ).delete()
+                delivery_scheduler.mark_delivered(
+                    {discord_uid for _, _, discord_uid, _ in batch}, now
+                )
+                for lane, payloads in lanes.items():
+                    transaction.on_commit(
+                        lambda payloads=payloads, lane=lane: start_forwarding_task(
+                            payloads, digest=lane == HeldNotification.Lane.DIGEST
+                        )
+                    )
+            released += len(batch)
+    finally:
+        cache.delete(RELEASE_LOCK_KEY)
+    if released:
+        logger.info("Released %d held notifications", released)
@@ -0,0 +1,161 @@
+import asyncio
+import threading
+from unittest.mock import patch
+
+import grpc
+from discordproxy.discord_api_pb2 import Embed
+
+from django.test import TestCase
+
+from .. import aio
+from ..balancer import ProxyBalancer
+from ..circuitbreaker import NoCircuitBreaker
+from ..core import SendResult, forward_notifications_to_discord
+from ..management.commands._benchmark import FakeDiscordProxy
+from .utils import make_payload
+
+AIO_PATH = "discordnotify.aio"
+CORE_PATH = "discordnotify.core"
+
+
+class ThreadRecordingCircuitBreaker(NoCircuitBreaker):
+    """Circuit breaker recording the threads it is called from."""
+
+    def __init__(self) -> None:
+        super().__init__(threshold=0, reset_timeout=0)
+        self.threads = set()
+
+    def allow_request(self) -> bool:
+        self.threads.add(threading.current_thread())
+        return True
+
+    def record(self, error=None) -> None:
+        self.threads.add(threading.current_thread())
+
+
+class TestAsyncSender(TestCase):
+    def setUp(self) -> None:
+        self.servicer = FakeDiscordProxy(latency=0.02, failing_uids={3})
+        port = self.servicer.start()
+        self.servicer_targets = [f"localhost:{port}"]
+        patcher = patch(
+            CORE_PATH + ".proxy_balancer", ProxyBalancer(self.servicer_targets)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.channel_pool = aio.AioChannelPool()
+        patcher = patch(AIO_PATH + ".aio_channel_pool", self.channel_pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self) -> None:
+        self.channel_pool.close()
+        self.servicer.stop()
+
+    def test_should_reuse_channels_across_batches(self):
+        # given
+        messages = [(uid, [Embed(title="title")]) for uid in range(4, 10)]
+        aio.send_messages_to_discord_users(messages, concurrency=2)
+        loop = self.channel_pool._loop
+        channel = self.channel_pool._channels[self.servicer_targets[0]]
+        # when
+        results = aio.send_messages_to_discord_users(messages, concurrency=2)
+        # then
+        self.assertEqual(results, [SendResult(1)] * 6)
+        self.assertIs(self.channel_pool._loop, loop)
+        self.assertIs(self.channel_pool._channels[self.servicer_targets[0]], channel)
+        self.assertEqual(len(self.channel_pool), 1)
+
+    def test_should_close_channels_and_stop_loop(self):
+        # given
+        aio.send_messages_to_discord_users([(4, [Embed(title="title")])], 1)
+        thread = self.channel_pool._thread
+        # when
+        self.channel_pool.close()
+        # then
+        self.assertEqual(len(self.channel_pool), 0)
+        self.assertFalse(thread.is_alive())
+
+    def test_should_send_all_messages(self):
+        # given
+        messages = [(uid, [Embed(title="title")]) for uid in range(1, 21)]
+        # when
+        results = aio.send_messages_to_discord_users(messages, concurrency=5)
+        # then
+        self.assertEqual(self.servicer.requests, 20)
+        self.assertEqual(
+            sorted(self.servicer.received_uids),
+            [uid for uid in range(1, 21) if uid != 3],
+        )
+        self.assertEqual(
+            [result.error is None for result in results],
+            [uid != 3 for uid in range(1, 21)],
+        )
+        self.assertEqual(results[2].error.code(), grpc.StatusCode.NOT_FOUND)
+
+    def test_should_respect_concurrency_limit(self):
+        # given
+        messages = [(uid, [Embed(title="title")]) for uid in range(1, 21)]
+        # when
+        aio.send_messages_to_discord_users(messages, concurrency=4)
+        # then
+        self.assertLessEqual(self.servicer.max_in_flight, 4)
+        self.assertGreater(self.servicer.max_in_flight, 1)
+
+    def test_should_send_to_other_proxy_when_one_is_down(self):
+        # given
+        other_servicer = FakeDiscordProxy()
+        other_port = other_servicer.start()
+        other_servicer.stop()  # nothing is listening on this port anymore
+        balancer = ProxyBalancer([f"localhost:{other_port}", *self.servicer_targets])
+        messages = [(uid, [Embed(title="title")]) for uid in range(4, 10)]
+        # when
+        with patch(CORE_PATH + ".proxy_balancer", balancer):
+            results = aio.send_messages_to_discord_users(messages, concurrency=2)
+        # then
+        self.assertEqual(results, [SendResult(1)] * 6)
+        self.assertEqual(sorted(self.servicer.received_uids), list(range(4, 10)))
+
+    def test_should_not_call_circuit_breaker_on_event_loop(self):
+        # given
+        circuit_breaker = ThreadRecordingCircuitBreaker()
+        messages = [(uid, [Embed(title="title")]) for uid in range(4, 10)]
+        # when
+        with patch(CORE_PATH + ".circuit_breaker", circuit_breaker):
+            results = aio.send_messages_to_discord_users(messages, concurrency=2)
+        # then
+        self.assertEqual(results, [SendResult(1)] * 6)
+        self.assertTrue(circuit_breaker.threads)
+        self.assertNotIn(self.channel_pool._thread, circuit_breaker.threads)
+
+    def test_can_run_only_without_running_event_loop(self):
+        # given
+        async def can_run():
+            return aio.can_run()
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        # when/then
+        self.assertTrue(aio.can_run())
+        self.assertFalse(loop.run_until_complete(can_run()))
+
+    @patch(CORE_PATH + ".DISCORDNOTIFY_ASYNC_SENDER", True)
+    @patch(CORE_PATH + "._send_message_to_discord_user")
+    def test_should_use_async_sender_for_batches(
+        self, mock_send_message_to_discord_user
+    ):
+        # when
+        forward_notifications_to_discord([make_payload(1, 1), make_payload(2, 2)])
+        # then
+        self.assertEqual(sorted(self.servicer.received_uids), [1, 2])
+        self.assertFalse(mock_send_message_to_discord_user.called)
+
+    @patch(CORE_PATH + ".DISCORDNOTIFY_ASYNC_SENDER", True)
+    @patch(AIO_PATH + ".can_run", lambda: False)
+    @patch(CORE_PATH + "._send_message_to_discord_user")
+    def test_should_fall_back_to_sync_sender(self, mock_send_message_to_discord_user):
+        # when
+        forward_notifications_to_discord([make_payload(1, 1), make_payload(2, 2)])
+        # then
+        self.assertEqual(mock_send_message_to_discord_user.call_count, 2)
+        self.assertEqual(self.servicer.received_uids, [])
@@ -0,0 +1,123 @@
+import json
+import time
+
+import grpc
+
+from django.test import TestCase
+
+from ..balancer import LEAST_OUTSTANDING, ProxyBalancer, discordproxy_targets
+from .utils import FakeRpcError
+
+
+class TestProxyBalancer(TestCase):
+    def test_should_use_port_when_no_targets_configured(self):
+        # when
+        balancer = ProxyBalancer(discordproxy_targets())
+        # then
+        self.assertEqual(balancer.targets, ["localhost:50051"])
+
+    def test_should_choose_targets_in_turn(self):
+        # given
+        balancer = ProxyBalancer(["a:1", "b:2", "c:3"])
+        # when
+        targets = [balancer.acquire() for _ in range(4)]
+        # then
+        self.assertEqual(targets, ["a:1", "b:2", "c:3", "a:1"])
+
+    def test_should_choose_target_with_least_outstanding_requests(self):
+        # given
+        balancer = ProxyBalancer(["a:1", "b:2"], strategy=LEAST_OUTSTANDING)
+        balancer.acquire()
+        balancer.acquire()
+        balancer.release("b:2")
+        # when
+        target = balancer.acquire()
+        # then
+        self.assertEqual(target, "b:2")
+        self.assertEqual(balancer.outstanding("a:1"), 1)
+
+    def test_should_eject_failing_target(self):
+        # given
+        balancer = ProxyBalancer(["a:1", "b:2"], ejection_threshold=2)
+        for _ in range(2):
+            balancer.acquire(exclude=["b:2"])
+            balancer.release("a:1", FakeRpcError(grpc.StatusCode.UNAVAILABLE))
+        # when
+        targets = [balancer.acquire() for _ in range(3)]
+        # then
+        self.assertTrue(balancer.is_ejected("a:1"))
+        self.assertEqual(targets, ["b:2", "b:2", "b:2"])
+
+    def test_should_not_eject_target_for_other_errors(self):
+        # given
+        balancer = ProxyBalancer(["a:1", "b:2"], ejection_threshold=1)
+        # when
+        balancer.acquire()
+        balancer.release("a:1", FakeRpcError(grpc.StatusCode.NOT_FOUND))
+        # then
+        self.assertFalse(balancer.is_ejected("a:1"))
+
+    def test_should_not_eject_target_for_errors_from_discord_proxy(self):
+        # given
+        balancer = ProxyBalancer(["a:1", "b:2"], ejection_threshold=2)
+        details = json.dumps(
+            {"type": "HTTPException", "status": 502, "code": 0, "text": "Bad Gateway"}
+        )
+        # when
+        for _ in range(2):
+            balancer.acquire(exclude=["b:2"])
+            balancer.release("a:1", FakeRpcError(grpc.StatusCode.UNAVAILABLE, details))
+        # then
+        self.assertFalse(balancer.is_ejected("a:1"))
+
+    def test_should_return_ejected_target_after_ejection_time(self):
+        # given
+        balancer = ProxyBalancer(
+            ["a:1", "b:2"], ejection_threshold=1, ejection_time=0.1
+        )
+        balancer.acquire()
+        balancer.release("a:1", FakeRpcError(grpc.StatusCode.UNAVAILABLE))
+        time.sleep(0.2)
+        # when
+        targets = [balancer.acquire() for _ in range(2)]
+        # then
+        self.assertEqual(sorted(targets), ["a:1", "b:2"])
+
+    def test_should_use_all_targets_when_all_are_ejected(self):
+        # given
+        balancer = ProxyBalancer(["a:1", "b:2"], ejection_threshold=1)
+        for target in ["a:1", "b:2"]:
+            balancer.acquire()
+            balancer.release(target, FakeRpcError(grpc.StatusCode.UNAVAILABLE))
+        # when
+        targets = [balancer.acquire() for _ in range(2)]
+        # then
+        self.assertEqual(sorted(targets), ["a:1", "b:2"])
+
+    def test_should_failover_only_when_unavailable(self):
+        # given
+        balancer = ProxyBalancer(["a:1", "b:2"])
+        unavailable = FakeRpcError(grpc.StatusCode.UNAVAILABLE)
+        deadline_exceeded = FakeRpcError(grpc.StatusCode.DEADLINE_EXCEEDED)
+        # when/then
+        self.assertTrue(balancer.can_failover(unavailable, ["a:1"]))
+        self.assertFalse(balancer.can_failover(unavailable, ["a:1", "b:2"]))
+        self.assertFalse(balancer.can_failover(deadline_exceeded, ["a:1"]))
+
+    def test_should_not_failover_when_error_is_from_discord_proxy(self):
+        # given
+        balancer = ProxyBalancer(["a:1", "b:2"])
+        details = json.dumps(
+            {"type": "HTTPException", "status": 502, "code": 0, "text": "Bad Gateway"}
+        )
+        bad_gateway = FakeRpcError(grpc.StatusCode.UNAVAILABLE, details)
+        no_connection = FakeRpcError(
+            grpc.StatusCode.UNAVAILABLE, "failed to connect to all addresses"
+        )
+        # when/then
+        self.assertFalse(balancer.can_failover(bad_gateway, ["a:1"]))
+        self.assertTrue(balancer.can_failover(no_connection, ["a:1"]))
+
+    def test_should_reject_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            ProxyBalancer(["a:1"], strategy="random")
@@ -0,0 +1,197 @@
+import threading
+from unittest.mock import Mock
+
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+
+from ..batching import BroadcastDetector, NotificationBatcher, OnCommitCollector
+from .utils import make_payload
+
+
+class TestOnCommitCollector(TransactionTestCase):
+    def test_should_process_immediately_outside_of_transactions(self):
+        # given
+        process = Mock()
+        collector = OnCommitCollector(process=process)
+        # when
+        collector.add(1)
+        collector.add(2)
+        # then
+        self.assertEqual(process.call_count, 2)
+
+    def test_should_process_once_per_transaction(self):
+        # given
+        process = Mock()
+        collector = OnCommitCollector(process=process)
+        # when
+        with transaction.atomic():
+            collector.add(1)
+            collector.add(2)
+        with transaction.atomic():
+            collector.add(3)
+        # then
+        self.assertListEqual(
+            [args[0] for args, _ in process.call_args_list], [[1, 2], [3]]
+        )
+
+    def test_should_discard_objects_of_rolled_back_savepoints(self):
+        # given
+        process = Mock()
+        collector = OnCommitCollector(process=process)
+        # when
+        with transaction.atomic():
+            collector.add(1)
+            try:
+                with transaction.atomic():
+                    collector.add(2)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            collector.add(3)
+        # then
+        process.assert_called_once_with([1, 3])
+
+    def test_should_discard_objects_of_rolled_back_transactions(self):
+        # given
+        process = Mock()
+        collector = OnCommitCollector(process=process)
+        try:
+            with transaction.atomic():
+                collector.add(1)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        # when
+        with transaction.atomic():
+            collector.add(2)
+        # then
+        process.assert_called_once_with([2])
+
+
+class TestNotificationBatcher(TestCase):
+    def test_should_dispatch_immediately_without_window(self):
+        # given
+        dispatch = Mock()
+        batcher = NotificationBatcher(dispatch=dispatch, max_size=100, window=0)
+        # when
+        batcher.add(make_payload(1))
+        # then
+        dispatch.assert_called_once_with([make_payload(1)])
+        self.assertEqual(len(batcher), 0)
+
+    def test_should_collect_payloads_within_window(self):
+        # given
+        dispatch = Mock()
+        batcher = NotificationBatcher(dispatch=dispatch, max_size=100, window=60)
+        # when
+        batcher.add(make_payload(1))
+        batcher.add(make_payload(2))
+        # then
+        self.assertFalse(dispatch.called)
+        batcher.flush()
+        dispatch.assert_called_once_with([make_payload(1), make_payload(2)])
+
+    def test_should_dispatch_when_batch_is_full(self):
+        # given
+        dispatch = Mock()
+        batcher = NotificationBatcher(dispatch=dispatch, max_size=2, window=60)
+        # when
+        batcher.extend([make_payload(1), make_payload(2), make_payload(3)])
+        # then
+        dispatch.assert_called_once_with([make_payload(1), make_payload(2)])
+        self.assertEqual(len(batcher), 1)
+        batcher.flush()
+
+    def test_should_dispatch_when_window_has_elapsed(self):
+        # given
+        dispatched = threading.Event()
+        batcher = NotificationBatcher(
+            dispatch=lambda batch: dispatched.set(), max_size=100, window=0.01
+        )
+        # when
+        batcher.add(make_payload(1))
+        # then
+        self.assertTrue(dispatched.wait(timeout=5))
+        self.assertEqual(len(batcher), 0)
+
+
+class TestBroadcastDetector(TestCase):
+    def setUp(self) -> None:
+        self.forward = Mock()
+        self.broadcast = Mock()
+        self.detector = BroadcastDetector(
+            forward=self.forward, broadcast=self.broadcast, min_users=3, window=60
+        )
+
+    def tearDown(self) -> None:
+        self.detector._cancel_timer()
+
+    def test_should_broadcast_identical_payloads_for_many_users(self):
+        # given
+        payloads = [make_payload(num, discord_uid=num) for num in range(1, 4)]
+        # when
+        self.detector.extend(payloads)
+        self.detector.flush()
+        # then
+        self.broadcast.assert_called_once_with(payloads, True)
+        self.assertFalse(self.forward.called)
+
+    def test_should_forward_payloads_for_few_users(self):
+        # given
+        payloads = [make_payload(num, discord_uid=123) for num in range(1, 4)]
+        payloads.append(make_payload(4, discord_uid=456)._replace(title="other"))
+        # when
+        self.detector.extend(payloads)
+        self.detector.flush()
+        # then
+        self.assertFalse(self.broadcast.called)
+        self.assertEqual(
+            [
+                obj.notification_id
+                for args, _ in self.forward.call_args_list
+                for obj in args[0]
+            ],
+            [1, 2, 3, 4],
+        )
+
+    def test_should_not_post_late_payloads_again(self):
+        # given
+        self.detector.extend(
+            [make_payload(num, discord_uid=num) for num in range(1, 4)]
+        )
+        self.detector.flush()
+        late_payload = make_payload(4, discord_uid=4)
+        # when
+        self.detector.extend([late_payload])
+        self.detector.flush()
+        # then
+        self.broadcast.assert_called_with([late_payload], False)
+
+    def test_should_forward_immediately_when_disabled(self):
+        # given
+        detector = BroadcastDetector(
+            forward=self.forward,
+            broadcast=self.broadcast,
+            min_users=3,
+            window=60,
+            enabled=False,
+        )
+        # when
+        detector.extend([make_payload(1)])
+        # then
+        self.forward.assert_called_once_with([make_payload(1)])
+
+    def test_should_dispatch_when_window_has_elapsed(self):
+        # given
+        dispatched = threading.Event()
+        detector = BroadcastDetector(
+            forward=lambda payloads: dispatched.set(),
+            broadcast=self.broadcast,
+            min_users=3,
+            window=0.01,
+        )
+        # when
+        detector.extend([make_payload(1)])
+        # then
+        self.assertTrue(dispatched.wait(timeout=5))
+        self.assertEqual(len(detector), 0)
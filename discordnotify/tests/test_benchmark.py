@@ -0,0 +1,188 @@
+import json
+from io import StringIO
+from unittest.mock import Mock, patch
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, TransactionTestCase
+
+from .. import core
+from ..balancer import ProxyBalancer
+from ..circuitbreaker import NoCircuitBreaker
+from ..dedup import Deduplicator
+from ..management.commands import _benchmark
+from ..management.commands._benchmark import (
+    BenchmarkReport,
+    FakeDiscordProxy,
+    run_benchmark,
+    run_soak_test,
+)
+from ..ratelimit import CacheRateLimiter
+
+AIO_PATH = "discordnotify.aio"
+BENCHMARK_PATH = "discordnotify.management.commands._benchmark"
+BENCHMARK_COMMAND_PATH = "discordnotify.management.commands.discordnotify_benchmark"
+CORE_PATH = "discordnotify.core"
+RATELIMIT_PATH = "discordnotify.ratelimit"
+TASKS_PATH = "discordnotify.tasks"
+
+
+class TestBenchmark(TransactionTestCase):
+    def setUp(self) -> None:
+        self.proxy = FakeDiscordProxy(seed=42)
+        port = self.proxy.start()
+        for path in [CORE_PATH, TASKS_PATH]:
+            patcher = patch(path + ".circuit_breaker", NoCircuitBreaker(0, 0))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch(
+            CORE_PATH + ".proxy_balancer", ProxyBalancer([f"localhost:{port}"])
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self) -> None:
+        self.proxy.stop()
+
+    def test_should_forward_all_notifications_and_report(self):
+        # when
+        report = run_benchmark(
+            self.proxy, num_notifications=20, num_users=5, idle_timeout=0.5
+        )
+        # then
+        self.assertEqual(report.messages, 20)
+        self.assertEqual(report.rpcs_per_notification, 1)
+        self.assertLess(report.db_queries_per_notification, 1)
+        self.assertIsNotNone(report.latency_p99)
+        self.assertFalse(
+            User.objects.filter(username__startswith="discordnotify_").exists()
+        )
+
+    def test_should_not_touch_production_throttling_state(self):
+        # given
+        rate_limiter = Mock(spec=CacheRateLimiter)
+        deduplicator = Mock(spec=Deduplicator)
+        # when
+        with patch(CORE_PATH + ".rate_limiter", rate_limiter), patch(
+            AIO_PATH + ".rate_limiter", rate_limiter
+        ), patch(CORE_PATH + ".deduplicator", deduplicator):
+            report = run_benchmark(
+                self.proxy, num_notifications=4, num_users=2, idle_timeout=0.5
+            )
+        # then
+        self.assertEqual(report.messages, 4)
+        self.assertFalse(report.throttling)
+        self.assertFalse(rate_limiter.method_calls)
+        self.assertFalse(deduplicator.method_calls)
+
+    @patch(RATELIMIT_PATH + ".DISCORDNOTIFY_RATE_LIMIT_ENABLED", True)
+    @patch(RATELIMIT_PATH + ".DISCORDNOTIFY_RATE_LIMIT_SHARED", True)
+    def test_should_throttle_with_own_cache_keys(self):
+        # given
+        rate_limiters = []
+        flush_batchers = _benchmark._flush_batchers
+
+        def record_rate_limiter():
+            rate_limiters.append(core.rate_limiter)
+            flush_batchers()
+
+        # when
+        with patch(BENCHMARK_PATH + "._flush_batchers", record_rate_limiter):
+            report = run_benchmark(
+                self.proxy,
+                num_notifications=4,
+                num_users=2,
+                idle_timeout=0.5,
+                throttling=True,
+            )
+        # then
+        self.assertEqual(report.messages, 4)
+        self.assertTrue(report.throttling)
+        self.assertIsInstance(rate_limiters[0], CacheRateLimiter)
+        self.assertTrue(
+            rate_limiters[0].CACHE_KEY_PREFIX.startswith("DISCORDNOTIFY_BENCHMARK_")
+        )
+        self.assertIsNot(core.rate_limiter, rate_limiters[0])
+
+    @patch(CORE_PATH + ".DISCORDNOTIFY_MAX_RETRIES", 0)
+    def test_should_report_failed_requests(self):
+        # given
+        self.proxy.error_rate = 0.5
+        # when
+        report = run_benchmark(
+            self.proxy, num_notifications=20, num_users=5, idle_timeout=0.5
+        )
+        # then
+        self.assertLess(report.messages, 20)
+        self.assertEqual(report.rpcs_per_notification, 1)
+
+    def test_should_report_soak_test(self):
+        # when
+        report = run_soak_test(
+            self.proxy,
+            rate=40,
+            duration=0.5,
+            num_users=5,
+            sample_interval=0.1,
+            idle_timeout=0.5,
+        )
+        # then
+        self.assertGreater(report.notifications, 0)
+        self.assertEqual(report.messages, report.notifications)
+        self.assertGreater(report.enqueue_rate, 0)
+        self.assertIsNotNone(report.drain_duration)
+        self.assertLess(report.db_queries_per_notification, 5)
+        self.assertIsNotNone(report.cpu_percent)
+        self.assertTrue(report.samples)
+        self.assertEqual(report.samples[-1]["backlog"], 0)
+        json.dumps(report._asdict())
+        self.assertFalse(
+            User.objects.filter(username__startswith="discordnotify_").exists()
+        )
+
+
+@patch(BENCHMARK_PATH + ".FakeDiscordProxy")
+class TestBenchmarkCommands(TestCase):
+    @patch(BENCHMARK_COMMAND_PATH + ".run_benchmark")
+    def test_should_run_benchmark_with_fake_proxy(
+        self, mock_run_benchmark, mock_FakeDiscordProxy
+    ):
+        # given
+        mock_run_benchmark.return_value = BenchmarkReport(
+            mode="eager",
+            throttling=False,
+            notifications=10,
+            users=2,
+            messages=10,
+            duration=1.0,
+            messages_per_second=10.0,
+            latency_p50=None,
+            latency_p99=None,
+            db_queries_per_notification=None,
+            rpcs_per_notification=1.0,
+        )
+        out = StringIO()
+        # when
+        call_command(
+            "discordnotify_benchmark",
+            "--noinput",
+            "--notifications=10",
+            "--users=2",
+            "--latency=0",
+            stdout=out,
+        )
+        # then
+        mock_FakeDiscordProxy.assert_called_once_with(
+            latency=0, error_rate=0, rate_limit_rate=0
+        )
+        self.assertTrue(mock_FakeDiscordProxy.return_value.stop.called)
+        _, kwargs = mock_run_benchmark.call_args
+        self.assertEqual(kwargs["num_notifications"], 10)
+        self.assertTrue(kwargs["eager"])
+        self.assertIn("Messages per second: 10.000", out.getvalue())
+
+    def test_should_reject_invalid_soak_test_options(self, mock_FakeDiscordProxy):
+        with self.assertRaises(CommandError):
+            call_command("discordnotify_soak", "--noinput", "--sample-interval=0")
+        self.assertFalse(mock_FakeDiscordProxy.called)
@@ -0,0 +1,119 @@
+from django.contrib.auth.models import Group, User
+from django.test import TestCase
+
+from allianceauth.services.modules.discord.models import DiscordUser
+
+from ..caches import NO_ACCOUNT, DiscordUidCache, discord_uid_cache, membership_cache
+from ..metrics import registry
+
+
+class TestDiscordUidCache(TestCase):
+    def setUp(self) -> None:
+        self.user_1 = User.objects.create_user("Bruce Wayne")
+        DiscordUser.objects.create(user=self.user_1, uid=123)
+        self.user_2 = User.objects.create_user("Clark Kent")
+
+    def test_should_return_discord_uids_and_no_account(self):
+        # given
+        uid_cache = DiscordUidCache(max_size=10, timeout=60)
+        # when
+        result = uid_cache.get_many([self.user_1.id, self.user_2.id])
+        # then
+        self.assertDictEqual(result, {self.user_1.id: 123, self.user_2.id: NO_ACCOUNT})
+        self.assertIsNone(uid_cache.get(self.user_2.id))
+
+    def test_should_count_hits_and_misses(self):
+        # given
+        registry.clear()
+        uid_cache = DiscordUidCache(max_size=10, timeout=60)
+        uid_cache.get_many([self.user_1.id, self.user_2.id])
+        # when
+        with self.assertNumQueries(0):
+            uid_cache.get_many([self.user_1.id, self.user_2.id])
+        # then
+        values = registry.values()
+        self.assertEqual(values["discordnotify_uid_cache_hits_total"], 2)
+        self.assertEqual(values["discordnotify_uid_cache_misses_total"], 2)
+        self.assertEqual(len(uid_cache), 2)
+
+    def test_should_evict_least_recently_used(self):
+        # given
+        user_3 = User.objects.create_user("Peter Parker")
+        uid_cache = DiscordUidCache(max_size=2, timeout=60)
+        uid_cache.get_many([self.user_1.id, self.user_2.id])
+        uid_cache.get(self.user_1.id)
+        # when
+        uid_cache.get(user_3.id)
+        # then
+        self.assertEqual(len(uid_cache), 2)
+        with self.assertNumQueries(1):
+            uid_cache.get(self.user_2.id)
+
+    def test_should_expire_entries(self):
+        # given
+        uid_cache = DiscordUidCache(max_size=10, timeout=-1)
+        uid_cache.get(self.user_1.id)
+        # when/then
+        with self.assertNumQueries(1):
+            uid_cache.get(self.user_1.id)
+
+    def test_should_share_entries_through_django_cache(self):
+        # given
+        uid_cache_1 = DiscordUidCache(max_size=10, timeout=60, shared=True)
+        uid_cache_2 = DiscordUidCache(max_size=10, timeout=60, shared=True)
+        uid_cache_1.invalidate(self.user_1.id)
+        uid_cache_1.get(self.user_1.id)
+        # when/then
+        with self.assertNumQueries(0):
+            self.assertEqual(uid_cache_2.get(self.user_1.id), 123)
+        uid_cache_1.invalidate(self.user_1.id)
+
+    def test_should_be_invalidated_when_account_is_created(self):
+        # given
+        discord_uid_cache.clear()
+        self.assertIsNone(discord_uid_cache.get(self.user_2.id))
+        # when
+        DiscordUser.objects.create(user=self.user_2, uid=987)
+        # then
+        self.assertEqual(discord_uid_cache.get(self.user_2.id), 987)
+
+    def test_should_be_invalidated_when_account_is_deleted(self):
+        # given
+        discord_uid_cache.clear()
+        self.assertEqual(discord_uid_cache.get(self.user_1.id), 123)
+        # when
+        self.user_1.discord.delete()
+        # then
+        self.assertIsNone(discord_uid_cache.get(self.user_1.id))
+
+
+class TestMembershipCache(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user("Bruce Wayne")
+        self.user.groups.add(Group.objects.create(name="Miners"))
+        membership_cache.clear()
+
+    def test_should_load_memberships_with_one_query(self):
+        # given
+        other_user = User.objects.create_user("Clark Kent")
+        # when
+        with self.assertNumQueries(1):
+            memberships = membership_cache.get_many([self.user.id, other_user.id])
+        # then
+        self.assertEqual(memberships[self.user.id].groups, frozenset({"Miners"}))
+        self.assertEqual(memberships[self.user.id].state, self.user.profile.state.name)
+        self.assertEqual(memberships[other_user.id].groups, frozenset())
+        with self.assertNumQueries(0):
+            membership_cache.get_many([self.user.id, other_user.id])
+
+    def test_should_invalidate_when_groups_change(self):
+        # given
+        membership_cache.get_many([self.user.id])
+        # when
+        self.user.groups.add(Group.objects.create(name="Fleet Commanders"))
+        # then
+        memberships = membership_cache.get_many([self.user.id])
+        self.assertEqual(
+            memberships[self.user.id].groups,
+            frozenset({"Miners", "Fleet Commanders"}),
+        )
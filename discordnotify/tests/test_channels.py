@@ -0,0 +1,63 @@
+from unittest.mock import Mock, patch
+
+from django.test import TestCase
+
+from ..channels import ChannelPool
+
+CHANNELS_PATH = "discordnotify.channels"
+
+
+@patch(CHANNELS_PATH + ".grpc.insecure_channel")
+class TestChannelPool(TestCase):
+    def test_should_reuse_channel_for_same_target(self, mock_insecure_channel):
+        # given
+        pool = ChannelPool()
+        # when
+        channel_1 = pool.get("localhost:50051")
+        channel_2 = pool.get("localhost:50051")
+        # then
+        self.assertIs(channel_1, channel_2)
+        self.assertEqual(mock_insecure_channel.call_count, 1)
+
+    def test_should_create_channel_per_target(self, mock_insecure_channel):
+        # given
+        mock_insecure_channel.side_effect = lambda *args, **kwargs: Mock()
+        pool = ChannelPool()
+        # when
+        channel_1 = pool.get("localhost:50051")
+        channel_2 = pool.get("localhost:50052")
+        # then
+        self.assertIsNot(channel_1, channel_2)
+        self.assertEqual(len(pool), 2)
+
+    def test_should_recreate_channels_after_fork(self, mock_insecure_channel):
+        # given
+        mock_insecure_channel.side_effect = lambda *args, **kwargs: Mock()
+        pool = ChannelPool()
+        channel_1 = pool.get("localhost:50051")
+        # when
+        with patch(CHANNELS_PATH + ".os.getpid", return_value=-1):
+            channel_2 = pool.get("localhost:50051")
+        # then
+        self.assertIsNot(channel_1, channel_2)
+        self.assertFalse(channel_1.close.called)
+
+    def test_should_close_all_channels(self, mock_insecure_channel):
+        # given
+        pool = ChannelPool()
+        channel = pool.get("localhost:50051")
+        # when
+        pool.close()
+        # then
+        self.assertTrue(channel.close.called)
+        self.assertEqual(len(pool), 0)
+
+    def test_should_enable_keepalive(self, mock_insecure_channel):
+        # given
+        pool = ChannelPool()
+        # when
+        pool.get("localhost:50051")
+        # then
+        _, kwargs = mock_insecure_channel.call_args
+        options = dict(kwargs["options"])
+        self.assertIn("grpc.keepalive_time_ms", options)
@@ -0,0 +1,73 @@
+import time
+import uuid
+
+import grpc
+
+from django.test import TestCase
+
+from ..circuitbreaker import CacheCircuitBreaker, CircuitOpenError, LocalCircuitBreaker
+from .utils import FakeRpcError
+
+
+class CircuitBreakerTestMixin:
+    def create_circuit_breaker(self, **kwargs):
+        raise NotImplementedError()
+
+    def test_should_open_after_consecutive_failures(self):
+        # given
+        circuit_breaker = self.create_circuit_breaker(threshold=2, reset_timeout=60)
+        # when
+        circuit_breaker.record(FakeRpcError(grpc.StatusCode.UNAVAILABLE))
+        self.assertTrue(circuit_breaker.allow_request())
+        circuit_breaker.record(FakeRpcError(grpc.StatusCode.DEADLINE_EXCEEDED))
+        # then
+        self.assertFalse(circuit_breaker.allow_request())
+        self.assertGreater(circuit_breaker.open_for(), 0)
+        with self.assertRaises(CircuitOpenError):
+            circuit_breaker.check()
+
+    def test_should_not_open_for_other_errors(self):
+        # given
+        circuit_breaker = self.create_circuit_breaker(threshold=2, reset_timeout=60)
+        # when
+        circuit_breaker.record(FakeRpcError(grpc.StatusCode.UNAVAILABLE))
+        circuit_breaker.record(FakeRpcError(grpc.StatusCode.NOT_FOUND))
+        circuit_breaker.record(FakeRpcError(grpc.StatusCode.UNAVAILABLE))
+        # then
+        self.assertTrue(circuit_breaker.allow_request())
+
+    def test_should_allow_one_probe_and_close_on_success(self):
+        # given
+        circuit_breaker = self.create_circuit_breaker(threshold=1, reset_timeout=0.2)
+        circuit_breaker.record(FakeRpcError(grpc.StatusCode.UNAVAILABLE))
+        time.sleep(0.3)
+        # when
+        results = [circuit_breaker.allow_request() for _ in range(2)]
+        circuit_breaker.record()
+        # then
+        self.assertEqual(results, [True, False])
+        self.assertTrue(circuit_breaker.allow_request())
+        self.assertEqual(circuit_breaker.open_for(), 0)
+
+    def test_should_open_again_when_probe_fails(self):
+        # given
+        circuit_breaker = self.create_circuit_breaker(threshold=1, reset_timeout=0.2)
+        circuit_breaker.record(FakeRpcError(grpc.StatusCode.UNAVAILABLE))
+        time.sleep(0.3)
+        # when
+        self.assertTrue(circuit_breaker.allow_request())
+        circuit_breaker.record(FakeRpcError(grpc.StatusCode.UNAVAILABLE))
+        # then
+        self.assertFalse(circuit_breaker.allow_request())
+
+
+class TestLocalCircuitBreaker(CircuitBreakerTestMixin, TestCase):
+    def create_circuit_breaker(self, **kwargs):
+        return LocalCircuitBreaker(**kwargs)
+
+
+class TestCacheCircuitBreaker(CircuitBreakerTestMixin, TestCase):
+    def create_circuit_breaker(self, **kwargs):
+        circuit_breaker = CacheCircuitBreaker(**kwargs)
+        circuit_breaker.CACHE_KEY_PREFIX = f"TEST_{uuid.uuid4().hex}"
+        return circuit_breaker
@@ -0,0 +1,267 @@
+import datetime as dt
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from allianceauth.notifications.models import Notification
+from allianceauth.services.modules.discord.models import DiscordUser
+
+from ..caches import discord_uid_cache
+from ..core import PendingPayloads
+from ..models import DeliveryRecord, FailedDelivery, HeldNotification
+
+BACKFILL_PATH = "discordnotify.management.commands.discordnotify_backfill"
+REDRIVE_PATH = "discordnotify.management.commands.discordnotify_redrive"
+SIGNALS_PATH = "discordnotify.signals"
+
+
+@patch(REDRIVE_PATH + ".start_forwarding_task")
+class TestRedriveCommand(TransactionTestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user("Bruce Wayne")
+        for status_code in ["UNAVAILABLE", "UNAVAILABLE", "NOT_FOUND"]:
+            notif = Notification.objects.notify_user(
+                user=self.user, title="title", message="message"
+            )
+            FailedDelivery.objects.create(
+                notification=notif, discord_uid=123, status_code=status_code
+            )
+
+    def test_should_redrive_all_failed_deliveries(self, mock_start_forwarding_task):
+        # when
+        call_command(
+            "discordnotify_redrive", "--noinput", "--batch-size=2", stdout=StringIO()
+        )
+        # then
+        self.assertFalse(FailedDelivery.objects.exists())
+        batch_sizes = [
+            len(args[0]) for args, _ in mock_start_forwarding_task.call_args_list
+        ]
+        self.assertListEqual(batch_sizes, [2, 1])
+        self.assertTrue(mock_start_forwarding_task.call_args[1]["skip_dedup"])
+        payload = mock_start_forwarding_task.call_args[0][0][0]
+        self.assertEqual(payload.discord_uid, 123)
+        self.assertEqual(payload.message, "message")
+
+    @patch(REDRIVE_PATH + ".start_channel_forwarding_task")
+    def test_should_redrive_failed_deliveries_to_their_channel(
+        self, mock_start_channel_forwarding_task, mock_start_forwarding_task
+    ):
+        # given
+        notif = Notification.objects.notify_user(user=self.user, title="redirected")
+        FailedDelivery.objects.create(
+            notification=notif,
+            discord_uid=123,
+            channel_id=987,
+            status_code="PERMISSION_DENIED",
+        )
+        # when
+        call_command("discordnotify_redrive", "--noinput", stdout=StringIO())
+        # then
+        self.assertFalse(FailedDelivery.objects.exists())
+        args, _ = mock_start_channel_forwarding_task.call_args
+        self.assertEqual(args[0], 987)
+        self.assertEqual([obj.title for obj in args[1]], ["redirected"])
+        args, _ = mock_start_forwarding_task.call_args
+        self.assertEqual(len(args[0]), 3)
+
+    def test_should_redrive_by_status_code(self, mock_start_forwarding_task):
+        # when
+        call_command(
+            "discordnotify_redrive",
+            "--noinput",
+            "--status-code=unavailable",
+            stdout=StringIO(),
+        )
+        # then
+        self.assertListEqual(
+            list(FailedDelivery.objects.values_list("status_code", flat=True)),
+            ["NOT_FOUND"],
+        )
+
+
+@patch(BACKFILL_PATH + ".DISCORDNOTIFY_ENABLED", True)
+@patch(BACKFILL_PATH + ".DISCORDNOTIFY_DELIVERY_LOG_ENABLED", True)
+@patch(BACKFILL_PATH + ".start_forwarding_task")
+class TestBackfillCommand(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("Bruce Wayne")
+        DiscordUser.objects.create(user=cls.user, uid=123)
+        cls.user_2 = User.objects.create_user("Lex Luthor")
+        with patch(SIGNALS_PATH + ".DISCORDNOTIFY_ENABLED", False):
+            cls.notifications = [
+                Notification.objects.notify_user(user=cls.user, title=f"title {num}")
+                for num in range(5)
+            ]
+            Notification.objects.notify_user(user=cls.user_2, title="no account")
+        cls.notifications[0].mark_viewed()
+        FailedDelivery.objects.create(
+            notification=cls.notifications[1], discord_uid=123, status_code="NOT_FOUND"
+        )
+
+    def test_should_forward_unforwarded_notifications(self, mock_start_forwarding_task):
+        # when
+        call_command(
+            "discordnotify_backfill",
+            "--noinput",
+            "--since=2000-01-01",
+            "--batch-size=2",
+            "--chunk-size=2",
+            stdout=StringIO(),
+        )
+        # then
+        payloads = [
+            payload
+            for args, _ in mock_start_forwarding_task.call_args_list
+            for payload in args[0]
+        ]
+        self.assertListEqual(
+            [payload.notification_id for payload in payloads],
+            [obj.id for obj in self.notifications[2:]],
+        )
+        self.assertEqual(payloads[0].discord_uid, 123)
+
+    def test_should_refuse_when_forwarded_notifications_are_unknown(
+        self, mock_start_forwarding_task
+    ):
+        # when
+        with patch(BACKFILL_PATH + ".DISCORDNOTIFY_DELIVERY_LOG_ENABLED", False):
+            with self.assertRaises(CommandError):
+                call_command(
+                    "discordnotify_backfill", "--noinput", "--since=2000-01-01"
+                )
+        # then
+        self.assertFalse(mock_start_forwarding_task.called)
+
+    def test_should_run_when_forced(self, mock_start_forwarding_task):
+        # when
+        with patch(BACKFILL_PATH + ".DISCORDNOTIFY_DELIVERY_LOG_ENABLED", False):
+            call_command(
+                "discordnotify_backfill",
+                "--noinput",
+                "--since=2000-01-01",
+                "--force",
+                stdout=StringIO(),
+            )
+        # then
+        self.assertTrue(mock_start_forwarding_task.called)
+
+    def test_should_skip_notifications_already_sent(self, mock_start_forwarding_task):
+        # given
+        DeliveryRecord.objects.create(
+            notification_id=self.notifications[2].id,
+            discord_uid=123,
+            status=DeliveryRecord.Status.SENT,
+            sent_at=timezone.now(),
+        )
+        # when
+        call_command(
+            "discordnotify_backfill",
+            "--noinput",
+            "--since=2000-01-01",
+            stdout=StringIO(),
+        )
+        # then
+        payloads = mock_start_forwarding_task.call_args[0][0]
+        self.assertListEqual(
+            [payload.notification_id for payload in payloads],
+            [obj.id for obj in self.notifications[3:]],
+        )
+
+    def test_should_skip_held_notifications(self, mock_start_forwarding_task):
+        # given
+        HeldNotification.objects.create(
+            notification=self.notifications[2],
+            discord_uid=123,
+            release_at=timezone.now() + dt.timedelta(hours=1),
+        )
+        # when
+        call_command(
+            "discordnotify_backfill",
+            "--noinput",
+            "--since=2000-01-01",
+            stdout=StringIO(),
+        )
+        # then
+        payloads = mock_start_forwarding_task.call_args[0][0]
+        self.assertListEqual(
+            [payload.notification_id for payload in payloads],
+            [obj.id for obj in self.notifications[3:]],
+        )
+
+    def test_should_include_viewed_notifications(self, mock_start_forwarding_task):
+        # when
+        call_command(
+            "discordnotify_backfill",
+            "--noinput",
+            "--since=2000-01-01",
+            "--include-viewed",
+            stdout=StringIO(),
+        )
+        # then
+        payloads = mock_start_forwarding_task.call_args[0][0]
+        self.assertEqual(payloads[0].notification_id, self.notifications[0].id)
+
+    def test_should_only_forward_notifications_in_time_range(
+        self, mock_start_forwarding_task
+    ):
+        # when
+        out = StringIO()
+        call_command(
+            "discordnotify_backfill",
+            "--noinput",
+            "--since=2000-01-01",
+            "--until=2000-01-02T12:00",
+            stdout=out,
+        )
+        # then
+        self.assertFalse(mock_start_forwarding_task.called)
+        self.assertIn("No notifications found", out.getvalue())
+
+    @patch(BACKFILL_PATH + ".forward_notifications_to_discord")
+    def test_should_forward_directly(
+        self, mock_forward_notifications_to_discord, mock_start_forwarding_task
+    ):
+        # given
+        mock_forward_notifications_to_discord.side_effect = (
+            lambda payloads, **kwargs: PendingPayloads(retry=payloads[:1], postponed=[])
+        )
+        # when
+        call_command(
+            "discordnotify_backfill",
+            "--noinput",
+            "--since=2000-01-01",
+            "--direct",
+            stdout=StringIO(),
+        )
+        # then
+        self.assertEqual(mock_forward_notifications_to_discord.call_count, 1)
+        args, kwargs = mock_start_forwarding_task.call_args
+        self.assertEqual(len(args[0]), 1)
+        self.assertEqual(kwargs["attempt"], 1)
+
+    def test_should_use_constant_number_of_queries_per_chunk(
+        self, mock_start_forwarding_task
+    ):
+        # given
+        discord_uid_cache.clear()
+        # when
+        with CaptureQueriesContext(connection) as context:
+            call_command(
+                "discordnotify_backfill",
+                "--noinput",
+                "--since=2000-01-01",
+                "--batch-size=10",
+                "--chunk-size=10",
+                stdout=StringIO(),
+            )
+        # then
+        self.assertLessEqual(len(context.captured_queries), 4)
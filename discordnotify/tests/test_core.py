@@ -0,0 +1,983 @@
+from unittest.mock import patch
+
+import grpc
+from celery.exceptions import Retry
+from discordproxy.discord_api_pb2 import Embed
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from allianceauth.notifications.models import Notification
+
+from ..balancer import ProxyBalancer
+from ..caches import NO_ACCOUNT
+from ..circuitbreaker import CircuitOpenError, LocalCircuitBreaker
+from ..core import (
+    COLOR_DANGER,
+    MAX_LENGTH_DESCRIPTION,
+    MAX_LENGTH_MESSAGE,
+    NotificationPayload,
+    PendingPayloads,
+    SendResult,
+    _create_embeds,
+    _send_message_to_discord_user,
+    forward_broadcast,
+    forward_notifications_to_channel,
+    forward_notifications_to_discord,
+    resolve_payloads,
+    retry_countdown,
+)
+from ..dedup import Deduplicator
+from ..management.commands._benchmark import FakeDiscordProxy
+from ..models import DeliveryRecord, FailedDelivery
+from ..tasks import (
+    start_forwarding_task,
+    task_forward_broadcast,
+    task_forward_notification_to_discord,
+    task_forward_notifications_bulk,
+)
+from .utils import FakeRpcError, make_payload
+
+CORE_PATH = "discordnotify.core"
+SIGNALS_PATH = "discordnotify.signals"
+TASKS_PATH = "discordnotify.tasks"
+
+
+@patch(CORE_PATH + ".DISCORDNOTIFY_ASYNC_SENDER", False)
+@patch(CORE_PATH + ".DISCORDNOTIFY_MAX_RETRIES", 2)
+@patch(CORE_PATH + "._send_message_to_discord_user")
+class TestRetriesAndFailedDeliveries(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user("Bruce Wayne")
+        self.notif = Notification.objects.notify_user(user=self.user, title="hi")
+
+    def test_should_return_transient_failures_for_retry(
+        self, mock_send_message_to_discord_user
+    ):
+        # given
+        mock_send_message_to_discord_user.side_effect = FakeRpcError(
+            grpc.StatusCode.UNAVAILABLE
+        )
+        # when
+        result = forward_notifications_to_discord([make_payload(self.notif.id)])
+        # then
+        self.assertEqual(result.retry, [make_payload(self.notif.id)])
+        self.assertFalse(FailedDelivery.objects.exists())
+
+    def test_should_store_permanent_failures(self, mock_send_message_to_discord_user):
+        # given
+        mock_send_message_to_discord_user.side_effect = FakeRpcError(
+            grpc.StatusCode.PERMISSION_DENIED, "Cannot send messages to this user"
+        )
+        # when
+        result = forward_notifications_to_discord([make_payload(self.notif.id)])
+        # then
+        self.assertEqual(result.retry, [])
+        obj = FailedDelivery.objects.get()
+        self.assertEqual(obj.notification, self.notif)
+        self.assertEqual(obj.discord_uid, 123)
+        self.assertEqual(obj.status_code, "PERMISSION_DENIED")
+        self.assertEqual(obj.attempts, 1)
+
+    def test_should_store_transient_failures_on_last_attempt(
+        self, mock_send_message_to_discord_user
+    ):
+        # given
+        mock_send_message_to_discord_user.side_effect = FakeRpcError(
+            grpc.StatusCode.UNAVAILABLE
+        )
+        # when
+        result = forward_notifications_to_discord(
+            [make_payload(self.notif.id)], attempt=2
+        )
+        # then
+        self.assertEqual(result.retry, [])
+        obj = FailedDelivery.objects.get()
+        self.assertEqual(obj.status_code, "UNAVAILABLE")
+        self.assertEqual(obj.attempts, 3)
+
+    def test_should_ignore_failures_of_deleted_notifications(
+        self, mock_send_message_to_discord_user
+    ):
+        # given
+        mock_send_message_to_discord_user.side_effect = FakeRpcError(
+            grpc.StatusCode.NOT_FOUND
+        )
+        # when
+        forward_notifications_to_discord([make_payload(self.notif.id + 1)])
+        # then
+        self.assertFalse(FailedDelivery.objects.exists())
+
+    @patch(TASKS_PATH + ".task_forward_notifications_bulk.apply_async")
+    def test_bulk_task_should_retry_transient_failures(
+        self, mock_apply_async, mock_send_message_to_discord_user
+    ):
+        # given
+        def send_message(discord_uid, embed, high_priority=False):
+            if discord_uid == 2:
+                raise FakeRpcError(grpc.StatusCode.DEADLINE_EXCEEDED)
+
+        mock_send_message_to_discord_user.side_effect = send_message
+        # when
+        task_forward_notifications_bulk(
+            payloads=[make_payload(self.notif.id, 1), make_payload(self.notif.id, 2)]
+        )
+        # then
+        _, kwargs = mock_apply_async.call_args
+        self.assertEqual(
+            kwargs["kwargs"]["payloads"], [list(make_payload(self.notif.id, 2))]
+        )
+        self.assertEqual(kwargs["kwargs"]["attempt"], 1)
+        self.assertGreater(kwargs["countdown"], 0)
+
+    @patch(TASKS_PATH + ".task_forward_notification_to_discord.retry")
+    def test_single_task_should_retry_transient_failures(
+        self, mock_retry, mock_send_message_to_discord_user
+    ):
+        # given
+        mock_send_message_to_discord_user.side_effect = FakeRpcError(
+            grpc.StatusCode.UNAVAILABLE
+        )
+        mock_retry.side_effect = Retry()
+        # when
+        with self.assertRaises(Retry):
+            task_forward_notification_to_discord(
+                **make_payload(self.notif.id)._asdict()
+            )
+        # then
+        self.assertGreater(mock_retry.call_args[1]["countdown"], 0)
+        self.assertFalse(FailedDelivery.objects.exists())
+
+    @override_settings(CELERY_ALWAYS_EAGER=True)
+    def test_bulk_task_should_store_failure_after_max_retries(
+        self, mock_send_message_to_discord_user
+    ):
+        # given
+        mock_send_message_to_discord_user.side_effect = FakeRpcError(
+            grpc.StatusCode.UNAVAILABLE
+        )
+        # when
+        task_forward_notifications_bulk.delay(payloads=[make_payload(self.notif.id)])
+        # then
+        self.assertEqual(mock_send_message_to_discord_user.call_count, 3)
+        obj = FailedDelivery.objects.get()
+        self.assertEqual(obj.status_code, "UNAVAILABLE")
+
+    @override_settings(CELERY_ALWAYS_EAGER=True)
+    def test_bulk_task_should_not_retry_unexpected_errors(
+        self, mock_send_message_to_discord_user
+    ):
+        # given
+        class VeryLongNameForAnUnexpectedErrorInOurOwnCode(Exception):
+            pass
+
+        mock_send_message_to_discord_user.side_effect = (
+            VeryLongNameForAnUnexpectedErrorInOurOwnCode
+        )
+        # when
+        task_forward_notifications_bulk.delay(payloads=[make_payload(self.notif.id)])
+        # then
+        self.assertEqual(mock_send_message_to_discord_user.call_count, 1)
+        obj = FailedDelivery.objects.get()
+        self.assertEqual(obj.status_code, "VeryLongNameForAnUnexpectedError")
+        self.assertEqual(obj.attempts, 1)
+
+    def test_should_deliver_failed_notification_again_when_skipping_dedup(
+        self, mock_send_message_to_discord_user
+    ):
+        # given
+        mock_send_message_to_discord_user.side_effect = FakeRpcError(
+            grpc.StatusCode.NOT_FOUND
+        )
+        payload = make_payload(self.notif.id)
+        with patch(CORE_PATH + ".deduplicator", Deduplicator(60, shared=False)):
+            forward_notifications_to_discord([payload])
+            mock_send_message_to_discord_user.reset_mock()
+            mock_send_message_to_discord_user.side_effect = None
+            # when
+            forward_notifications_to_discord([payload], skip_dedup=True)
+        # then
+        self.assertEqual(mock_send_message_to_discord_user.call_count, 1)
+
+    def test_should_send_duplicate_when_first_send_failed(
+        self, mock_send_message_to_discord_user
+    ):
+        # given
+        mock_send_message_to_discord_user.side_effect = FakeRpcError(
+            grpc.StatusCode.NOT_FOUND
+        )
+        with patch(CORE_PATH + ".deduplicator", Deduplicator(60, shared=False)):
+            forward_notifications_to_discord([make_payload(self.notif.id)])
+            mock_send_message_to_discord_user.reset_mock()
+            mock_send_message_to_discord_user.side_effect = None
+            # when
+            forward_notifications_to_discord([make_payload(self.notif.id + 1)])
+        # then
+        self.assertEqual(mock_send_message_to_discord_user.call_count, 1)
+
+    def test_should_send_duplicate_when_first_send_was_postponed(
+        self, mock_send_message_to_discord_user
+    ):
+        # given
+        mock_send_message_to_discord_user.side_effect = CircuitOpenError
+        with patch(CORE_PATH + ".deduplicator", Deduplicator(60, shared=False)):
+            forward_notifications_to_discord([make_payload(self.notif.id)])
+            mock_send_message_to_discord_user.reset_mock()
+            mock_send_message_to_discord_user.side_effect = None
+            # when
+            forward_notifications_to_discord([make_payload(self.notif.id + 1)])
+        # then
+        self.assertEqual(mock_send_message_to_discord_user.call_count, 1)
+
+
+@patch(CORE_PATH + ".DISCORDNOTIFY_ASYNC_SENDER", False)
+@patch(CORE_PATH + ".DISCORDNOTIFY_DELIVERY_LOG_ENABLED", True)
+@patch(CORE_PATH + ".DISCORDNOTIFY_MAX_RETRIES", 1)
+@patch(CORE_PATH + "._send_message_to_discord_user")
+class TestDeliveryRecords(TestCase):
+    def test_should_store_outcome_of_all_notifications_with_one_insert(
+        self, mock_send_message_to_discord_user
+    ):
+        # given
+        def send_message(discord_uid, embed, high_priority=False):
+            if discord_uid == 2:
+                raise FakeRpcError(grpc.StatusCode.NOT_FOUND)
+
+        mock_send_message_to_discord_user.side_effect = send_message
+        payloads = [
+            make_payload(1, discord_uid=1),
+            make_payload(2, discord_uid=2),
+            make_payload(3, discord_uid=1),
+        ]
+        # when
+        with patch(CORE_PATH + ".deduplicator", Deduplicator(60, shared=False)):
+            with CaptureQueriesContext(connection) as context:
+                forward_notifications_to_discord(payloads)
+        # then
+        inserts = [
+            query
+            for query in context.captured_queries
+            if query["sql"].startswith("INSERT")
+            and "discordnotify_deliveryrecord" in query["sql"]
+        ]
+        self.assertEqual(len(inserts), 1)
+        records = {obj.notification_id: obj for obj in DeliveryRecord.objects.all()}
+        self.assertEqual(records[1].status, DeliveryRecord.Status.SENT)
+        self.assertEqual(records[1].discord_uid, 1)
+        self.assertGreater(records[1].latency_ms, 0)
+        self.assertEqual(records[2].status, DeliveryRecord.Status.FAILED)
+        self.assertIsNone(records[2].latency_ms)
+        self.assertEqual(records[3].status, DeliveryRecord.Status.SUPPRESSED)
+
+    def test_should_store_attempts(self, mock_send_message_to_discord_user):
+        # when
+        forward_notifications_to_discord([make_payload(1)], attempt=1)
+        # then
+        self.assertEqual(DeliveryRecord.objects.get().attempts, 2)
+
+    def test_should_not_store_notifications_to_be_retried(
+        self, mock_send_message_to_discord_user
+    ):
+        # given
+        mock_send_message_to_discord_user.side_effect = FakeRpcError(
+            grpc.StatusCode.UNAVAILABLE
+        )
+        # when
+        forward_notifications_to_discord([make_payload(1)])
+        # then
+        self.assertFalse(DeliveryRecord.objects.exists())
+
+    def test_should_not_store_when_disabled(self, mock_send_message_to_discord_user):
+        # when
+        with patch(CORE_PATH + ".DISCORDNOTIFY_DELIVERY_LOG_ENABLED", False):
+            forward_notifications_to_discord([make_payload(1)])
+        # then
+        self.assertFalse(DeliveryRecord.objects.exists())
+
+
+@patch(CORE_PATH + ".DISCORDNOTIFY_DIGEST_ENABLED", True)
+@patch(CORE_PATH + ".DISCORDNOTIFY_ASYNC_SENDER", False)
+@patch(CORE_PATH + "._send_message_to_discord_user")
+class TestDigestMode(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user("Bruce Wayne")
+
+    def test_should_combine_notifications_for_same_user(
+        self, mock_send_message_to_discord_user
+    ):
+        # given
+        payloads = [
+            make_payload(1, 123)._replace(title="alpha", level="info"),
+            make_payload(2, 987),
+            make_payload(3, 123)._replace(title="bravo", level="danger"),
+        ]
+        # when
+        forward_notifications_to_discord(payloads)
+        # then
+        self.assertEqual(mock_send_message_to_discord_user.call_count, 2)
+        embeds = {
+            kwargs["discord_uid"]: kwargs["embed"]
+            for _, kwargs in mock_send_message_to_discord_user.call_args_list
+        }
+        self.assertEqual(embeds[123].title, "2 new notifications")
+        self.assertIn("alpha", embeds[123].description)
+        self.assertIn("bravo", embeds[123].description)
+        self.assertEqual(embeds[123].color, COLOR_DANGER)
+        self.assertEqual(embeds[987].title, "title")
+
+    def test_should_respect_max_length_of_description(
+        self, mock_send_message_to_discord_user
+    ):
+        # given
+        payloads = [
+            make_payload(n, 123)._replace(message="x" * 1000) for n in range(1, 51)
+        ]
+        # when
+        forward_notifications_to_discord(payloads)
+        # then
+        _, kwargs = mock_send_message_to_discord_user.call_args
+        description = kwargs["embed"].description
+        self.assertLessEqual(len(description), MAX_LENGTH_DESCRIPTION)
+        self.assertIn("more", description)
+
+    @patch(CORE_PATH + ".DISCORDNOTIFY_MARK_AS_VIEWED", True)
+    def test_should_mark_all_combined_notifications_as_viewed(
+        self, mock_send_message_to_discord_user
+    ):
+        # given
+        notifications = [
+            Notification.objects.notify_user(user=self.user, title="hi")
+            for _ in range(3)
+        ]
+        # when
+        forward_notifications_to_discord(
+            [make_payload(obj.id, 123) for obj in notifications]
+        )
+        # then
+        self.assertEqual(mock_send_message_to_discord_user.call_count, 1)
+        self.assertFalse(Notification.objects.filter(viewed=False).exists())
+
+
+@patch(CORE_PATH + "._send_message_to_discord_channel")
+class TestForwardNotificationsToChannel(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user("Bruce Wayne")
+        with patch(SIGNALS_PATH + ".DISCORDNOTIFY_ENABLED", False):
+            self.notif = Notification.objects.notify_user(
+                user=self.user, title="title", message="message"
+            )
+
+    @patch(CORE_PATH + ".DISCORDNOTIFY_MARK_AS_VIEWED", True)
+    def test_should_mention_user(self, mock_send_message_to_discord_channel):
+        # given
+        payload = NotificationPayload.from_notification(self.notif, 123)
+        # when
+        retry_payloads, _ = forward_notifications_to_channel(987, [payload])
+        # then
+        self.assertEqual(retry_payloads, [])
+        _, kwargs = mock_send_message_to_discord_channel.call_args
+        self.assertEqual(kwargs["channel_id"], 987)
+        self.assertEqual(kwargs["content"], "<@123>")
+        self.assertEqual(kwargs["embed"].title, "title")
+        self.notif.refresh_from_db()
+        self.assertTrue(self.notif.viewed)
+
+    def test_should_return_payloads_to_retry(
+        self, mock_send_message_to_discord_channel
+    ):
+        # given
+        mock_send_message_to_discord_channel.side_effect = FakeRpcError(
+            grpc.StatusCode.UNAVAILABLE
+        )
+        payload = NotificationPayload.from_notification(self.notif, NO_ACCOUNT)
+        # when
+        retry_payloads, _ = forward_notifications_to_channel(987, [payload])
+        # then
+        self.assertEqual(retry_payloads, [payload])
+        _, kwargs = mock_send_message_to_discord_channel.call_args
+        self.assertEqual(kwargs["content"], "")
+        self.notif.refresh_from_db()
+        self.assertFalse(self.notif.viewed)
+
+    def test_should_store_permanent_failures_for_channel(
+        self, mock_send_message_to_discord_channel
+    ):
+        # given
+        mock_send_message_to_discord_channel.side_effect = FakeRpcError(
+            grpc.StatusCode.PERMISSION_DENIED, "Missing Access"
+        )
+        payload = NotificationPayload.from_notification(self.notif, 123)
+        # when
+        retry_payloads, _ = forward_notifications_to_channel(987, [payload])
+        # then
+        self.assertEqual(retry_payloads, [])
+        obj = FailedDelivery.objects.get()
+        self.assertEqual(obj.notification, self.notif)
+        self.assertEqual(obj.discord_uid, 123)
+        self.assertEqual(obj.channel_id, 987)
+        self.assertEqual(obj.status_code, "PERMISSION_DENIED")
+        self.assertEqual(obj.attempts, 1)
+
+    @patch(CORE_PATH + ".DISCORDNOTIFY_MAX_RETRIES", 2)
+    def test_should_store_transient_failures_for_channel_on_last_attempt(
+        self, mock_send_message_to_discord_channel
+    ):
+        # given
+        mock_send_message_to_discord_channel.side_effect = FakeRpcError(
+            grpc.StatusCode.UNAVAILABLE
+        )
+        payload = NotificationPayload.from_notification(self.notif, 123)
+        # when
+        retry_payloads, _ = forward_notifications_to_channel(987, [payload], attempt=2)
+        # then
+        self.assertEqual(retry_payloads, [])
+        obj = FailedDelivery.objects.get()
+        self.assertEqual(obj.channel_id, 987)
+        self.assertEqual(obj.attempts, 3)
+
+
+class TestCompactPayloads(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user("Bruce Wayne")
+        with patch(SIGNALS_PATH + ".DISCORDNOTIFY_ENABLED", False):
+            self.notif = Notification.objects.notify_user(
+                user=self.user, title="title", message="x" * 10000, level="warning"
+            )
+
+    def test_should_cut_message_when_creating_payload(self):
+        # when
+        payload = NotificationPayload.from_notification(self.notif, 123)
+        # then
+        self.assertEqual(len(payload.message), MAX_LENGTH_MESSAGE)
+        embeds = _create_embeds(payload)
+        self.assertEqual(len(embeds), 3)
+        self.assertEqual(len(embeds[-1].description), MAX_LENGTH_DESCRIPTION)
+        self.assertTrue(embeds[-1].description.endswith(" [...]"))
+
+    def test_should_resolve_compact_payloads_with_one_query(self):
+        # given
+        full_payload = make_payload(42, 987)
+        items = [[self.notif.id, 123], [self.notif.id + 1000, 123], list(full_payload)]
+        # when
+        with self.assertNumQueries(1):
+            payloads = resolve_payloads(items)
+        # then
+        self.assertEqual(len(payloads), 2)
+        self.assertIn(full_payload, payloads)
+        payload = [obj for obj in payloads if obj.notification_id == self.notif.id][0]
+        self.assertEqual(payload.level, "warning")
+        self.assertEqual(payload.timestamp, self.notif.timestamp.isoformat())
+
+    def test_should_resolve_payloads_serialized_as_objects(self):
+        # given
+        payload = NotificationPayload.from_notification(self.notif, 123)
+        # when
+        payloads = resolve_payloads([payload._asdict()])
+        # then
+        self.assertEqual(payloads, [payload])
+
+    @patch(TASKS_PATH + ".DISCORDNOTIFY_COMPACT_PAYLOADS", True)
+    @patch(TASKS_PATH + ".task_forward_notifications_bulk.apply_async")
+    def test_should_only_pass_ids_to_task(self, mock_apply_async):
+        # when
+        start_forwarding_task([make_payload(self.notif.id, 123)])
+        # then
+        _, kwargs = mock_apply_async.call_args
+        self.assertEqual(kwargs["kwargs"]["payloads"], [[self.notif.id, 123]])
+
+    @patch(CORE_PATH + ".DISCORDNOTIFY_ASYNC_SENDER", False)
+    @patch(CORE_PATH + "._send_message_to_discord_user")
+    def test_should_forward_compact_payloads(self, mock_send_message_to_discord_user):
+        # when
+        task_forward_notifications_bulk(payloads=[[self.notif.id, 123]])
+        # then
+        _, kwargs = mock_send_message_to_discord_user.call_args
+        self.assertEqual(kwargs["discord_uid"], 123)
+        self.assertEqual(kwargs["embed"].title, "title (3/3)")
+
+
+@patch(CORE_PATH + ".DISCORDNOTIFY_ASYNC_SENDER", False)
+@patch(CORE_PATH + "._send_message_to_discord_user")
+class TestForwardDuplicates(TestCase):
+    def setUp(self) -> None:
+        deduplicator = Deduplicator(timeout=60, shared=False)
+        patcher = patch(CORE_PATH + ".deduplicator", deduplicator)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_should_send_duplicates_only_once(self, mock_send_message_to_discord_user):
+        # when
+        forward_notifications_to_discord([make_payload(1), make_payload(2)])
+        forward_notifications_to_discord([make_payload(3)])
+        # then
+        self.assertEqual(mock_send_message_to_discord_user.call_count, 1)
+
+    def test_should_not_suppress_retries(self, mock_send_message_to_discord_user):
+        # given
+        forward_notifications_to_discord([make_payload(1)])
+        # when
+        forward_notifications_to_discord([make_payload(1)], attempt=1)
+        # then
+        self.assertEqual(mock_send_message_to_discord_user.call_count, 2)
+
+    @patch(CORE_PATH + ".DISCORDNOTIFY_MARK_AS_VIEWED", True)
+    def test_should_mark_duplicates_as_viewed(self, mock_send_message_to_discord_user):
+        # given
+        user = User.objects.create_user("Bruce Wayne")
+        with patch(SIGNALS_PATH + ".DISCORDNOTIFY_ENABLED", False):
+            notif_1 = Notification.objects.notify_user(user=user, title="title")
+            notif_2 = Notification.objects.notify_user(user=user, title="title")
+        # when
+        forward_notifications_to_discord(
+            [make_payload(notif_1.id), make_payload(notif_2.id)]
+        )
+        # then
+        self.assertFalse(Notification.objects.filter(viewed=False).exists())
+
+    @patch(CORE_PATH + ".deduplicator.check", return_value=3)
+    def test_should_add_counter_to_title(
+        self, mock_check, mock_send_message_to_discord_user
+    ):
+        # when
+        forward_notifications_to_discord([make_payload(1)])
+        # then
+        _, kwargs = mock_send_message_to_discord_user.call_args
+        self.assertEqual(kwargs["embed"].title, "title (repeated 3×)")
+
+
+@patch(CORE_PATH + ".DiscordApiStub")
+@patch(CORE_PATH + ".channel_pool")
+class TestSendWithCircuitBreaker(TestCase):
+    @patch(CORE_PATH + ".circuit_breaker", LocalCircuitBreaker(1, 60))
+    def test_should_fail_fast_when_open(self, mock_channel_pool, mock_DiscordApiStub):
+        # given
+        send_direct_message = mock_DiscordApiStub.return_value.SendDirectMessage
+        send_direct_message.side_effect = FakeRpcError(grpc.StatusCode.UNAVAILABLE)
+        with self.assertRaises(grpc.RpcError):
+            _send_message_to_discord_user(discord_uid=123, embed=Embed())
+        # when
+        with self.assertRaises(CircuitOpenError):
+            _send_message_to_discord_user(discord_uid=123, embed=Embed())
+        # then
+        self.assertEqual(send_direct_message.call_count, 1)
+
+    @patch(CORE_PATH + ".DISCORDNOTIFY_SEND_TIMEOUT", 3)
+    def test_should_send_with_timeout(self, mock_channel_pool, mock_DiscordApiStub):
+        # when
+        _send_message_to_discord_user(discord_uid=123, embed=Embed())
+        # then
+        send_direct_message = mock_DiscordApiStub.return_value.SendDirectMessage
+        self.assertEqual(send_direct_message.call_args[1]["timeout"], 3)
+
+    @patch(TASKS_PATH + ".start_forwarding_task")
+    @patch(TASKS_PATH + ".forward_notifications_to_discord")
+    @patch(TASKS_PATH + ".circuit_breaker")
+    def test_should_postpone_task_while_open(
+        self,
+        mock_circuit_breaker,
+        mock_forward_notifications_to_discord,
+        mock_start_forwarding_task,
+        mock_channel_pool,
+        mock_DiscordApiStub,
+    ):
+        # given
+        mock_circuit_breaker.open_for.return_value = 25
+        payloads = [list(make_payload(1))]
+        # when
+        task_forward_notifications_bulk(payloads=payloads, attempt=2)
+        # then
+        self.assertFalse(mock_forward_notifications_to_discord.called)
+        mock_start_forwarding_task.assert_called_once_with(
+            payloads,
+            high_priority=False,
+            attempt=2,
+            countdown=25,
+            digest=False,
+            skip_dedup=False,
+        )
+
+    @patch(CORE_PATH + ".DISCORDNOTIFY_MAX_RETRIES", 2)
+    @patch(CORE_PATH + "._send_message_to_discord_user")
+    def test_should_return_payloads_refused_while_open_as_postponed(
+        self, mock_send_message_to_discord_user, mock_channel_pool, mock_DiscordApiStub
+    ):
+        # given
+        mock_send_message_to_discord_user.side_effect = CircuitOpenError
+        # when
+        result = forward_notifications_to_discord([make_payload(1)], attempt=2)
+        # then
+        self.assertEqual(result, PendingPayloads(retry=[], postponed=[make_payload(1)]))
+        self.assertFalse(FailedDelivery.objects.exists())
+
+    @patch(TASKS_PATH + ".start_forwarding_task")
+    @patch(TASKS_PATH + ".forward_notifications_to_discord")
+    @patch(TASKS_PATH + ".circuit_breaker")
+    def test_should_postpone_payloads_refused_while_probing_without_attempt(
+        self,
+        mock_circuit_breaker,
+        mock_forward_notifications_to_discord,
+        mock_start_forwarding_task,
+        mock_channel_pool,
+        mock_DiscordApiStub,
+    ):
+        # given
+        mock_circuit_breaker.open_for.return_value = 0
+        mock_forward_notifications_to_discord.return_value = PendingPayloads(
+            retry=[], postponed=[make_payload(1)]
+        )
+        # when
+        task_forward_notifications_bulk(payloads=[list(make_payload(1))], attempt=2)
+        # then
+        args, kwargs = mock_start_forwarding_task.call_args
+        self.assertEqual(args[0], [make_payload(1)])
+        self.assertEqual(kwargs["attempt"], 2)
+        self.assertTrue(kwargs["skip_dedup"])
+        self.assertGreater(kwargs["countdown"], 0)
+
+
+@patch(CORE_PATH + ".DiscordApiStub")
+@patch(CORE_PATH + ".channel_pool")
+class TestSendWithFailover(TestCase):
+    def setUp(self) -> None:
+        patcher = patch(CORE_PATH + ".circuit_breaker", LocalCircuitBreaker(1, 60))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_should_send_to_next_target_when_unavailable(
+        self, mock_channel_pool, mock_DiscordApiStub
+    ):
+        # given
+        send_direct_message = mock_DiscordApiStub.return_value.SendDirectMessage
+        send_direct_message.side_effect = [
+            FakeRpcError(grpc.StatusCode.UNAVAILABLE),
+            None,
+        ]
+        balancer = ProxyBalancer(["a:1", "b:2"])
+        # when
+        with patch(CORE_PATH + ".proxy_balancer", balancer):
+            _send_message_to_discord_user(discord_uid=123, embed=Embed())
+        # then
+        targets = [args[0] for args, _ in mock_channel_pool.get.call_args_list]
+        self.assertEqual(targets, ["a:1", "b:2"])
+        self.assertEqual(balancer.outstanding("a:1"), 0)
+        self.assertEqual(balancer.outstanding("b:2"), 0)
+
+    def test_should_raise_when_all_targets_are_unavailable(
+        self, mock_channel_pool, mock_DiscordApiStub
+    ):
+        # given
+        send_direct_message = mock_DiscordApiStub.return_value.SendDirectMessage
+        send_direct_message.side_effect = FakeRpcError(grpc.StatusCode.UNAVAILABLE)
+        # when
+        with patch(CORE_PATH + ".proxy_balancer", ProxyBalancer(["a:1", "b:2"])):
+            with self.assertRaises(grpc.RpcError):
+                _send_message_to_discord_user(discord_uid=123, embed=Embed())
+        # then
+        self.assertEqual(send_direct_message.call_count, 2)
+
+
+@patch(CORE_PATH + ".DISCORDNOTIFY_ASYNC_SENDER", False)
+@patch(CORE_PATH + "._send_message_to_discord_user")
+class TestSplitMessages(TestCase):
+    def test_should_send_long_message_as_several_messages_in_order(
+        self, mock_send_message_to_discord_user
+    ):
+        # given
+        message = "\n\n".join(f"{num} " + "x" * 1500 for num in range(3))
+        payload = make_payload(1)._replace(message=message)
+        # when
+        forward_notifications_to_discord([payload])
+        # then
+        embeds = [
+            kwargs["embed"]
+            for _, kwargs in mock_send_message_to_discord_user.call_args_list
+        ]
+        self.assertListEqual(
+            [embed.title for embed in embeds],
+            ["title (1/3)", "title (2/3)", "title (3/3)"],
+        )
+        self.assertListEqual(
+            [embed.description[0] for embed in embeds], ["0", "1", "2"]
+        )
+
+    def test_should_stop_sending_parts_after_error(
+        self, mock_send_message_to_discord_user
+    ):
+        # given
+        mock_send_message_to_discord_user.side_effect = FakeRpcError(
+            grpc.StatusCode.NOT_FOUND
+        )
+        message = "\n\n".join("x" * 1500 for _ in range(3))
+        # when
+        forward_notifications_to_discord([make_payload(1)._replace(message=message)])
+        # then
+        self.assertEqual(mock_send_message_to_discord_user.call_count, 1)
+
+    def test_should_only_retry_parts_not_sent_when_middle_part_fails(
+        self, mock_send_message_to_discord_user
+    ):
+        # given
+        mock_send_message_to_discord_user.side_effect = [
+            None,
+            FakeRpcError(grpc.StatusCode.UNAVAILABLE),
+        ]
+        message = "\n\n".join(f"{num} " + "x" * 1500 for num in range(3))
+        payload = make_payload(1)._replace(message=message)
+        # when
+        retry_payloads, _ = forward_notifications_to_discord([payload])
+        # then
+        self.assertEqual(retry_payloads, [payload._replace(parts_sent=1)])
+        # when
+        mock_send_message_to_discord_user.reset_mock()
+        mock_send_message_to_discord_user.side_effect = None
+        retry_payloads, _ = forward_notifications_to_discord(retry_payloads, attempt=1)
+        # then
+        self.assertEqual(retry_payloads, [])
+        titles = [
+            kwargs["embed"].title
+            for _, kwargs in mock_send_message_to_discord_user.call_args_list
+        ]
+        self.assertListEqual(titles, ["title (2/3)", "title (3/3)"])
+
+    @patch(CORE_PATH + "._send_message_to_discord_channel")
+    def test_should_only_retry_channel_parts_not_sent(
+        self, mock_send_message_to_discord_channel, mock_send_message_to_discord_user
+    ):
+        # given
+        mock_send_message_to_discord_channel.side_effect = [
+            None,
+            FakeRpcError(grpc.StatusCode.UNAVAILABLE),
+        ]
+        message = "\n\n".join(f"{num} " + "x" * 1500 for num in range(3))
+        payload = make_payload(1)._replace(message=message)
+        # when
+        retry_payloads, _ = forward_notifications_to_channel(42, [payload])
+        # then
+        self.assertEqual(retry_payloads, [payload._replace(parts_sent=1)])
+
+    def test_should_keep_parts_sent_in_compact_payloads(
+        self, mock_send_message_to_discord_user
+    ):
+        # given
+        payload = make_payload(1)._replace(parts_sent=2)
+        # when
+        compact = NotificationPayload.compact(payload)
+        # then
+        self.assertListEqual(compact, [1, 123, 2])
+        self.assertListEqual(NotificationPayload.compact(make_payload(1)), [1, 123])
+
+
+class TestRetryCountdown(TestCase):
+    @patch(CORE_PATH + ".DISCORDNOTIFY_RETRY_BACKOFF", 10)
+    @patch(CORE_PATH + ".DISCORDNOTIFY_RETRY_BACKOFF_MAX", 60)
+    def test_should_back_off_exponentially_with_jitter(self):
+        for attempt, backoff in [(0, 10), (1, 20), (2, 40), (3, 60), (10, 60)]:
+            countdown = retry_countdown(attempt)
+            self.assertGreaterEqual(countdown, backoff / 2)
+            self.assertLessEqual(countdown, backoff)
+
+
+@patch(CORE_PATH + ".DiscordApiStub")
+@patch(CORE_PATH + ".channel_pool")
+class TestSendMessageToDiscordUser(TestCase):
+    def test_should_use_pooled_channel(self, mock_channel_pool, mock_DiscordApiStub):
+        # when
+        _send_message_to_discord_user(discord_uid=123, embed=Embed())
+        _send_message_to_discord_user(discord_uid=123, embed=Embed())
+        # then
+        self.assertEqual(mock_channel_pool.get.call_count, 2)
+        self.assertEqual(
+            mock_DiscordApiStub.return_value.SendDirectMessage.call_count, 2
+        )
+        self.assertFalse(mock_channel_pool.get.return_value.close.called)
+
+    @patch(CORE_PATH + ".rate_limiter")
+    def test_should_retry_when_rate_limited(
+        self, mock_rate_limiter, mock_channel_pool, mock_DiscordApiStub
+    ):
+        # given
+        send_direct_message = mock_DiscordApiStub.return_value.SendDirectMessage
+        send_direct_message.side_effect = [
+            FakeRpcError(
+                grpc.StatusCode.RESOURCE_EXHAUSTED,
+                FakeDiscordProxy._rate_limit_details(),
+            ),
+            None,
+        ]
+        # when
+        _send_message_to_discord_user(discord_uid=123, embed=Embed())
+        # then
+        self.assertEqual(send_direct_message.call_count, 2)
+        self.assertEqual(mock_rate_limiter.acquire.call_count, 2)
+        self.assertTrue(mock_rate_limiter.penalize.called)
+
+    @patch(CORE_PATH + ".DISCORDNOTIFY_RATE_LIMIT_RETRIES", 1)
+    @patch(CORE_PATH + ".rate_limiter")
+    def test_should_give_up_when_rate_limited_too_often(
+        self, mock_rate_limiter, mock_channel_pool, mock_DiscordApiStub
+    ):
+        # given
+        send_direct_message = mock_DiscordApiStub.return_value.SendDirectMessage
+        send_direct_message.side_effect = FakeRpcError(
+            grpc.StatusCode.RESOURCE_EXHAUSTED, FakeDiscordProxy._rate_limit_details()
+        )
+        # when
+        with self.assertRaises(grpc.RpcError):
+            _send_message_to_discord_user(discord_uid=123, embed=Embed())
+        # then
+        self.assertEqual(send_direct_message.call_count, 2)
+
+
+@patch(CORE_PATH + ".DISCORDNOTIFY_BROADCAST_ROLES", [555, 666])
+@patch(CORE_PATH + ".DISCORDNOTIFY_BROADCAST_CHANNEL", 987)
+@patch(CORE_PATH + ".DISCORDNOTIFY_DELIVERY_LOG_ENABLED", True)
+@patch(CORE_PATH + "._send_message_to_discord_channel")
+class TestForwardBroadcast(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user("Bruce Wayne")
+        with patch(SIGNALS_PATH + ".DISCORDNOTIFY_ENABLED", False):
+            self.notifs = [
+                Notification.objects.notify_user(user=self.user, title="Fleet up")
+                for _ in range(3)
+            ]
+        self.payload = NotificationPayload.from_notification(self.notifs[0], 1)
+        self.recipients = [(obj.id, num) for num, obj in enumerate(self.notifs, 1)]
+
+    @patch(CORE_PATH + ".DISCORDNOTIFY_MARK_AS_VIEWED", True)
+    def test_should_post_once_and_record_all(
+        self, mock_send_message_to_discord_channel
+    ):
+        # when
+        result = forward_broadcast(self.payload, self.recipients)
+        # then
+        self.assertEqual(result, SendResult(1))
+        self.assertEqual(mock_send_message_to_discord_channel.call_count, 1)
+        _, kwargs = mock_send_message_to_discord_channel.call_args
+        self.assertEqual(kwargs["channel_id"], 987)
+        self.assertEqual(kwargs["content"], "<@&555> <@&666>")
+        self.assertEqual(Notification.objects.filter(viewed=True).count(), 3)
+        self.assertEqual(
+            set(DeliveryRecord.objects.values_list("discord_uid", flat=True)),
+            {1, 2, 3},
+        )
+
+    def test_should_only_record_when_already_posted(
+        self, mock_send_message_to_discord_channel
+    ):
+        # when
+        forward_broadcast(self.payload, self.recipients, post=False)
+        # then
+        self.assertFalse(mock_send_message_to_discord_channel.called)
+        self.assertEqual(DeliveryRecord.objects.count(), 3)
+
+    @patch(TASKS_PATH + ".start_forwarding_task")
+    def test_should_fall_back_to_direct_messages(
+        self, mock_start_forwarding_task, mock_send_message_to_discord_channel
+    ):
+        # given
+        mock_send_message_to_discord_channel.side_effect = FakeRpcError(
+            grpc.StatusCode.PERMISSION_DENIED
+        )
+        recipients = [list(obj) for obj in self.recipients]
+        # when
+        task_forward_broadcast(payload=list(self.payload), recipients=recipients)
+        # then
+        mock_start_forwarding_task.assert_called_once_with(recipients)
+        self.assertEqual(DeliveryRecord.objects.count(), 0)
+
+    @patch(TASKS_PATH + "._start_broadcast_task")
+    def test_should_only_retry_parts_not_posted(
+        self, mock_start_broadcast_task, mock_send_message_to_discord_channel
+    ):
+        # given
+        mock_send_message_to_discord_channel.side_effect = [
+            None,
+            FakeRpcError(grpc.StatusCode.UNAVAILABLE),
+        ]
+        message = "\n\n".join(f"{num} " + "x" * 1500 for num in range(3))
+        payload = self.payload._replace(message=message)
+        recipients = [list(obj) for obj in self.recipients]
+        # when
+        task_forward_broadcast(payload=list(payload), recipients=recipients)
+        # then
+        args, _ = mock_start_broadcast_task.call_args
+        self.assertEqual(NotificationPayload(*args[0]).parts_sent, 1)
+        self.assertEqual(args[3], 1)
+        self.assertEqual(DeliveryRecord.objects.count(), 0)
+
+    @patch(TASKS_PATH + "._start_broadcast_task")
+    def test_should_postpone_broadcast_refused_while_probing_without_attempt(
+        self, mock_start_broadcast_task, mock_send_message_to_discord_channel
+    ):
+        # given
+        mock_send_message_to_discord_channel.side_effect = CircuitOpenError
+        recipients = [list(obj) for obj in self.recipients]
+        # when
+        task_forward_broadcast(
+            payload=list(self.payload), recipients=recipients, attempt=2
+        )
+        # then
+        args, _ = mock_start_broadcast_task.call_args
+        self.assertEqual(args[3], 2)
+        self.assertGreater(args[4], 0)
+
+
+@patch(CORE_PATH + ".DISCORDNOTIFY_ASYNC_SENDER", False)
+@patch(CORE_PATH + "._send_message_to_discord_user")
+class TestForwardNotificationsToDiscord(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user("Bruce Wayne")
+
+    @patch(CORE_PATH + ".DISCORDNOTIFY_SEND_CONCURRENCY", 4)
+    def test_should_send_all_messages(self, mock_send_message_to_discord_user):
+        # given
+        payloads = [make_payload(n, discord_uid=n) for n in range(1, 11)]
+        # when
+        forward_notifications_to_discord(payloads)
+        # then
+        discord_uids = {
+            kwargs["discord_uid"]
+            for _, kwargs in mock_send_message_to_discord_user.call_args_list
+        }
+        self.assertSetEqual(discord_uids, set(range(1, 11)))
+
+    @patch(CORE_PATH + ".DISCORDNOTIFY_MARK_AS_VIEWED", True)
+    def test_should_mark_only_sent_notifications_as_viewed(
+        self, mock_send_message_to_discord_user
+    ):
+        # given
+        def send_message(discord_uid, embed, high_priority=False):
+            if discord_uid != 1:
+                raise FakeRpcError(grpc.StatusCode.NOT_FOUND)
+
+        mock_send_message_to_discord_user.side_effect = send_message
+        notif_1 = Notification.objects.notify_user(user=self.user, title="hi")
+        notif_2 = Notification.objects.notify_user(user=self.user, title="hi")
+        # when
+        forward_notifications_to_discord(
+            [make_payload(notif_1.id, 1), make_payload(notif_2.id, 2)]
+        )
+        # then
+        notif_1.refresh_from_db()
+        self.assertTrue(notif_1.viewed)
+        notif_2.refresh_from_db()
+        self.assertFalse(notif_2.viewed)
+
+    @patch(CORE_PATH + ".DISCORDNOTIFY_MARK_AS_VIEWED", True)
+    def test_should_mark_notifications_as_viewed_with_one_update(
+        self, mock_send_message_to_discord_user
+    ):
+        # given
+        notifications = [
+            Notification.objects.notify_user(user=self.user, title="hi")
+            for _ in range(5)
+        ]
+        payloads = [make_payload(obj.id) for obj in notifications]
+        # when
+        # update + invalidating the unread cache
+        with self.assertNumQueries(2):
+            forward_notifications_to_discord(payloads)
+        # then
+        self.assertFalse(Notification.objects.filter(viewed=False).exists())
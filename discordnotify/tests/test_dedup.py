@@ -0,0 +1,64 @@
+import time
+import uuid
+
+from django.test import TestCase
+
+from ..dedup import Deduplicator
+
+
+class DeduplicatorTestMixin:
+    def create_deduplicator(self, **kwargs):
+        raise NotImplementedError()
+
+    def test_should_suppress_duplicates_for_same_user(self):
+        # given
+        deduplicator = self.create_deduplicator(timeout=60)
+        # when
+        results = [deduplicator.check(123, "title", "message") for _ in range(3)]
+        # then
+        self.assertEqual(results, [0, None, None])
+        self.assertEqual(deduplicator.check(987, "title", "message"), 0)
+        self.assertEqual(deduplicator.check(123, "title", "other"), 0)
+
+    def test_should_count_duplicates_after_timeout(self):
+        # given
+        deduplicator = self.create_deduplicator(timeout=1)
+        for _ in range(3):
+            deduplicator.check(123, "title", "message")
+        # when
+        time.sleep(1.1)
+        result = deduplicator.check(123, "title", "message")
+        # then
+        self.assertEqual(result, 2)
+
+    def test_should_not_count_duplicates_when_disabled(self):
+        # given
+        deduplicator = self.create_deduplicator(timeout=1, count_duplicates=False)
+        for _ in range(3):
+            deduplicator.check(123, "title", "message")
+        # when
+        time.sleep(1.1)
+        result = deduplicator.check(123, "title", "message")
+        # then
+        self.assertEqual(result, 0)
+
+    def test_should_not_suppress_after_release(self):
+        # given
+        deduplicator = self.create_deduplicator(timeout=60)
+        deduplicator.check(123, "title", "message")
+        # when
+        deduplicator.release(123, "title", "message")
+        # then
+        self.assertEqual(deduplicator.check(123, "title", "message"), 0)
+
+
+class TestLocalDeduplicator(DeduplicatorTestMixin, TestCase):
+    def create_deduplicator(self, **kwargs):
+        return Deduplicator(shared=False, **kwargs)
+
+
+class TestSharedDeduplicator(DeduplicatorTestMixin, TestCase):
+    def create_deduplicator(self, **kwargs):
+        deduplicator = Deduplicator(shared=True, **kwargs)
+        deduplicator.CACHE_KEY_PREFIX = f"TEST_{uuid.uuid4().hex}"
+        return deduplicator
@@ -0,0 +1,60 @@
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+
+from app_utils.urls import reverse_absolute, static_file_absolute_url
+
+from ..embeds import EmbedTemplate, embed_template
+
+EMBEDS_PATH = "discordnotify.embeds"
+
+
+class TestEmbedTemplate(TestCase):
+    def setUp(self) -> None:
+        embed_template.clear()
+
+    def tearDown(self) -> None:
+        embed_template.clear()
+
+    @patch(
+        EMBEDS_PATH + ".static_file_absolute_url",
+        wraps=static_file_absolute_url,
+    )
+    def test_should_build_static_parts_only_once(self, spy_static_file_absolute_url):
+        # given
+        template = EmbedTemplate()
+        # when
+        embeds = [template.create(title=f"title {num}") for num in range(3)]
+        # then
+        self.assertEqual(spy_static_file_absolute_url.call_count, 1)
+        self.assertEqual(embeds[2].title, "title 2")
+        self.assertEqual(embeds[2].author.name, "Alliance Auth Notification")
+
+    def test_should_create_independent_embeds(self):
+        # given
+        first = embed_template.create(title="first")
+        # when
+        first.footer.text = "changed"
+        second = embed_template.create(title="second", color=None)
+        # then
+        self.assertNotEqual(second.footer.text, "changed")
+        self.assertEqual(second.color, 0)
+
+    def test_should_create_same_urls_as_reverse(self):
+        self.assertEqual(
+            embed_template.notification_url(42),
+            reverse_absolute("notifications:view", args=[42]),
+        )
+        self.assertEqual(
+            embed_template.notification_list_url(),
+            reverse_absolute("notifications:list"),
+        )
+
+    def test_should_rebuild_when_settings_change(self):
+        # given
+        embed_template.create()
+        # when
+        with override_settings(SITE_NAME="Gotham"):
+            embed = embed_template.create()
+        # then
+        self.assertEqual(embed.footer.text, "Gotham")
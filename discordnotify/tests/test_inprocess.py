@@ -0,0 +1,73 @@
+import threading
+from unittest.mock import Mock
+
+from django.test import TestCase
+
+from ..inprocess import InProcessSender
+
+
+class TestInProcessSender(TestCase):
+    def setUp(self) -> None:
+        self.sender = InProcessSender(workers=1, queue_size=1)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def tearDown(self) -> None:
+        self.release.set()
+        self.sender.drain(timeout=5)
+
+    def _block(self, **kwargs):
+        self.started.set()
+        self.release.wait(timeout=5)
+
+    def test_should_run_jobs_in_background(self):
+        # given
+        done = threading.Event()
+        # when
+        accepted = self.sender.submit(lambda value: done.set(), value=1)
+        # then
+        self.assertTrue(accepted)
+        self.assertTrue(done.wait(timeout=5))
+
+    def test_should_reject_jobs_when_queue_is_full(self):
+        # given
+        self.sender.submit(self._block)
+        self.assertTrue(self.started.wait(timeout=5))
+        self.assertTrue(self.sender.submit(Mock()))
+        # when
+        accepted = self.sender.submit(Mock())
+        # then
+        self.assertFalse(accepted)
+
+    def test_should_reject_jobs_when_disabled(self):
+        # given
+        sender = InProcessSender(workers=1, queue_size=1, enabled=False)
+        # when/then
+        self.assertFalse(sender.submit(Mock()))
+
+    def test_should_drain_queued_jobs(self):
+        # given
+        job = Mock()
+        self.sender.submit(self._block)
+        self.assertTrue(self.started.wait(timeout=5))
+        self.sender.submit(job, value=1)
+        # when
+        self.release.set()
+        is_drained = self.sender.drain(timeout=5)
+        # then
+        self.assertTrue(is_drained)
+        job.assert_called_once_with(value=1)
+        self.assertEqual(len(self.sender), 0)
+
+    def test_should_hand_over_queued_jobs_to_celery_after_timeout(self):
+        # given
+        job = Mock()
+        self.sender.submit(self._block)
+        self.assertTrue(self.started.wait(timeout=5))
+        self.sender.submit(job, value=1)
+        # when
+        is_drained = self.sender.drain(timeout=0.01)
+        # then
+        self.assertFalse(is_drained)
+        job.apply_async.assert_called_once_with(kwargs={"value": 1})
+        self.assertFalse(job.called)
@@ -0,0 +1,140 @@
+import uuid
+from unittest.mock import Mock, patch
+
+import grpc
+from discordproxy.discord_api_pb2 import Embed
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from allianceauth.notifications.models import Notification
+
+from ..caches import discord_uid_cache
+from ..core import _send_message_to_discord_user, forward_notifications_to_discord
+from ..metrics import Counter, Histogram, MetricsRegistry, registry
+from ..signals import _forward_notifications
+from .utils import FakeRpcError, make_payload
+
+CORE_PATH = "discordnotify.core"
+SIGNALS_PATH = "discordnotify.signals"
+
+
+class TestMetrics(TestCase):
+    def setUp(self) -> None:
+        registry.clear()
+        discord_uid_cache.clear()
+
+    def test_should_render_counter_and_histogram(self):
+        # given
+        my_registry = MetricsRegistry()
+        counter = Counter(my_registry, "my_total", "Counter.", labelnames=["code"])
+        histogram = Histogram(my_registry, "my_seconds", "Histogram.", buckets=[1, 5])
+        # when
+        counter.inc(code="NOT_FOUND")
+        counter.inc(2, code="NOT_FOUND")
+        histogram.observe_many([0.5, 3, 10])
+        # then
+        self.assertEqual(
+            my_registry.render(),
+            "# HELP my_total Counter.\n"
+            "# TYPE my_total counter\n"
+            'my_total{code="NOT_FOUND"} 3\n'
+            "# HELP my_seconds Histogram.\n"
+            "# TYPE my_seconds histogram\n"
+            'my_seconds_bucket{le="1"} 1\n'
+            'my_seconds_bucket{le="5"} 2\n'
+            'my_seconds_bucket{le="+Inf"} 3\n'
+            "my_seconds_sum 13.5\n"
+            "my_seconds_count 3\n",
+        )
+
+    def test_should_aggregate_metrics_of_processes_in_shared_mode(self):
+        # given
+        prefix = f"DISCORDNOTIFY_TEST_{uuid.uuid4().hex}"
+        registries = []
+        for _ in range(2):
+            my_registry = MetricsRegistry(shared=True)
+            my_registry.CACHE_KEY_PREFIX = prefix
+            counter = Counter(my_registry, "my_total", "Counter.")
+            registries.append((my_registry, counter))
+        # when
+        for my_registry, counter in registries:
+            counter.inc(1.5)
+            my_registry.flush()
+        # then
+        self.assertIn("my_total 3\n", registries[0][0].render())
+
+    def test_should_write_to_cache_once_per_flush_interval(self):
+        # given
+        prefix = f"DISCORDNOTIFY_TEST_{uuid.uuid4().hex}"
+        my_registry = MetricsRegistry(shared=True, flush_interval=60)
+        my_registry.CACHE_KEY_PREFIX = prefix
+        other_registry = MetricsRegistry(shared=True)
+        other_registry.CACHE_KEY_PREFIX = prefix
+        counter = Counter(my_registry, "my_total", "Counter.")
+        Counter(other_registry, "my_total", "Counter.")
+        # when
+        counter.inc()
+        my_registry.flush(force=False)
+        counter.inc()
+        my_registry.flush(force=False)
+        # then
+        self.assertIn("my_total 1\n", other_registry.render())
+        my_registry.flush()
+        self.assertIn("my_total 2\n", other_registry.render())
+
+    def test_should_not_record_when_disabled(self):
+        # given
+        my_registry = MetricsRegistry(enabled=False)
+        counter = Counter(my_registry, "my_total", "Counter.")
+        # when
+        counter.inc()
+        # then
+        self.assertEqual(my_registry.values(), {})
+
+    @patch(CORE_PATH + ".DISCORDNOTIFY_ASYNC_SENDER", False)
+    @patch(CORE_PATH + "._send_message_to_discord_user")
+    def test_should_record_forwarded_notifications(
+        self, mock_send_message_to_discord_user
+    ):
+        # given
+        mock_send_message_to_discord_user.side_effect = [
+            None,
+            FakeRpcError(grpc.StatusCode.NOT_FOUND),
+        ]
+        # when
+        forward_notifications_to_discord([make_payload(1, 1), make_payload(2, 2)])
+        # then
+        values = registry.values()
+        self.assertEqual(values["discordnotify_notifications_forwarded_total"], 1)
+        self.assertEqual(values["discordnotify_delivery_lag_seconds_count"], 1)
+        self.assertEqual(values["discordnotify_batch_size_sum"], 2)
+
+    @patch(CORE_PATH + ".DiscordApiStub")
+    @patch(CORE_PATH + ".channel_pool")
+    def test_should_record_rpc_errors(self, mock_channel_pool, mock_DiscordApiStub):
+        # given
+        send_direct_message = mock_DiscordApiStub.return_value.SendDirectMessage
+        send_direct_message.side_effect = FakeRpcError(grpc.StatusCode.NOT_FOUND)
+        # when
+        with self.assertRaises(grpc.RpcError):
+            _send_message_to_discord_user(discord_uid=123, embed=Embed())
+        # then
+        values = registry.values()
+        self.assertEqual(values['discordnotify_rpc_errors_total{code="NOT_FOUND"}'], 1)
+        self.assertEqual(values["discordnotify_rpc_duration_seconds_count"], 1)
+
+    @patch(SIGNALS_PATH + ".broadcast_detector", Mock())
+    def test_should_record_skipped_notifications(self):
+        # given
+        user = User.objects.create_user("Bruce Wayne")
+        with patch(SIGNALS_PATH + ".DISCORDNOTIFY_ENABLED", False):
+            notification = Notification.objects.notify_user(user=user, title="hi")
+        # when
+        _forward_notifications([notification])
+        # then
+        values = registry.values()
+        self.assertEqual(values["discordnotify_notifications_seen_total"], 1)
+        self.assertEqual(
+            values['discordnotify_notifications_skipped_total{reason="no_account"}'], 1
+        )
@@ -0,0 +1,156 @@
+import json
+import uuid
+from unittest.mock import patch
+
+import grpc
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from ..management.commands._benchmark import FakeDiscordProxy
+from ..ratelimit import CacheRateLimiter, LocalRateLimiter, RateLimit, parse_rate_limit
+from .utils import FakeRpcError
+
+RATELIMIT_PATH = "discordnotify.ratelimit"
+
+
+class TestParseRateLimit(TestCase):
+    @patch(RATELIMIT_PATH + ".DISCORDNOTIFY_RATE_LIMIT_PER_USER_PERIOD", 5)
+    def test_should_parse_rate_limit_from_discord_proxy(self):
+        # given
+        error = FakeRpcError(
+            grpc.StatusCode.RESOURCE_EXHAUSTED, FakeDiscordProxy._rate_limit_details()
+        )
+        # when
+        result = parse_rate_limit(error)
+        # then
+        self.assertEqual(result, RateLimit(retry_after=5, is_global=False))
+
+    def test_should_return_none_when_not_reported_by_discord(self):
+        # given
+        error = FakeRpcError(
+            grpc.StatusCode.RESOURCE_EXHAUSTED, "Received message larger than max"
+        )
+        # when/then
+        self.assertIsNone(parse_rate_limit(error))
+
+    def test_should_return_none_for_other_http_errors(self):
+        # given
+        details = json.dumps(
+            {"type": "HTTPException", "status": 413, "code": 0, "text": "Too large"}
+        )
+        error = FakeRpcError(grpc.StatusCode.RESOURCE_EXHAUSTED, details)
+        # when/then
+        self.assertIsNone(parse_rate_limit(error))
+
+    def test_should_return_none_for_other_errors(self):
+        # given
+        error = FakeRpcError(grpc.StatusCode.NOT_FOUND, "Unknown user")
+        # when/then
+        self.assertIsNone(parse_rate_limit(error))
+
+
+class RateLimiterTestMixin:
+    def create_rate_limiter(self, **kwargs):
+        raise NotImplementedError()
+
+    def test_should_limit_per_user(self):
+        # given
+        rate_limiter = self.create_rate_limiter(
+            global_limit=100, user_limit=2, user_period=3600
+        )
+        # when
+        results = [rate_limiter.reserve(123) for _ in range(3)]
+        # then
+        self.assertEqual(results[:2], [0, 0])
+        self.assertGreater(results[2], 0)
+        self.assertEqual(rate_limiter.reserve(987), 0)
+
+    def test_should_limit_globally(self):
+        # given
+        rate_limiter = self.create_rate_limiter(
+            global_limit=2, user_limit=100, user_period=3600
+        )
+        rate_limiter.GLOBAL_PERIOD = 3600
+        # when
+        results = [rate_limiter.reserve(uid) for uid in range(1, 4)]
+        # then
+        self.assertEqual(results[:2], [0, 0])
+        self.assertGreater(results[2], 0)
+
+    def test_should_block_user_after_rate_limit(self):
+        # given
+        rate_limiter = self.create_rate_limiter(
+            global_limit=100, user_limit=100, user_period=3600
+        )
+        # when
+        rate_limiter.penalize(123, RateLimit(retry_after=60, is_global=False))
+        # then
+        self.assertGreater(rate_limiter.reserve(123), 0)
+        self.assertEqual(rate_limiter.reserve(987), 0)
+
+    def test_should_block_all_after_global_rate_limit(self):
+        # given
+        rate_limiter = self.create_rate_limiter(
+            global_limit=100, user_limit=100, user_period=3600
+        )
+        # when
+        rate_limiter.penalize(123, RateLimit(retry_after=60, is_global=True))
+        # then
+        self.assertGreater(rate_limiter.reserve(987), 0)
+
+    def test_should_reserve_global_tokens_for_high_priority(self):
+        # given
+        rate_limiter = self.create_rate_limiter(
+            global_limit=4, user_limit=100, user_period=3600, priority_reserved=2
+        )
+        rate_limiter.GLOBAL_PERIOD = 3600
+        # when
+        results = [rate_limiter.reserve(uid) for uid in range(1, 4)]
+        results_high = [
+            rate_limiter.reserve(uid, high_priority=True) for uid in range(4, 7)
+        ]
+        # then
+        self.assertEqual(results[:2], [0, 0])
+        self.assertGreater(results[2], 0)
+        self.assertEqual(results_high[:2], [0, 0])
+        self.assertGreater(results_high[2], 0)
+
+
+class TestLocalRateLimiter(RateLimiterTestMixin, TestCase):
+    def create_rate_limiter(self, **kwargs):
+        return LocalRateLimiter(**kwargs)
+
+    def test_should_refill_tokens_over_time(self):
+        # given
+        rate_limiter = self.create_rate_limiter(
+            global_limit=100, user_limit=1, user_period=0.05
+        )
+        rate_limiter.reserve(123)
+        # when
+        rate_limiter.acquire(123)
+        # then
+        self.assertGreater(rate_limiter.reserve(123), 0)
+
+
+class TestCacheRateLimiter(RateLimiterTestMixin, TestCase):
+    def create_rate_limiter(self, **kwargs):
+        rate_limiter = CacheRateLimiter(**kwargs)
+        rate_limiter.CACHE_KEY_PREFIX = f"TEST_{uuid.uuid4().hex}"
+        return rate_limiter
+
+    @patch(RATELIMIT_PATH + ".time")
+    def test_should_not_take_user_token_when_global_bucket_is_full(self, mock_time):
+        # given
+        mock_time.time.return_value = 1000.5
+        rate_limiter = self.create_rate_limiter(
+            global_limit=2, user_limit=5, user_period=10
+        )
+        user_key = f"{rate_limiter.CACHE_KEY_PREFIX}_user_2_100"
+        self.assertEqual(rate_limiter.reserve(1), 0)
+        self.assertEqual(rate_limiter.reserve(3), 0)
+        # when
+        wait = rate_limiter.reserve(2)
+        # then
+        self.assertAlmostEqual(wait, 0.5)
+        self.assertEqual(cache.get(user_key, 0), 0)
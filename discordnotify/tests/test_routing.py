@@ -0,0 +1,181 @@
+from unittest.mock import patch
+
+from django.contrib.auth.models import Group, User
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase
+
+from allianceauth.notifications.models import Notification
+from allianceauth.services.modules.discord.models import DiscordUser
+
+from ..caches import Membership, discord_uid_cache
+from ..routing import (
+    DIGEST,
+    DROP,
+    FORWARD,
+    REDIRECT,
+    PriorityRouter,
+    RuleAction,
+    RuleEngine,
+    compile_rules,
+)
+from ..signals import _forward_notifications
+
+ROUTING_PATH = "discordnotify.routing"
+SIGNALS_PATH = "discordnotify.signals"
+
+
+class TestPriorityRouter(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user("Bruce Wayne")
+
+    def test_should_route_by_level(self):
+        # given
+        router = PriorityRouter(levels=["danger"], groups=[], title_pattern="")
+        # when/then
+        self.assertTrue(router.is_high_priority(Notification(level="danger")))
+        self.assertFalse(router.is_high_priority(Notification(level="info")))
+
+    def test_should_route_by_title(self):
+        # given
+        router = PriorityRouter(levels=[], groups=[], title_pattern=r"^\[URGENT\]")
+        # when/then
+        self.assertTrue(router.is_high_priority(Notification(title="[URGENT] Ping")))
+        self.assertFalse(router.is_high_priority(Notification(title="Hi [URGENT]")))
+
+    def test_should_route_by_group(self):
+        # given
+        group = Group.objects.create(name="Fleet Commanders")
+        self.user.groups.add(group)
+        other_user = User.objects.create_user("Clark Kent")
+        router = PriorityRouter(
+            levels=[], groups=["Fleet Commanders"], title_pattern=""
+        )
+        # when
+        user_ids = router.high_priority_user_ids([self.user.id, other_user.id])
+        # then
+        self.assertSetEqual(user_ids, {self.user.id})
+        self.assertTrue(router.is_high_priority(Notification(user=self.user), user_ids))
+        self.assertFalse(
+            router.is_high_priority(Notification(user=other_user), user_ids)
+        )
+
+    @patch(SIGNALS_PATH + ".broadcast_detector")
+    @patch(SIGNALS_PATH + ".priority_batcher")
+    def test_should_dispatch_high_priority_notifications_separately(
+        self, mock_priority_batcher, mock_notification_batcher
+    ):
+        # given
+        DiscordUser.objects.create(user=self.user, uid=123)
+        discord_uid_cache.clear()
+        with patch(SIGNALS_PATH + ".DISCORDNOTIFY_ENABLED", False):
+            alert = Notification.objects.notify_user(
+                user=self.user, title="alert", level="danger"
+            )
+            info = Notification.objects.notify_user(user=self.user, title="info")
+        # when
+        _forward_notifications([alert, info])
+        # then
+        priority_payloads = mock_priority_batcher.extend.call_args[0][0]
+        self.assertEqual([obj.notification_id for obj in priority_payloads], [alert.id])
+        payloads = mock_notification_batcher.extend.call_args[0][0]
+        self.assertEqual([obj.notification_id for obj in payloads], [info.id])
+
+
+class TestCompileRules(TestCase):
+    def test_should_compile_rules(self):
+        # when
+        rules = compile_rules(
+            [
+                {"levels": ["info"], "title": "^Fleet", "action": "drop"},
+                {"groups": ["Members"], "action": "redirect", "channel": "987"},
+            ]
+        )
+        # then
+        self.assertEqual(rules[0].levels, frozenset({"info"}))
+        self.assertEqual(rules[0].result, RuleAction(DROP))
+        self.assertEqual(rules[1].result, RuleAction(REDIRECT, 987))
+
+    def test_should_reject_invalid_rules(self):
+        for config in [
+            {"action": "shout"},
+            {"action": "redirect"},
+            {"title": "(", "action": "drop"},
+            {"level": ["info"], "action": "drop"},
+            {"levels": "danger", "action": "drop"},
+            {"groups": {"Members"}, "action": "drop"},
+            {"states": None, "action": "drop"},
+        ]:
+            with self.subTest(config=config), self.assertRaises(ImproperlyConfigured):
+                compile_rules([config])
+
+
+class TestRuleEngine(TestCase):
+    def test_should_forward_when_no_rule_matches(self):
+        # given
+        engine = RuleEngine(compile_rules([{"levels": ["info"], "action": "drop"}]))
+        # when/then
+        self.assertEqual(engine.decide("danger", "title"), RuleAction(FORWARD))
+
+    def test_should_apply_first_matching_rule(self):
+        # given
+        engine = RuleEngine(
+            compile_rules(
+                [
+                    {"title": "^Fleet", "action": "digest"},
+                    {"levels": ["info"], "action": "drop"},
+                    {"action": "redirect", "channel": 987},
+                ]
+            )
+        )
+        # when/then
+        self.assertEqual(engine.decide("info", "Fleet up"), RuleAction(DIGEST))
+        self.assertEqual(engine.decide("info", "Hello"), RuleAction(DROP))
+        self.assertEqual(engine.decide("danger", "Hello"), RuleAction(REDIRECT, 987))
+
+    def test_should_match_titles_in_order_of_rules(self):
+        # given
+        engine = RuleEngine(
+            compile_rules(
+                [
+                    {"title": "down$", "action": "digest"},
+                    {"title": "(?i)^fleet", "action": "drop"},
+                    {"title": r"(\w+) \1", "action": "redirect", "channel": 987},
+                    {"title": "Fleet|Structure", "action": "forward"},
+                ]
+            )
+        )
+        # when/then
+        self.assertEqual(engine.decide("info", "Fleet is down"), RuleAction(DIGEST))
+        self.assertEqual(engine.decide("info", "fleet up"), RuleAction(DROP))
+        self.assertEqual(engine.decide("info", "Hello world"), RuleAction(FORWARD))
+        self.assertEqual(engine.decide("info", "A hey hey"), RuleAction(REDIRECT, 987))
+        self.assertEqual(engine.decide("info", "Structure"), RuleAction(FORWARD))
+
+    def test_should_match_groups_and_states(self):
+        # given
+        engine = RuleEngine(
+            compile_rules(
+                [
+                    {"groups": ["Fleet Commanders"], "action": "digest"},
+                    {"states": ["Guest"], "action": "drop"},
+                ]
+            )
+        )
+        commander = Membership(groups=frozenset({"Fleet Commanders"}), state="Guest")
+        guest = Membership(groups=frozenset({"Miners"}), state="Guest")
+        member = Membership(groups=frozenset(), state="Member")
+        # when/then
+        self.assertEqual(engine.decide("info", "", commander), RuleAction(DIGEST))
+        self.assertEqual(engine.decide("info", "", guest), RuleAction(DROP))
+        self.assertEqual(engine.decide("info", "", member), RuleAction(FORWARD))
+
+    @patch(ROUTING_PATH + ".membership_cache")
+    def test_should_load_memberships_only_when_needed(self, mock_membership_cache):
+        # given
+        engine = RuleEngine(compile_rules([{"levels": ["info"], "action": "drop"}]))
+        notifications = [Notification(user_id=1, level="info", title="title")]
+        # when
+        actions = engine.decide_many(notifications)
+        # then
+        self.assertEqual(actions, [RuleAction(DROP)])
+        self.assertFalse(mock_membership_cache.get_many.called)
@@ -0,0 +1,153 @@
+import datetime as dt
+from unittest.mock import patch
+
+import pytz
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.utils import timezone
+
+from allianceauth.notifications.models import Notification
+from allianceauth.services.modules.discord.models import DiscordUser
+
+from ..models import DeliveryPreference, HeldNotification
+from ..scheduling import DeliveryScheduler, next_delivery_time
+from .utils import make_payload
+
+SIGNALS_PATH = "discordnotify.signals"
+
+
+def make_preference(**kwargs) -> DeliveryPreference:
+    params = {"timezone": "UTC", "min_interval": 0}
+    params.update(kwargs)
+    return DeliveryPreference(**params)
+
+
+class TestNextDeliveryTime(TestCase):
+    def test_should_deliver_now_without_restrictions(self):
+        # given
+        now = dt.datetime(2021, 6, 1, 12, 0, tzinfo=pytz.utc)
+        # when/then
+        self.assertEqual(next_delivery_time(make_preference(), now), now)
+
+    def test_should_deliver_at_end_of_quiet_hours(self):
+        # given
+        preference = make_preference(
+            quiet_hours_start=dt.time(9, 0), quiet_hours_end=dt.time(17, 0)
+        )
+        now = dt.datetime(2021, 6, 1, 12, 0, tzinfo=pytz.utc)
+        # when/then
+        self.assertEqual(
+            next_delivery_time(preference, now),
+            dt.datetime(2021, 6, 1, 17, 0, tzinfo=pytz.utc),
+        )
+
+    def test_should_deliver_now_outside_quiet_hours(self):
+        # given
+        preference = make_preference(
+            quiet_hours_start=dt.time(22, 0), quiet_hours_end=dt.time(7, 0)
+        )
+        now = dt.datetime(2021, 6, 1, 12, 0, tzinfo=pytz.utc)
+        # when/then
+        self.assertEqual(next_delivery_time(preference, now), now)
+
+    def test_should_handle_quiet_hours_spanning_midnight(self):
+        # given
+        preference = make_preference(
+            quiet_hours_start=dt.time(22, 0), quiet_hours_end=dt.time(7, 0)
+        )
+        before_midnight = dt.datetime(2021, 6, 1, 23, 0, tzinfo=pytz.utc)
+        after_midnight = dt.datetime(2021, 6, 2, 1, 0, tzinfo=pytz.utc)
+        expected = dt.datetime(2021, 6, 2, 7, 0, tzinfo=pytz.utc)
+        # when/then
+        self.assertEqual(next_delivery_time(preference, before_midnight), expected)
+        self.assertEqual(next_delivery_time(preference, after_midnight), expected)
+
+    def test_should_apply_quiet_hours_in_users_timezone(self):
+        # given
+        preference = make_preference(
+            quiet_hours_start=dt.time(22, 0),
+            quiet_hours_end=dt.time(7, 0),
+            timezone="America/New_York",
+        )
+        now = dt.datetime(2021, 6, 2, 4, 0, tzinfo=pytz.utc)  # 0:00 in New York
+        # when/then
+        self.assertEqual(
+            next_delivery_time(preference, now),
+            dt.datetime(2021, 6, 2, 11, 0, tzinfo=pytz.utc),
+        )
+
+    def test_should_deliver_after_min_interval(self):
+        # given
+        now = dt.datetime(2021, 6, 1, 12, 0, tzinfo=pytz.utc)
+        preference = make_preference(
+            min_interval=60, last_delivered_at=now - dt.timedelta(minutes=20)
+        )
+        # when/then
+        self.assertEqual(
+            next_delivery_time(preference, now), now + dt.timedelta(minutes=40)
+        )
+
+
+class TestDeliveryScheduler(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user_1 = User.objects.create_user("Bruce Wayne")
+        DiscordUser.objects.create(user=cls.user_1, uid=1)
+        cls.user_2 = User.objects.create_user("Lex Luthor")
+        DiscordUser.objects.create(user=cls.user_2, uid=2)
+        with patch(SIGNALS_PATH + ".DISCORDNOTIFY_ENABLED", False):
+            cls.notif_1 = Notification.objects.notify_user(cls.user_1, "title")
+            cls.notif_2 = Notification.objects.notify_user(cls.user_2, "title")
+
+    def setUp(self) -> None:
+        self.scheduler = DeliveryScheduler(enabled=True)
+
+    def test_should_hold_notifications_during_quiet_hours(self):
+        # given
+        now = timezone.now()
+        DeliveryPreference.objects.create(
+            user=self.user_1,
+            quiet_hours_start=(now - dt.timedelta(hours=1)).time(),
+            quiet_hours_end=(now + dt.timedelta(hours=1)).time(),
+            timezone="UTC",
+        )
+        payloads = [
+            make_payload(self.notif_1.id, discord_uid=1),
+            make_payload(self.notif_2.id, discord_uid=2),
+        ]
+        # when
+        result = self.scheduler.hold(payloads)
+        # then
+        self.assertEqual(result, payloads[1:])
+        held = HeldNotification.objects.get()
+        self.assertEqual(held.notification_id, self.notif_1.id)
+        self.assertGreater(held.release_at, now)
+
+    def test_should_hold_notifications_within_min_interval(self):
+        # given
+        preference = DeliveryPreference.objects.create(
+            user=self.user_1, min_interval=30
+        )
+        # when
+        first = self.scheduler.hold([make_payload(self.notif_1.id, discord_uid=1)])
+        second = self.scheduler.hold([make_payload(self.notif_1.id, discord_uid=1)])
+        # then
+        self.assertEqual(len(first), 1)
+        self.assertEqual(second, [])
+        preference.refresh_from_db()
+        self.assertEqual(
+            HeldNotification.objects.get().release_at,
+            preference.last_delivered_at + dt.timedelta(minutes=30),
+        )
+
+    def test_should_not_hold_when_disabled(self):
+        # given
+        DeliveryPreference.objects.create(user=self.user_1, min_interval=30)
+        scheduler = DeliveryScheduler(enabled=False)
+        payloads = [make_payload(self.notif_1.id, discord_uid=1)] * 2
+        # when
+        with self.assertNumQueries(0):
+            result = scheduler.hold(payloads)
+        # then
+        self.assertEqual(result, payloads)
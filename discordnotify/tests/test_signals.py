@@ -0,0 +1,153 @@
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from allianceauth.notifications import notify
+from allianceauth.notifications.models import Notification
+from allianceauth.services.modules.discord.models import DiscordUser
+
+from ..caches import NO_ACCOUNT, discord_uid_cache
+from ..routing import RuleEngine, compile_rules
+from ..signals import _forward_notifications
+
+CORE_PATH = "discordnotify.core"
+SIGNALS_PATH = "discordnotify.signals"
+
+
+@patch(SIGNALS_PATH + ".DISCORDNOTIFY_ENABLED", True)
+@patch(CORE_PATH + ".DISCORDNOTIFY_SUPERUSER_ONLY", False)
+@patch(SIGNALS_PATH + ".broadcast_detector")
+class TestForwardNewNotificationsOnCommit(TransactionTestCase):
+    def setUp(self) -> None:
+        discord_uid_cache.clear()
+        self.user_1 = User.objects.create_user("Bruce Wayne")
+        DiscordUser.objects.create(user=self.user_1, uid=123)
+        self.user_2 = User.objects.create_user("Clark Kent")
+        DiscordUser.objects.create(user=self.user_2, uid=987)
+
+    def test_should_forward_after_commit_as_one_batch(self, mock_batcher):
+        # when
+        with transaction.atomic():
+            notify(self.user_1, "hi")
+            notify(self.user_2, "hi")
+            notify(self.user_1, "hi again")
+            self.assertFalse(mock_batcher.extend.called)
+        # then
+        self.assertEqual(mock_batcher.extend.call_count, 1)
+        payloads = mock_batcher.extend.call_args[0][0]
+        self.assertListEqual([obj.discord_uid for obj in payloads], [123, 987, 123])
+
+    def test_should_not_forward_when_transaction_is_rolled_back(self, mock_batcher):
+        # when
+        try:
+            with transaction.atomic():
+                notify(self.user_1, "hi")
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        with transaction.atomic():
+            notify(self.user_2, "hi")
+        # then
+        self.assertEqual(mock_batcher.extend.call_count, 1)
+        payloads = mock_batcher.extend.call_args[0][0]
+        self.assertListEqual([obj.discord_uid for obj in payloads], [987])
+
+    def test_should_not_forward_from_rolled_back_savepoint(self, mock_batcher):
+        # when
+        with transaction.atomic():
+            notify(self.user_1, "hi")
+            try:
+                with transaction.atomic():
+                    notify(self.user_2, "hi")
+                    raise RuntimeError()
+            except RuntimeError:
+                pass
+        # then
+        payloads = [
+            obj for args, _ in mock_batcher.extend.call_args_list for obj in args[0]
+        ]
+        self.assertListEqual([obj.discord_uid for obj in payloads], [123])
+
+    def test_should_resolve_users_with_one_query(self, mock_batcher):
+        # given
+        notifications = [
+            Notification.objects.create(user=user, title="hi", message="hi")
+            for user in [self.user_1, self.user_2, self.user_1]
+        ]
+        mock_batcher.reset_mock()
+        discord_uid_cache.clear()
+        notifications = list(
+            Notification.objects.filter(pk__in=[obj.pk for obj in notifications])
+        )
+        # when
+        with CaptureQueriesContext(connection) as context:
+            _forward_notifications(notifications)
+        # then
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(len(mock_batcher.extend.call_args[0][0]), 3)
+
+
+@patch(SIGNALS_PATH + ".start_channel_forwarding_task")
+@patch(SIGNALS_PATH + ".digest_batcher")
+@patch(SIGNALS_PATH + ".broadcast_detector")
+class TestRoutingRules(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user("Bruce Wayne")
+        DiscordUser.objects.create(user=self.user, uid=123)
+        discord_uid_cache.clear()
+
+    def _notify(self, title: str) -> Notification:
+        with patch(SIGNALS_PATH + ".DISCORDNOTIFY_ENABLED", False):
+            return Notification.objects.notify_user(user=self.user, title=title)
+
+    def test_should_route_notifications_by_rules(
+        self,
+        mock_notification_batcher,
+        mock_digest_batcher,
+        mock_start_channel_forwarding_task,
+    ):
+        # given
+        engine = RuleEngine(
+            compile_rules(
+                [
+                    {"title": "^Spam", "action": "drop"},
+                    {"title": "^Market", "action": "digest"},
+                    {"title": "^Fleet", "action": "redirect", "channel": 987},
+                ]
+            )
+        )
+        spam = self._notify("Spam")
+        market = self._notify("Market order")
+        fleet = self._notify("Fleet up")
+        other = self._notify("Other")
+        # when
+        with patch(CORE_PATH + ".rule_engine", engine):
+            _forward_notifications([spam, market, fleet, other])
+        # then
+        payloads = mock_notification_batcher.extend.call_args[0][0]
+        self.assertEqual([obj.notification_id for obj in payloads], [other.id])
+        payloads = mock_digest_batcher.extend.call_args[0][0]
+        self.assertEqual([obj.notification_id for obj in payloads], [market.id])
+        channel_id, payloads = mock_start_channel_forwarding_task.call_args[0]
+        self.assertEqual(channel_id, 987)
+        self.assertEqual([obj.notification_id for obj in payloads], [fleet.id])
+
+    def test_should_redirect_for_users_without_discord_account(
+        self,
+        mock_notification_batcher,
+        mock_digest_batcher,
+        mock_start_channel_forwarding_task,
+    ):
+        # given
+        self.user.discord.delete()
+        engine = RuleEngine(compile_rules([{"action": "redirect", "channel": 987}]))
+        notif = self._notify("Fleet up")
+        # when
+        with patch(CORE_PATH + ".rule_engine", engine):
+            _forward_notifications([notif])
+        # then
+        _, payloads = mock_start_channel_forwarding_task.call_args[0]
+        self.assertEqual(payloads[0].discord_uid, NO_ACCOUNT)
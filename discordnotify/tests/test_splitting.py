@@ -0,0 +1,63 @@
+import math
+
+from django.test import TestCase
+
+from ..splitting import split_text
+
+
+class TestSplitText(TestCase):
+    def test_should_not_split_short_text(self):
+        self.assertListEqual(split_text("alpha bravo", 20), ["alpha bravo"])
+
+    def test_should_return_no_parts_for_empty_text(self):
+        self.assertListEqual(split_text("  ", 20), [])
+
+    def test_should_prefer_paragraphs(self):
+        # given
+        text = "alpha bravo\n\ncharlie\ndelta echo"
+        # when
+        parts = split_text(text, 20)
+        # then
+        self.assertListEqual(parts, ["alpha bravo", "charlie\ndelta echo"])
+
+    def test_should_break_at_lines_then_words(self):
+        # given
+        text = "alpha bravo charlie\ndelta echo foxtrot golf"
+        # when
+        parts = split_text(text, 20)
+        # then
+        self.assertListEqual(
+            parts, ["alpha bravo charlie", "delta echo foxtrot", "golf"]
+        )
+
+    def test_should_cut_words_longer_than_a_part(self):
+        self.assertListEqual(split_text("x" * 25, 10), ["x" * 10, "x" * 10, "x" * 5])
+
+    def test_should_not_break_too_early(self):
+        # given
+        text = "alpha\n\n" + "bravo charlie delta echo foxtrot"
+        # when
+        parts = split_text(text, 20)
+        # then
+        self.assertEqual(parts[0], "alpha\n\nbravo")
+
+    def test_should_truncate_last_part(self):
+        # given
+        text = "alpha bravo charlie delta echo foxtrot golf hotel"
+        # when
+        parts = split_text(text, 20, max_parts=2)
+        # then
+        self.assertEqual(len(parts), 2)
+        self.assertEqual(parts[1], "delta echo fox [...]")
+        self.assertLessEqual(len(parts[1]), 20)
+
+    def test_should_keep_all_content(self):
+        # given
+        words = [f"word{num}" for num in range(5000)]
+        text = "\n".join(" ".join(words[i : i + 7]) for i in range(0, 5000, 7))
+        # when
+        parts = split_text(text, 2048)
+        # then
+        self.assertTrue(all(len(part) <= 2048 for part in parts))
+        self.assertEqual(" ".join(" ".join(parts).split()), " ".join(words))
+        self.assertEqual(len(parts), math.ceil(len(text) / 2048))
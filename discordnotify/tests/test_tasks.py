@@ -0,0 +1,213 @@
+import datetime as dt
+from unittest.mock import patch
+
+from kombu.utils import json as kombu_json
+
+from django.contrib.auth.models import User
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from allianceauth.notifications.models import Notification
+from allianceauth.services.modules.discord.models import DiscordUser
+
+from ..core import resolve_payloads
+from ..models import DeliveryPreference, DeliveryRecord, HeldNotification
+from ..scheduling import DeliveryScheduler
+from ..tasks import (
+    BULK_TASK_PRIORITY,
+    PRIORITY_TASK_PRIORITY,
+    start_channel_forwarding_task,
+    start_forwarding_task,
+    task_prune_delivery_records,
+    task_release_held_notifications,
+)
+from .utils import make_payload
+
+SIGNALS_PATH = "discordnotify.signals"
+TASKS_PATH = "discordnotify.tasks"
+
+
+@patch(TASKS_PATH + ".DISCORDNOTIFY_DELIVERY_LOG_RETENTION", 30)
+@patch(TASKS_PATH + ".PRUNE_BATCH_SIZE", 2)
+class TestPruneDeliveryRecords(TestCase):
+    def test_should_delete_old_records_only(self):
+        # given
+        now = timezone.now()
+        for days in [31, 40, 50, 29, 1]:
+            DeliveryRecord.objects.create(
+                notification_id=days,
+                discord_uid=123,
+                status=DeliveryRecord.Status.SENT,
+                sent_at=now - dt.timedelta(days=days),
+            )
+        # when
+        task_prune_delivery_records()
+        # then
+        self.assertListEqual(
+            sorted(DeliveryRecord.objects.values_list("notification_id", flat=True)),
+            [1, 29],
+        )
+
+
+@patch(TASKS_PATH + ".task_forward_notifications_bulk.apply_async")
+class TestStartForwardingTask(TestCase):
+    @patch(TASKS_PATH + ".DISCORDNOTIFY_PRIORITY_QUEUE", "priority")
+    def test_should_start_high_priority_task_on_priority_queue(self, mock_apply_async):
+        # when
+        start_forwarding_task([make_payload(1)], high_priority=True)
+        # then
+        _, kwargs = mock_apply_async.call_args
+        self.assertEqual(kwargs["queue"], "priority")
+        self.assertEqual(kwargs["priority"], PRIORITY_TASK_PRIORITY)
+        self.assertTrue(kwargs["kwargs"]["high_priority"])
+
+    @patch(TASKS_PATH + ".DISCORDNOTIFY_BULK_QUEUE", "")
+    def test_should_start_normal_task_on_default_queue(self, mock_apply_async):
+        # when
+        start_forwarding_task([make_payload(1)])
+        # then
+        _, kwargs = mock_apply_async.call_args
+        self.assertNotIn("queue", kwargs)
+        self.assertEqual(kwargs["priority"], BULK_TASK_PRIORITY)
+        self.assertLess(PRIORITY_TASK_PRIORITY, BULK_TASK_PRIORITY)
+        self.assertFalse(kwargs["kwargs"]["high_priority"])
+
+    def test_should_pass_payloads_which_survive_serialization(self, mock_apply_async):
+        # given
+        payload = make_payload(1)._replace(parts_sent=2)
+        # when
+        start_forwarding_task([payload])
+        # then
+        _, kwargs = mock_apply_async.call_args
+        task_kwargs = kombu_json.loads(kombu_json.dumps(kwargs["kwargs"]))
+        self.assertEqual(resolve_payloads(task_kwargs["payloads"]), [payload])
+
+    @patch(TASKS_PATH + ".task_forward_notifications_to_channel.apply_async")
+    def test_should_pass_channel_payloads_which_survive_serialization(
+        self, mock_apply_async_channel, mock_apply_async
+    ):
+        # given
+        payload = make_payload(1)
+        # when
+        start_channel_forwarding_task(987, [payload])
+        # then
+        _, kwargs = mock_apply_async_channel.call_args
+        task_kwargs = kombu_json.loads(kombu_json.dumps(kwargs["kwargs"]))
+        self.assertEqual(resolve_payloads(task_kwargs["payloads"]), [payload])
+
+
+class TestReleaseHeldNotifications(TransactionTestCase):
+    def setUp(self) -> None:
+        self.user_1 = User.objects.create_user("Bruce Wayne")
+        DiscordUser.objects.create(user=self.user_1, uid=1)
+        self.user_2 = User.objects.create_user("Lex Luthor")
+        DiscordUser.objects.create(user=self.user_2, uid=2)
+        with patch(SIGNALS_PATH + ".DISCORDNOTIFY_ENABLED", False):
+            self.notif_1 = Notification.objects.notify_user(self.user_1, "title")
+            self.notif_2 = Notification.objects.notify_user(self.user_2, "title")
+
+    @patch(TASKS_PATH + ".DISCORDNOTIFY_BATCH_SIZE", 1)
+    @patch(TASKS_PATH + ".DISCORDNOTIFY_SCHEDULER_RELEASE_LIMIT", 2)
+    @patch(TASKS_PATH + ".start_forwarding_task")
+    def test_should_release_due_notifications_in_order(
+        self, mock_start_forwarding_task
+    ):
+        # given
+        preference = DeliveryPreference.objects.create(
+            user=self.user_1, min_interval=30
+        )
+        now = timezone.now()
+        for minutes, notification, discord_uid in [
+            (-5, self.notif_2, 2),
+            (-10, self.notif_1, 1),
+            (-1, self.notif_1, 1),
+            (5, self.notif_2, 2),
+        ]:
+            HeldNotification.objects.create(
+                notification=notification,
+                discord_uid=discord_uid,
+                release_at=now + dt.timedelta(minutes=minutes),
+            )
+        # when
+        task_release_held_notifications()
+        # then
+        payloads = [args[0] for args, _ in mock_start_forwarding_task.call_args_list]
+        self.assertListEqual(payloads, [[[self.notif_1.id, 1]], [[self.notif_2.id, 2]]])
+        self.assertEqual(HeldNotification.objects.count(), 2)
+        preference.refresh_from_db()
+        self.assertIsNotNone(preference.last_delivered_at)
+
+    @patch(TASKS_PATH + ".start_forwarding_task")
+    def test_should_release_digest_lane_as_digest(self, mock_start_forwarding_task):
+        # given
+        DeliveryPreference.objects.create(user=self.user_1, min_interval=30)
+        DeliveryPreference.objects.create(user=self.user_2, min_interval=30)
+        scheduler = DeliveryScheduler(enabled=True)
+        scheduler.hold([make_payload(self.notif_1.id, discord_uid=1)])
+        scheduler.hold([make_payload(self.notif_1.id, discord_uid=1)])
+        scheduler.hold([make_payload(self.notif_2.id, discord_uid=2)], digest=True)
+        scheduler.hold([make_payload(self.notif_2.id, discord_uid=2)], digest=True)
+        self.assertListEqual(
+            sorted(HeldNotification.objects.values_list("discord_uid", "lane")),
+            [(1, HeldNotification.Lane.NORMAL), (2, HeldNotification.Lane.DIGEST)],
+        )
+        HeldNotification.objects.update(release_at=timezone.now())
+        # when
+        task_release_held_notifications()
+        # then
+        calls = sorted(
+            (args[0], kwargs["digest"])
+            for args, kwargs in mock_start_forwarding_task.call_args_list
+        )
+        self.assertListEqual(
+            calls, [([[self.notif_1.id, 1]], False), ([[self.notif_2.id, 2]], True)]
+        )
+
+
+@patch(TASKS_PATH + ".task_forward_notifications_bulk")
+@patch(TASKS_PATH + ".inprocess_sender")
+class TestStartForwardingTaskInProcess(TestCase):
+    def test_should_forward_in_process(
+        self, mock_inprocess_sender, mock_task_forward_notifications_bulk
+    ):
+        # given
+        mock_inprocess_sender.submit.return_value = True
+        # when
+        start_forwarding_task([make_payload(1)])
+        # then
+        _, kwargs = mock_inprocess_sender.submit.call_args
+        self.assertEqual(kwargs["payloads"], [list(make_payload(1))])
+        self.assertFalse(mock_task_forward_notifications_bulk.apply_async.called)
+
+    def test_should_start_task_when_rejected(
+        self, mock_inprocess_sender, mock_task_forward_notifications_bulk
+    ):
+        # given
+        mock_inprocess_sender.submit.return_value = False
+        # when
+        start_forwarding_task([make_payload(1)])
+        # then
+        self.assertTrue(mock_task_forward_notifications_bulk.apply_async.called)
+
+    def test_should_start_task_for_retries(
+        self, mock_inprocess_sender, mock_task_forward_notifications_bulk
+    ):
+        # when
+        start_forwarding_task([make_payload(1)], attempt=1, countdown=10)
+        # then
+        self.assertFalse(mock_inprocess_sender.submit.called)
+        self.assertTrue(mock_task_forward_notifications_bulk.apply_async.called)
+
+    @patch(TASKS_PATH + ".DISCORDNOTIFY_PRIORITY_QUEUE", "priority")
+    def test_should_start_priority_task_for_high_priority(
+        self, mock_inprocess_sender, mock_task_forward_notifications_bulk
+    ):
+        # given
+        mock_inprocess_sender.submit.return_value = True
+        # when
+        start_forwarding_task([make_payload(1)], high_priority=True)
+        # then
+        self.assertFalse(mock_inprocess_sender.submit.called)
+        _, kwargs = mock_task_forward_notifications_bulk.apply_async.call_args
+        self.assertEqual(kwargs["queue"], "priority")
+        self.assertTrue(kwargs["kwargs"]["high_priority"])
@@ -0,0 +1,79 @@
+from unittest.mock import patch
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
+
+from allianceauth.notifications import notify
+
+from .. import views
+
+VIEWS_PATH = "discordnotify.views"
+
+
+class TestViews(TestCase):
+    @patch(VIEWS_PATH + ".notify", wraps=notify)
+    @patch(VIEWS_PATH + ".messages_plus")
+    def test_should_create_notification_and_send_message(
+        self, spy_messages_plus, spy_notify
+    ):
+        # given
+        user = User.objects.create_user("Bruce Wayne")
+        factory = RequestFactory()
+        request = factory.get(reverse("discordnotify:send_test_notification"))
+        request.user = user
+        # when
+        response = views.send_test_notification(request)
+        # then
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, reverse("authentication:dashboard"))
+        self.assertTrue(spy_notify.called)
+        self.assertTrue(spy_messages_plus.success.called)
+
+
+class TestMetricsView(TestCase):
+    def setUp(self) -> None:
+        self.factory = RequestFactory()
+
+    def test_should_return_metrics_for_superuser(self):
+        # given
+        request = self.factory.get(reverse("discordnotify:metrics"))
+        request.user = User.objects.create_superuser("Bruce Wayne")
+        # when
+        response = views.metrics(request)
+        # then
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"discordnotify_notifications_seen_total", response.content)
+
+    def test_should_deny_access_for_normal_user(self):
+        # given
+        request = self.factory.get(reverse("discordnotify:metrics"))
+        request.user = User.objects.create_user("Bruce Wayne")
+        # when
+        response = views.metrics(request)
+        # then
+        self.assertEqual(response.status_code, 403)
+
+    @patch(VIEWS_PATH + ".DISCORDNOTIFY_METRICS_TOKEN", "secret")
+    def test_should_return_metrics_with_valid_token(self):
+        # given
+        request = self.factory.get(
+            reverse("discordnotify:metrics"), HTTP_AUTHORIZATION="Bearer secret"
+        )
+        request.user = AnonymousUser()
+        # when
+        response = views.metrics(request)
+        # then
+        self.assertEqual(response.status_code, 200)
+
+    @patch(VIEWS_PATH + ".DISCORDNOTIFY_METRICS_TOKEN", "secret")
+    def test_should_deny_access_with_invalid_token(self):
+        # given
+        request = self.factory.get(
+            reverse("discordnotify:metrics"), HTTP_AUTHORIZATION="Bearer wrong"
+        )
+        request.user = AnonymousUser()
+        # when
+        response = views.metrics(request)
+        # then
+        self.assertEqual(response.status_code, 403)
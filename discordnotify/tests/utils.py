@@ -0,0 +1,26 @@
+import grpc
+
+from ..core import NotificationPayload
+
+
+class FakeRpcError(grpc.RpcError):
+    def __init__(self, code: grpc.StatusCode, details: str = "") -> None:
+        self._code = code
+        self._details = details
+
+    def code(self):
+        return self._code
+
+    def details(self):
+        return self._details
+
+
+def make_payload(notification_id: int, discord_uid: int = 123):
+    return NotificationPayload(
+        notification_id=notification_id,
+        discord_uid=discord_uid,
+        title="title",
+        message="message",
+        level="info",
+        timestamp="2021-05-24T12:00:00+00:00",
+    )
@@ -5,5 +5,6 @@ from . import views
 app_name = "discordnotify"
 
 urlpatterns = [
+    path("metrics", views.metrics, name="metrics"),
     path("test", views.send_test_notification, name="send_test_notification"),
 ]
@@ -1,9 +1,15 @@
+import hmac
+
 from django.contrib.auth.decorators import login_required
+from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import redirect
 
 from allianceauth.notifications import notify
 from app_utils.messages import messages_plus
 
+from .app_settings import DISCORDNOTIFY_METRICS_TOKEN
+from .metrics import CONTENT_TYPE, registry
+
 
 @login_required
 def send_test_notification(request):
@@ -16,3 +22,23 @@ def send_test_notification(request):
         request, f"Discord Notify: Test notification was created for {request.user}"
     )
     return redirect("authentication:dashboard")
+
+
+def metrics(request):
+    """Metrics in the Prometheus text format.
+
+    Accessible for superusers and with the bearer token DISCORDNOTIFY_METRICS_TOKEN.
+    """
+    if not request.user.is_superuser and not _has_valid_token(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type=CONTENT_TYPE)
+
+
+def _has_valid_token(request) -> bool:
+    if not DISCORDNOTIFY_METRICS_TOKEN:
+        return False
+    auth_header = request.META.get("HTTP_AUTHORIZATION", "")
+    scheme, _, token = auth_header.partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(
+        token.strip().encode(), DISCORDNOTIFY_METRICS_TOKEN.encode()
+    )